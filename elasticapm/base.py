@@ -50,12 +50,14 @@ import elasticapm
 from elasticapm.conf import Config, VersionedConfig, constants
 from elasticapm.conf.constants import ERROR
 from elasticapm.metrics.base_metrics import MetricsRegistry
+from elasticapm.profiler import SamplingProfiler
 from elasticapm.traces import DroppedSpan, Tracer, execution_context
 from elasticapm.utils import cgroup, cloud, compat, is_master_process, stacks, varmap
 from elasticapm.utils.disttracing import TraceParent
 from elasticapm.utils.encoding import enforce_label_format, keyword_field, shorten, transform
 from elasticapm.utils.logging import get_logger
 from elasticapm.utils.module_import import import_string
+from elasticapm.watchdog import SlowTransactionWatchdog
 
 __all__ = ("Client",)
 
@@ -93,6 +95,9 @@ class Client(object):
 
     logger = get_logger("elasticapm")
 
+    # names of functions whose frames _get_stack_info_for_trace needs, see _get_stack_snapshot_for_trace
+    _span_frames_kept_for_functions = ()
+
     def __init__(self, config=None, **inline) -> None:
         # configure loggers first
         cls = self.__class__
@@ -180,13 +185,11 @@ class Client(object):
             skip_modules = ("elasticapm.",)
 
         self.tracer = Tracer(
-            frames_collector_func=lambda: list(
-                stacks.iter_stack_frames(
-                    start_frame=inspect.currentframe(), skip_top_modules=skip_modules, config=self.config
-                )
+            frames_collector_func=lambda: self._get_stack_snapshot_for_trace(
+                start_frame=inspect.currentframe(), skip_top_modules=skip_modules
             ),
             frames_processing_func=lambda frames: self._get_stack_info_for_trace(
-                frames,
+                stacks.iter_stack_snapshot(frames),
                 library_frame_context_lines=self.config.source_lines_span_library_frames,
                 in_app_frame_context_lines=self.config.source_lines_span_app_frames,
                 with_locals=self.config.collect_local_variables in ("all", "transactions"),
@@ -204,17 +207,33 @@ class Client(object):
             config=self.config,
             agent=self,
         )
-        self.include_paths_re = stacks.get_path_regex(self.config.include_paths) if self.config.include_paths else None
-        self.exclude_paths_re = stacks.get_path_regex(self.config.exclude_paths) if self.config.exclude_paths else None
+        self._paths_re = (None, None, None, None)
         self.metrics = MetricsRegistry(self)
         for path in self.config.metrics_sets:
             self.metrics.register(path)
         if self.config.breakdown_metrics:
             self.metrics.register("elasticapm.metrics.sets.breakdown.BreakdownMetricSet")
+        if self.config.transport_metrics:
+            self.metrics.register("elasticapm.metrics.sets.transport.TransportMetricSet")
         if self.config.prometheus_metrics:
             self.metrics.register("elasticapm.metrics.sets.prometheus.PrometheusMetrics")
+        if self.config.transaction_max_spans_window > timedelta(seconds=0):
+            self.metrics.register("elasticapm.metrics.sets.long_transaction.LongTransactionMetricSet")
         if self.config.metrics_interval:
             self._thread_managers["metrics"] = self.metrics
+        if self.config.profiling_inferred_spans_enabled:
+            self.tracer.profiler = SamplingProfiler(self)
+            self._thread_managers["profiler"] = self.tracer.profiler
+        if self.config.slow_transaction_threshold > timedelta(seconds=0):
+            self.tracer.watchdog = SlowTransactionWatchdog(self)
+            self._thread_managers["watchdog"] = self.tracer.watchdog
+        if self.config.event_loop_block_threshold > timedelta(seconds=0):
+            from elasticapm.contrib.asyncio.loop_monitor import EventLoopMonitor
+
+            self.loop_monitor = self.tracer.loop_monitor = EventLoopMonitor(self)
+            self._thread_managers["loop_monitor"] = self.loop_monitor
+        else:
+            self.loop_monitor = None
         compat.atexit_register(self.close)
         if self.config.central_config:
             self._thread_managers["config"] = self.config
@@ -295,6 +314,17 @@ class Client(object):
             flush = False
         self._transport.queue(event_type, data, flush)
 
+    def get_transport_stats(self):
+        """
+        Returns a snapshot of statistics about the events handled by the transport, like the number of queued,
+        sent and dropped events, or the duration of requests to the APM Server. Counters are totals since the
+        transport was started.
+
+        :return: a dictionary of statistics, or None if the transport doesn't provide any
+        """
+        get_stats = getattr(self._transport, "get_stats", None)
+        return get_stats() if get_stats else None
+
     def begin_transaction(
         self,
         transaction_type: str,
@@ -302,6 +332,8 @@ class Client(object):
         start: Optional[float] = None,
         auto_activate: bool = True,
         links: Optional[Sequence[TraceParent]] = None,
+        name: Optional[str] = None,
+        url: Optional[str] = None,
     ):
         """
         Register the start of a transaction on the client
@@ -311,11 +343,21 @@ class Client(object):
         :param start: override the start timestamp, mostly useful for testing
         :param auto_activate: whether to set this transaction in execution_context
         :param links: a sequence of traceparent objects to causally link this transaction with
+        :param name: name of the transaction, if it is known when the transaction starts.
+                     Sampling with transaction_sample_target takes it into account.
+        :param url: URL path of the request, if the transaction is an HTTP request. It is matched against
+                    transaction_sampling_rules.
         :return: the started transaction object
         """
         if self.config.is_recording:
             return self.tracer.begin_transaction(
-                transaction_type, trace_parent=trace_parent, start=start, auto_activate=auto_activate, links=links
+                transaction_type,
+                trace_parent=trace_parent,
+                start=start,
+                auto_activate=auto_activate,
+                links=links,
+                name=name,
+                url=url,
             )
 
     def end_transaction(self, name=None, result="", duration=None):
@@ -618,6 +660,7 @@ class Client(object):
             # parent id might already be set in the handler
             event_data.setdefault("parent_id", span.id if span else transaction.id)
             event_data["transaction_id"] = transaction.id
+            transaction.error_captured = True
             event_data["transaction"] = {
                 "sampled": transaction.is_sampled,
                 "type": transaction.transaction_type,
@@ -647,6 +690,45 @@ class Client(object):
                 return True
         return False
 
+    @property
+    def include_paths_re(self):
+        return self._get_paths_re()[0]
+
+    @property
+    def exclude_paths_re(self):
+        return self._get_paths_re()[1]
+
+    def _get_paths_re(self):
+        """
+        Returns the compiled include_paths and exclude_paths, recompiling them if the settings changed
+        """
+        include_paths, exclude_paths = self.config.include_paths, self.config.exclude_paths
+        cached_include_paths, cached_exclude_paths, include_paths_re, exclude_paths_re = self._paths_re
+        if include_paths is not cached_include_paths or exclude_paths is not cached_exclude_paths:
+            include_paths_re = stacks.get_path_regex(include_paths) if include_paths else None
+            exclude_paths_re = stacks.get_path_regex(exclude_paths) if exclude_paths else None
+            self._paths_re = (include_paths, exclude_paths, include_paths_re, exclude_paths_re)
+            # cached frame infos contain library_frame, which depends on the paths
+            stacks.clear_frame_info_cache()
+        return include_paths_re, exclude_paths_re
+
+    def _get_stack_snapshot_for_trace(self, start_frame, skip_top_modules):
+        """
+        Captures the stack when a span starts. Only a snapshot of the code objects and line numbers is taken,
+        which is turned into frames by _get_stack_info_for_trace if the span is long enough to need them.
+        """
+        if self.config.collect_local_variables in ("all", "transactions"):
+            # local variables are only read when the span ends, the frames have to be kept alive until then
+            return list(
+                stacks.iter_stack_frames(start_frame=start_frame, skip_top_modules=skip_top_modules, config=self.config)
+            )
+        return stacks.get_stack_snapshot(
+            start_frame=start_frame,
+            skip_top_modules=skip_top_modules,
+            config=self.config,
+            keep_frames_of=self._span_frames_kept_for_functions,
+        )
+
     def _get_stack_info_for_trace(
         self,
         frames,
@@ -342,6 +342,33 @@ class PrecisionValidator(object):
         return rounded
 
 
+def _sampling_rule(value):
+    """
+    Parses a `pattern=rate` or `pattern=limit/s` rule of TRANSACTION_SAMPLING_RULES into a
+    (pattern, rate, limit) tuple
+    """
+    if isinstance(value, tuple):
+        return value
+    pattern, _, rule = value.rpartition("=")
+    pattern, rule = pattern.strip(), rule.strip()
+    try:
+        if not pattern:
+            raise ValueError()
+        if rule.endswith("/s"):
+            limit = float(rule[:-2])
+            if limit < 0:
+                raise ValueError()
+            return (pattern, None, limit)
+        rate = float(rule)
+        if not 0 <= rate <= 1:
+            raise ValueError()
+        return (pattern, rate, None)
+    except ValueError:
+        raise ConfigurationError(
+            "TRANSACTION_SAMPLING_RULES: {} is not a valid rule".format(value), "TRANSACTION_SAMPLING_RULES"
+        )
+
+
 size_validator = UnitValidator(
     r"^(\d+)(b|kb|mb|gb)$", r"\d+(b|KB|MB|GB)", {"b": 1, "kb": 1024, "mb": 1024 * 1024, "gb": 1024 * 1024 * 1024}
 )
@@ -366,6 +393,27 @@ class ExcludeRangeValidator(object):
         return value
 
 
+class RangeValidator(object):
+    """
+    Ensures that a number is within a range. Bounds that are None are not checked.
+    """
+
+    def __init__(self, min_value=None, max_value=None, min_exclusive=False) -> None:
+        self.min_value = min_value
+        self.max_value = max_value
+        self.min_exclusive = min_exclusive
+
+    def __call__(self, value, field_name):
+        if self.min_value is not None and (value <= self.min_value if self.min_exclusive else value < self.min_value):
+            raise ConfigurationError(
+                "{}={} must be {} {}".format(field_name, value, ">" if self.min_exclusive else ">=", self.min_value),
+                field_name,
+            )
+        if self.max_value is not None and value > self.max_value:
+            raise ConfigurationError("{}={} must be <= {}".format(field_name, value, self.max_value), field_name)
+        return value
+
+
 class FileIsReadableValidator(object):
     def __call__(self, value, field_name):
         value = os.path.normpath(value)
@@ -652,16 +700,37 @@ class Config(_ConfigBase):
         default=timedelta(seconds=30),
     )
     breakdown_metrics = _BoolConfigValue("BREAKDOWN_METRICS", default=True)
+    transport_metrics = _BoolConfigValue("TRANSPORT_METRICS", default=False)
     prometheus_metrics = _BoolConfigValue("PROMETHEUS_METRICS", default=False)
     prometheus_metrics_prefix = _ConfigValue("PROMETHEUS_METRICS_PREFIX", default="prometheus.metrics.")
     disable_metrics = _ListConfigValue("DISABLE_METRICS", type=starmatch_to_regex, default=[])
     central_config = _BoolConfigValue("CENTRAL_CONFIG", default=True)
     api_request_size = _ConfigValue("API_REQUEST_SIZE", type=int, validators=[size_validator], default=768 * 1024)
     api_request_time = _DurationConfigValue("API_REQUEST_TIME", default=timedelta(seconds=10))
+    api_request_max_inflight = _ConfigValue(
+        "API_REQUEST_MAX_INFLIGHT", type=int, validators=[RangeValidator(min_value=0)], default=1
+    )
+    transport_spool_dir = _ConfigValue("TRANSPORT_SPOOL_DIR", default="")
+    transport_spool_max_size = _ConfigValue(
+        "TRANSPORT_SPOOL_MAX_SIZE", type=int, validators=[size_validator], default=100 * 1024 * 1024
+    )
+    transport_spool_max_age = _DurationConfigValue("TRANSPORT_SPOOL_MAX_AGE", default=timedelta(minutes=60))
+    transport_memory_budget = _ConfigValue(
+        "TRANSPORT_MEMORY_BUDGET", type=int, validators=[size_validator], default=64 * 1024 * 1024
+    )
     transaction_sample_rate = _ConfigValue(
         "TRANSACTION_SAMPLE_RATE", type=float, validators=[PrecisionValidator(4, 0.0001)], default=1.0
     )
+    transaction_sample_target = _ConfigValue("TRANSACTION_SAMPLE_TARGET", type=float, default=0.0)
+    transaction_sampling_rules = _ListConfigValue("TRANSACTION_SAMPLING_RULES", type=_sampling_rule, default=[])
     transaction_max_spans = _ConfigValue("TRANSACTION_MAX_SPANS", type=int, default=500)
+    transaction_max_spans_window = _DurationConfigValue("TRANSACTION_MAX_SPANS_WINDOW", default=timedelta(seconds=0))
+    tail_sampling = _BoolConfigValue("TAIL_SAMPLING", default=False)
+    tail_sampling_rate = _ConfigValue(
+        "TAIL_SAMPLING_RATE", type=float, validators=[PrecisionValidator(4)], default=0.01
+    )
+    tail_sampling_latency_percentile = _ConfigValue("TAIL_SAMPLING_LATENCY_PERCENTILE", type=float, default=99.0)
+    tail_sampling_buffer_size = _ConfigValue("TAIL_SAMPLING_BUFFER_SIZE", type=int, default=10000)
     stack_trace_limit = _ConfigValue("STACK_TRACE_LIMIT", type=int, default=50)
     span_frames_min_duration = _DurationConfigValue(
         "SPAN_FRAMES_MIN_DURATION", default=timedelta(seconds=0.005), unitless_factor=0.001
@@ -678,10 +747,28 @@ class Config(_ConfigBase):
         "SPAN_COMPRESSION_SAME_KIND_MAX_DURATION",
         default=timedelta(seconds=0),
     )
+    span_compression_window_size = _ConfigValue("SPAN_COMPRESSION_WINDOW_SIZE", type=int, default=1)
     exit_span_min_duration = _DurationConfigValue(
         "EXIT_SPAN_MIN_DURATION",
         default=timedelta(seconds=0),
     )
+    defer_span_serialization = _BoolConfigValue("DEFER_SPAN_SERIALIZATION", default=False)
+    profiling_inferred_spans_enabled = _BoolConfigValue("PROFILING_INFERRED_SPANS_ENABLED", default=False)
+    profiling_inferred_spans_sampling_interval = _DurationConfigValue(
+        "PROFILING_INFERRED_SPANS_SAMPLING_INTERVAL", default=timedelta(seconds=0.05)
+    )
+    profiling_inferred_spans_min_duration = _DurationConfigValue(
+        "PROFILING_INFERRED_SPANS_MIN_DURATION", default=timedelta(seconds=0)
+    )
+    profiling_inferred_spans_max_overhead = _ConfigValue(
+        "PROFILING_INFERRED_SPANS_MAX_OVERHEAD",
+        type=float,
+        validators=[RangeValidator(min_value=0, max_value=1, min_exclusive=True)],
+        default=0.01,
+    )
+    slow_transaction_threshold = _DurationConfigValue("SLOW_TRANSACTION_THRESHOLD", default=timedelta(seconds=0))
+    slow_transaction_max_snapshots = _ConfigValue("SLOW_TRANSACTION_MAX_SNAPSHOTS", type=int, default=1)
+    event_loop_block_threshold = _DurationConfigValue("EVENT_LOOP_BLOCK_THRESHOLD", default=timedelta(seconds=0))
     collect_local_variables = _ConfigValue("COLLECT_LOCAL_VARIABLES", default="errors")
     source_lines_error_app_frames = _ConfigValue("SOURCE_LINES_ERROR_APP_FRAMES", type=int, default=5)
     source_lines_error_library_frames = _ConfigValue("SOURCE_LINES_ERROR_LIBRARY_FRAMES", type=int, default=5)
@@ -839,6 +926,14 @@ class VersionedConfig(ThreadManager):
     def config_version(self):
         return self._version
 
+    @property
+    def current_config(self):
+        """
+        The Config object that is currently in effect. It is replaced on every update or reset,
+        so it can be used to invalidate values that are derived from the configuration.
+        """
+        return self._config
+
     def update_config(self):
         if not self.transport:
             logger.warning("No transport set for config updates, skipping")
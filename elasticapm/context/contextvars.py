@@ -42,7 +42,9 @@ if TYPE_CHECKING:
 
 class ContextVarsContext(BaseContext):
     elasticapm_transaction_var = contextvars.ContextVar("elasticapm_transaction_var")
-    elasticapm_spans_var = contextvars.ContextVar("elasticapm_spans_var", default=())
+    # the stack of active spans, as a linked list of (span, parent node) tuples. Pushing and popping
+    # create a new node or return the parent node, so contexts copied for new tasks are never modified.
+    elasticapm_spans_var = contextvars.ContextVar("elasticapm_spans_var", default=None)
 
     def get_transaction(self, clear: bool = False) -> "elasticapm.traces.Transaction":
         """
@@ -70,7 +72,7 @@ class ContextVarsContext(BaseContext):
         Get the active span for the current execution context.
         """
         spans = self.elasticapm_spans_var.get()
-        return spans[-1] if spans else None
+        return spans[0] if spans else None
 
     def set_span(self, span: "elasticapm.traces.Span") -> None:
         """
@@ -78,8 +80,7 @@ class ContextVarsContext(BaseContext):
 
         The previously-activated span will be saved to be re-activated later.
         """
-        spans = self.elasticapm_spans_var.get()
-        self.elasticapm_spans_var.set(spans + (span,))
+        self.elasticapm_spans_var.set((span, self.elasticapm_spans_var.get()))
 
     def unset_span(self, clear_all: bool = False) -> "elasticapm.traces.Span":
         """
@@ -93,11 +94,8 @@ class ContextVarsContext(BaseContext):
         spans = self.elasticapm_spans_var.get()
         span = None
         if spans:
-            span = spans[-1]
-            if clear_all:
-                self.elasticapm_spans_var.set(())
-            else:
-                self.elasticapm_spans_var.set(spans[0:-1])
+            span, parent = spans
+            self.elasticapm_spans_var.set(None if clear_all else parent)
         return span
 
 
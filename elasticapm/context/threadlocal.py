@@ -42,7 +42,8 @@ class ThreadLocalContext(BaseContext):
     thread_local = threading.local()
     # TODO why do we getattr on every access if the variables are defined here?
     thread_local.transaction = None
-    thread_local.spans = ()
+    # the stack of active spans, as a linked list of (span, parent node) tuples
+    thread_local.spans = None
 
     def get_transaction(self, clear: bool = False) -> "elasticapm.traces.Transaction":
         """
@@ -66,11 +67,8 @@ class ThreadLocalContext(BaseContext):
         """
         Get the active span for the current execution context.
         """
-        spans = getattr(self.thread_local, "spans", ())
-        span = None
-        if spans:
-            span = spans[-1]
-        return span
+        spans = getattr(self.thread_local, "spans", None)
+        return spans[0] if spans else None
 
     def set_span(self, span: "elasticapm.traces.Span") -> None:
         """
@@ -78,7 +76,7 @@ class ThreadLocalContext(BaseContext):
 
         The previously-activated span will be saved to be re-activated later.
         """
-        self.thread_local.spans = getattr(self.thread_local, "spans", ()) + (span,)
+        self.thread_local.spans = (span, getattr(self.thread_local, "spans", None))
 
     def unset_span(self, clear_all: bool = False) -> "elasticapm.traces.Span":
         """
@@ -89,14 +87,11 @@ class ThreadLocalContext(BaseContext):
 
         If clear_all=True, all spans will be cleared and no span will be active.
         """
-        spans = getattr(self.thread_local, "spans", ())
+        spans = getattr(self.thread_local, "spans", None)
         span = None
         if spans:
-            span = spans[-1]
-            if clear_all:
-                self.thread_local.spans = ()
-            else:
-                self.thread_local.spans = spans[0:-1]
+            span, parent = spans
+            self.thread_local.spans = None if clear_all else parent
         return span
 
 
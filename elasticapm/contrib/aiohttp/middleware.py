@@ -49,8 +49,10 @@ def tracing_middleware(app, client=None):
         elasticapm_client = get_client() if client is None else client
         should_trace = elasticapm_client and not elasticapm_client.should_ignore_url(request.path)
         if should_trace:
+            if elasticapm_client.loop_monitor is not None:
+                elasticapm_client.loop_monitor.watch()
             trace_parent = AioHttpTraceParent.from_headers(request.headers)
-            elasticapm_client.begin_transaction("request", trace_parent=trace_parent)
+            elasticapm_client.begin_transaction("request", trace_parent=trace_parent, url=request.path)
             resource = request.match_info.route.resource
             name = request.method
             if resource:
@@ -77,8 +77,14 @@ class ASGITracingMiddleware:
         url, url_dict = self.get_url(scope)
         body = None
         if not self.client.should_ignore_url(url):
+            if self.client.loop_monitor is not None:
+                self.client.loop_monitor.watch()
             headers = self.get_headers(scope)
-            self.client.begin_transaction(transaction_type="request", trace_parent=TraceParent.from_headers(headers))
+            self.client.begin_transaction(
+                transaction_type="request",
+                trace_parent=TraceParent.from_headers(headers),
+                url=scope.get("root_path", "") + scope.get("path", ""),
+            )
             self.set_transaction_name(scope["method"], url)
             if scope["method"] in constants.HTTP_WITH_BODY and self.client.config.capture_body != "off":
                 messages = []
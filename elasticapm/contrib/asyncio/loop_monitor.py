@@ -0,0 +1,212 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+from elasticapm import traces
+from elasticapm.metrics.sets.event_loop import EventLoopMetricSet
+from elasticapm.utils import stacks
+from elasticapm.utils.logging import get_logger
+from elasticapm.utils.threading import IntervalTimer, ThreadManager
+
+if TYPE_CHECKING:
+    import elasticapm
+
+logger = get_logger("elasticapm.loop_monitor")
+
+# the pure Python asyncio callback handle, whose frame holds the context of the running task
+_handle_run_code = asyncio.events.Handle._run.__code__
+
+
+class _LoopState(object):
+    __slots__ = ("loop", "thread_id", "expected_ns", "stall")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.thread_id: Optional[int] = None
+        # when the next heartbeat is due
+        self.expected_ns: Optional[int] = None
+        # (transaction, stack snapshot, start) of a stall the loop is currently in
+        self.stall = None
+
+
+class EventLoopMonitor(ThreadManager):
+    """
+    Detects synchronous code that blocks asyncio event loops.
+
+    A heartbeat callback is scheduled on each watched loop, and a watchdog thread checks that the heartbeats
+    run on time. If a heartbeat is late by more than `event_loop_block_threshold`, the watchdog takes a
+    snapshot of the stack of the loop's thread, and looks up the transaction of the task that blocks the loop.
+    Once the loop is unblocked, or the transaction ends, whichever comes first, the stall is reported as a span
+    of that transaction. The lag of all heartbeats is recorded in the EventLoopMetricSet.
+    """
+
+    def __init__(self, client: "elasticapm.Client") -> None:
+        self.client = client
+        self._lock = threading.Lock()
+        self._loops: Dict[asyncio.AbstractEventLoop, _LoopState] = {}
+        self._check_timer = None
+        self.metrics = client.metrics.register(EventLoopMetricSet)
+        super(EventLoopMonitor, self).__init__()
+
+    @property
+    def interval(self) -> float:
+        """The interval of heartbeats and checks, in seconds"""
+        return max(min(self.client.config.event_loop_block_threshold.total_seconds() / 2, 0.1), 0.001)
+
+    def watch(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """
+        Starts watching the given loop, or the running loop. Loops that are already watched are ignored.
+        """
+        loop = loop or asyncio.get_running_loop()
+        if loop in self._loops:
+            return
+        with self._lock:
+            if loop in self._loops:
+                return
+            state = self._loops[loop] = _LoopState(loop)
+        # run the heartbeats in their own context, instead of a copy of the context of the current request
+        loop.call_soon_threadsafe(self._heartbeat, state, context=contextvars.Context())
+
+    def _heartbeat(self, state: _LoopState) -> None:
+        now_ns = traces._time_ns_func()
+        state.thread_id = threading.get_ident()
+        if state.expected_ns is not None:
+            lag_ns = max(now_ns - state.expected_ns, 0)
+            self.metrics.record_lag(lag_ns / 1_000_000_000)
+            if lag_ns >= traces.duration_to_ns(self.client.config.event_loop_block_threshold):
+                self.metrics.blocked.inc()
+        with self._lock:
+            stall, state.stall = state.stall, None
+        if stall is not None:
+            self._report_stall(*stall, end_ns=now_ns)
+        interval = self.interval
+        state.expected_ns = now_ns + int(interval * 1_000_000_000)
+        state.loop.call_later(interval, self._heartbeat, state)
+
+    def check(self) -> None:
+        """
+        Takes a snapshot of the stacks of loops whose heartbeat is late by more than the threshold
+        """
+        threshold_ns = traces.duration_to_ns(self.client.config.event_loop_block_threshold)
+        now_ns = traces._time_ns_func()
+        with self._lock:
+            for loop in [loop for loop in self._loops if loop.is_closed()]:
+                del self._loops[loop]
+            blocked = [
+                state
+                for state in self._loops.values()
+                if state.expected_ns is not None and state.stall is None and now_ns - state.expected_ns > threshold_ns
+            ]
+        if blocked:
+            frames = sys._current_frames()
+            for state in blocked:
+                expected_ns = state.expected_ns
+                frame = frames.get(state.thread_id)
+                if frame is not None:
+                    stall = (
+                        self._get_transaction(state.loop, frame),
+                        stacks.get_stack_snapshot(start_frame=frame, config=self.client.config),
+                        expected_ns,
+                    )
+                    with self._lock:
+                        # unless the loop got unblocked in the meantime
+                        if state.stall is None and state.expected_ns == expected_ns:
+                            state.stall = stall
+            del frames, frame
+
+    def transaction_ending(self, transaction: "traces.Transaction") -> None:
+        """
+        Reports the stall of a loop that is blocked by the given transaction, so that it is part of the
+        transaction, even if the transaction ends before the loop runs the next heartbeat
+        """
+        stalls = []
+        with self._lock:
+            for state in self._loops.values():
+                if state.stall is not None and state.stall[0] is transaction:
+                    stalls.append(state.stall)
+                    # keep the stall, without transaction, so that it isn't detected again until the next heartbeat
+                    state.stall = (None, None, state.stall[2])
+        if stalls:
+            now_ns = traces._time_ns_func()
+            for stall in stalls:
+                self._report_stall(*stall, end_ns=now_ns)
+
+    def _get_transaction(self, loop: asyncio.AbstractEventLoop, frame) -> Optional["traces.Transaction"]:
+        """
+        Returns the transaction of the task that is running on the loop. This runs on the watchdog thread,
+        so the context of the task has to be looked up through the task or the handle that runs it.
+        """
+        var = getattr(traces.execution_context, "elasticapm_transaction_var", None)
+        if var is None:
+            return None
+        context = None
+        task = asyncio.current_task(loop)
+        if task is not None and hasattr(task, "get_context"):
+            context = task.get_context()
+        else:
+            while frame is not None:
+                if frame.f_code is _handle_run_code:
+                    context = getattr(frame.f_locals.get("self"), "_context", None)
+                    break
+                frame = frame.f_back
+        return context.get(var) if context is not None else None
+
+    def _report_stall(self, transaction: Optional["traces.Transaction"], snapshot, start_ns: int, end_ns: int) -> None:
+        if transaction is None or not transaction.is_sampled or transaction.ended_ns is not None:
+            return
+        span = transaction.begin_span(
+            "event loop blocked",
+            "app",
+            span_subtype="internal",
+            span_action="blocked",
+            start=time.time() - (traces._time_ns_func() - start_ns) / 1_000_000_000,
+            auto_activate=False,
+        )
+        if isinstance(span, traces.Span):
+            span.frames = snapshot
+        span.end(duration=traces.ns_to_timedelta(end_ns - start_ns))
+
+    def start_thread(self, pid=None) -> None:
+        super(EventLoopMonitor, self).start_thread(pid=pid)
+        self._check_timer = IntervalTimer(self.check, self.interval, name="eapm event loop monitor", daemon=True)
+        logger.debug("Starting event loop monitor")
+        self._check_timer.start()
+
+    def stop_thread(self) -> None:
+        if self._check_timer and self._check_timer.is_alive():
+            logger.debug("Stopping event loop monitor")
+            self._check_timer.cancel()
+            self._check_timer = None
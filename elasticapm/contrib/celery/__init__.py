@@ -99,7 +99,7 @@ def register_instrumentation(client) -> None:
         task = kwargs["task"]
 
         trace_parent = get_trace_parent(task)
-        client.begin_transaction("celery", trace_parent=trace_parent)
+        client.begin_transaction("celery", trace_parent=trace_parent, name=get_name_from_func(task))
 
     def end_transaction(task_id, task, *args, **kwargs) -> None:
         name = get_name_from_func(task)
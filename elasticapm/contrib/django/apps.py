@@ -137,6 +137,7 @@ def _request_started_handler(client, sender, *args, **kwargs) -> None:
         return
     # try to find trace id
     trace_parent = None
+    url = None
     if "environ" in kwargs:
         url = get_current_url(kwargs["environ"], strip_querystring=True, path_only=True)
         if client.should_ignore_url(url):
@@ -157,7 +158,7 @@ def _request_started_handler(client, sender, *args, **kwargs) -> None:
             return
         if "headers" in scope:
             trace_parent = TraceParent.from_headers(scope["headers"])
-    client.begin_transaction("request", trace_parent=trace_parent)
+    client.begin_transaction("request", trace_parent=trace_parent, url=url)
 
 
 def instrument(client) -> None:
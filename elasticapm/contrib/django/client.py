@@ -81,6 +81,9 @@ def get_client():
 class DjangoClient(Client):
     logger = get_logger("elasticapm.errors.client.django")
 
+    # iterate_with_template_sources looks up the template source in the locals of render() frames
+    _span_frames_kept_for_functions = ("render",)
+
     def __init__(self, config=None, **inline) -> None:
         if config is None:
             config = getattr(django_settings, "ELASTIC_APM", {})
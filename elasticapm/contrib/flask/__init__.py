@@ -183,7 +183,7 @@ class ElasticAPM(object):
     def request_started(self, app) -> None:
         if (not self.app.debug or self.client.config.debug) and not self.client.should_ignore_url(request.path):
             trace_parent = TraceParent.from_headers(request.headers)
-            self.client.begin_transaction("request", trace_parent=trace_parent)
+            self.client.begin_transaction("request", trace_parent=trace_parent, url=request.path)
             elasticapm.set_context(
                 lambda: get_data_from_request(request, self.client.config, constants.TRANSACTION), "request"
             )
@@ -256,8 +256,10 @@ class ElasticAPM:
         @entity.middleware("request")
         async def _instrument_request(request: Request) -> None:
             if not self._client.should_ignore_url(url=request.path):
+                if self._client.loop_monitor is not None:
+                    self._client.loop_monitor.watch()
                 trace_parent = TraceParent.from_headers(headers=request.headers)
-                self._client.begin_transaction("request", trace_parent=trace_parent)
+                self._client.begin_transaction("request", trace_parent=trace_parent, url=request.path)
                 await set_context(
                     lambda: get_request_info(
                         config=self._client.config, request=request, event_type=constants.TRANSACTION
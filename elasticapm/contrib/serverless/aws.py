@@ -127,6 +127,9 @@ def prep_kwargs(kwargs=None):
     if "metrics_sets" not in kwargs and "ELASTIC_APM_METRICS_SETS" not in os.environ:
         # Allow users to override metrics sets
         kwargs["metrics_sets"] = []
+    if "api_request_max_inflight" not in kwargs and "ELASTIC_APM_API_REQUEST_MAX_INFLIGHT" not in os.environ:
+        # data is flushed at the end of every invocation anyway, send it from the event processor thread
+        kwargs["api_request_max_inflight"] = 0
     kwargs["central_config"] = False
     kwargs["cloud_provider"] = "none"
     kwargs["framework_name"] = "AWS Lambda"
@@ -466,8 +469,11 @@ class _lambda_transaction(object):
             transaction = execution_context.get_transaction()
             transport = self.client._transport
             logger.debug("Sending partial transaction and early metadata to the lambda extension...")
-            data = transport._json_serializer({"metadata": self.client.build_metadata()}) + "\n"
-            data += transport._json_serializer({"transaction": transaction.to_dict()})
+            if not transport._metadata:
+                transport._metadata = self.client.build_metadata()
+            # reuse the metadata line that the transport encoded for earlier invocations, if still current
+            metadata, _ = transport._encoded_metadata()
+            data = metadata + transport._json_serializer({"transaction": transaction.to_dict()}).encode("utf-8")
             partial_transaction_url = urllib.parse.urljoin(
                 (
                     self.client.config.server_url
@@ -194,9 +194,13 @@ class ElasticAPM:
         _mocked_receive = None
         _request_receive = None
 
+        if self.client.loop_monitor is not None:
+            self.client.loop_monitor.watch()
         # begin the transaction before capturing the body to get that time accounted
         trace_parent = TraceParent.from_headers(dict(Headers(scope=scope)))
-        self.client.begin_transaction("request", trace_parent=trace_parent)
+        self.client.begin_transaction(
+            "request", trace_parent=trace_parent, url=scope.get("root_path", "") + scope.get("path", "")
+        )
 
         if self.client.config.capture_body != "off":
 
@@ -0,0 +1,82 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from elasticapm.metrics.base_metrics import MetricSet
+
+
+class TransportMetricSet(MetricSet):
+    """
+    Metrics about the agent's own event pipeline, e.g. to alert when the agent drops data,
+    or when requests to the APM Server get slow
+    """
+
+    def __init__(self, registry) -> None:
+        self._previous = {}
+        super(TransportMetricSet, self).__init__(registry)
+
+    def before_collect(self) -> None:
+        client = self._registry.client
+        stats = client.get_transport_stats()
+        if stats is None:
+            return
+        self.gauge("agent.events.total").val = self._delta("events", sum(stats["events"].values()))
+        self.gauge("agent.events.dropped", reason="queue").val = self._delta(
+            "dropped.queue", sum(stats["dropped"].values())
+        )
+        self.gauge("agent.events.dropped", reason="processor").val = self._delta(
+            "dropped.processor", sum(stats["dropped_by_processors"].values())
+        )
+        self.gauge("agent.events.queue.size").val = stats["queue"]["events"]
+        self.gauge("agent.events.queue.bytes").val = stats["queue"]["bytes"]
+        self.gauge("agent.events.queue.fill.pct").val = stats["queue"]["fill_ratio"]
+        requests = stats["requests"]
+        request_count = self._delta("requests.count", requests["count"])
+        self.gauge("agent.events.requests.count").val = request_count
+        self.gauge("agent.events.requests.failed").val = self._delta("requests.failed", requests["failed"])
+        self.gauge("agent.events.requests.bytes").val = self._delta("requests.bytes", requests["bytes"])
+        self.gauge("agent.events.requests.inflight").val = requests["inflight"]
+        duration = self._delta("requests.duration", requests["duration"])
+        self.timer("agent.events.requests.duration", reset_on_collect=True, unit="us").update(
+            int(duration * 1000000), request_count
+        )
+        if stats["compression_ratio"] is not None:
+            self.gauge("agent.events.compression.ratio").val = stats["compression_ratio"]
+        self.gauge("agent.events.backoff.time").val = self._delta("backoff.time", stats["backoff"]["time"])
+        if "spool" in stats:
+            self.gauge("agent.events.spool.size").val = stats["spool"]["pending"]
+            self.gauge("agent.events.spool.bytes").val = stats["spool"]["pending_bytes"]
+
+    def _delta(self, key, total):
+        """
+        The transport reports totals, while metrics are reported per collection interval
+        """
+        previous = self._previous.get(key, 0)
+        self._previous[key] = total
+        return total - previous
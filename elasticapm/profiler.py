@@ -0,0 +1,295 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from elasticapm import traces
+from elasticapm.conf.constants import SPAN
+from elasticapm.utils import stacks
+from elasticapm.utils.logging import get_logger
+from elasticapm.utils.threading import IntervalTimer, ThreadManager
+
+if TYPE_CHECKING:
+    import elasticapm
+
+logger = get_logger("elasticapm.profiler")
+
+try:
+    _thread_time_ns = time.thread_time_ns
+except AttributeError:  # Python 3.6
+
+    def _thread_time_ns() -> int:
+        return int(time.process_time() * 1_000_000_000)
+
+
+class _CallNode(object):
+    """A function call that was seen on the stack of consecutive samples"""
+
+    __slots__ = ("code", "parent", "start_ns", "last_seen_ns", "span")
+
+    def __init__(self, code, parent: Optional["_CallNode"], timestamp_ns: int) -> None:
+        self.code = code
+        self.parent = parent
+        self.start_ns = timestamp_ns
+        self.last_seen_ns = timestamp_ns
+        # the inferred span, once it is created, or False if the call was too short to report
+        self.span = None
+
+
+class TransactionProfile(object):
+    """
+    The stack samples of a thread while it runs a transaction, merged into a tree of calls
+    """
+
+    __slots__ = ("transaction", "thread_id", "ancestors", "stack", "calls", "samples", "spans", "discarded")
+
+    def __init__(self, transaction: "traces.Transaction", thread_id: int, ancestors: Sequence[Tuple]) -> None:
+        self.transaction = transaction
+        self.thread_id = thread_id
+        # (id, code) of the frames that called begin_transaction, from the outermost frame. The frames
+        # that are still on the stack when a sample is taken are not part of the transaction.
+        self.ancestors = ancestors
+        self.stack: List[_CallNode] = []
+        self.calls: List[_CallNode] = []
+        self.samples = 0
+        # inferred spans created from this profile
+        self.spans = 0
+        self.discarded = False
+
+    def add_sample(self, codes: List, timestamp_ns: int) -> None:
+        """
+        Adds a sample, given as the code objects of the stack from the outermost to the innermost call.
+        Calls that are on the stack of consecutive samples are merged, calls that are gone are finished.
+        """
+        self.samples += 1
+        stack = self.stack
+        common = 0
+        for node, code in zip(stack, codes):
+            if node.code is not code:
+                break
+            node.last_seen_ns = timestamp_ns
+            common += 1
+        if common < len(stack):
+            self.calls.extend(stack[common:])
+            del stack[common:]
+        parent = stack[-1] if stack else None
+        for code in codes[common:]:
+            parent = _CallNode(code, parent, timestamp_ns)
+            stack.append(parent)
+
+    def finish(self) -> List[_CallNode]:
+        self.calls.extend(self.stack)
+        self.stack = []
+        return self.calls
+
+
+class SamplingProfiler(ThreadManager):
+    """
+    A wall clock sampling profiler. It periodically samples the stacks of the threads that run a sampled
+    transaction, and reports calls that were seen in consecutive samples as inferred spans of type
+    `app.inferred`, to explain where the time of a transaction went that is not covered by other spans.
+
+    Only calls of application code are reported, library frames and frames of the agent are skipped.
+    The sampling interval is stretched if sampling takes more than `profiling_inferred_spans_max_overhead`
+    of the CPU time, and sampling is paused while the agent sheds events. To bound the memory used by
+    long transactions, a transaction isn't sampled anymore once `max_samples` samples have been taken.
+    """
+
+    code_names_size = 10000
+    max_samples = 10000
+
+    def __init__(self, client: "elasticapm.Client") -> None:
+        self.client = client
+        self._lock = threading.Lock()
+        # profiles of the transactions running on each thread
+        self._profiles: Dict[int, List[TransactionProfile]] = {}
+        self._ended: List[TransactionProfile] = []
+        # names of the inferred spans by code object, None for code that is not reported
+        self._code_names: Dict = {}
+        self._code_names_paths_re = None
+        self._sample_timer = None
+        super(SamplingProfiler, self).__init__()
+
+    @property
+    def interval(self) -> float:
+        return max(self.client.config.profiling_inferred_spans_sampling_interval.total_seconds(), 0.001)
+
+    def transaction_started(self, transaction: "traces.Transaction") -> None:
+        thread_id = threading.get_ident()
+        ancestors = []
+        frame = sys._getframe(1)
+        while frame is not None:
+            ancestors.append((id(frame), frame.f_code))
+            frame = frame.f_back
+        ancestors.reverse()
+        profile = TransactionProfile(transaction, thread_id, ancestors)
+        transaction._profile = profile
+        with self._lock:
+            profiles = self._profiles.setdefault(thread_id, [])
+            profiles.append(profile)
+            if len(profiles) > 1:
+                # several transactions on one thread, e.g. with asyncio. The samples of the thread can't be
+                # attributed to one of them.
+                for other in profiles:
+                    other.discarded = True
+
+    def transaction_ended(self, transaction: "traces.Transaction") -> None:
+        profile, transaction._profile = transaction._profile, None
+        with self._lock:
+            profiles = self._profiles.get(profile.thread_id)
+            if profiles and profile in profiles:
+                profiles.remove(profile)
+                if not profiles:
+                    del self._profiles[profile.thread_id]
+            if not profile.discarded:
+                self._ended.append(profile)
+
+    def sample(self) -> float:
+        """
+        Samples the stacks of threads that run a transaction, and reports the profiles of ended transactions
+
+        :return: the interval until the next sample, in seconds
+        """
+        cpu_start_ns = _thread_time_ns()
+        with self._lock:
+            ended, self._ended = self._ended, []
+            profiles = [
+                profiles[0]
+                for profiles in self._profiles.values()
+                if len(profiles) == 1 and not profiles[0].discarded and profiles[0].samples < self.max_samples
+            ]
+        for profile in ended:
+            self.report(profile)
+        if self.client.tracer.shed_event(SPAN):
+            # the agent is overloaded. Inferred spans would be dropped, and the sampling gap would distort
+            # the profiles of running transactions.
+            for profile in profiles:
+                profile.discarded = True
+        elif profiles:
+            frames = sys._current_frames()
+            timestamp_ns = traces._time_ns_func()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.add_sample(self._get_codes(frame, profile.ancestors), timestamp_ns)
+            del frames, frame
+        cost = (_thread_time_ns() - cpu_start_ns) / 1_000_000_000
+        return max(self.interval, cost / self.client.config.profiling_inferred_spans_max_overhead)
+
+    def report(self, profile: TransactionProfile) -> None:
+        """
+        Turns the calls of a profile into inferred spans, and reports them
+        """
+        min_duration_ns = max(traces.duration_to_ns(self.client.config.profiling_inferred_spans_min_duration), 1)
+        spans = []
+        for node in profile.finish():
+            self._get_span(node, profile, min_duration_ns, spans)
+        # parents are created before their children. End the children first, so that they are accounted
+        # for in the self time of their parents.
+        for span, duration_ns in reversed(spans):
+            span.end(duration=duration_ns / 1_000_000_000)
+
+    def _get_span(self, node: _CallNode, profile: TransactionProfile, min_duration_ns: int, spans: List):
+        if node.span is None:
+            transaction = profile.transaction
+            start_ns = node.start_ns
+            duration_ns = min(node.last_seen_ns, transaction.ended_ns) - start_ns
+            max_spans = transaction.config_transaction_max_spans
+            # the transaction has been reported already, so its span count isn't updated for inferred spans
+            if duration_ns < min_duration_ns or (max_spans and transaction._span_counter + profile.spans >= max_spans):
+                node.span = False
+                return None
+            # the call of the parent node spans the call of the child node, so it is reported as well
+            parent = self._get_span(node.parent, profile, min_duration_ns, spans) if node.parent else None
+            node.span = traces.Span(
+                transaction=transaction,
+                name=self._code_names.get(node.code) or node.code.co_name,
+                span_type="app",
+                span_subtype="inferred",
+                parent=parent,
+                start_ns=start_ns,
+            )
+            profile.spans += 1
+            spans.append((node.span, duration_ns))
+        return node.span or None
+
+    def _get_codes(self, frame, ancestors: Sequence[Tuple]) -> List:
+        """
+        Returns the code objects of the application code on the stack, from the outermost to the innermost call
+        """
+        paths_re = (self.client.include_paths_re, self.client.exclude_paths_re)
+        if paths_re != self._code_names_paths_re or len(self._code_names) > self.code_names_size:
+            self._code_names = {}
+            self._code_names_paths_re = paths_re
+        code_names = self._code_names
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        # skip the frames that called begin_transaction. Frame ids can be reused once a frame is gone,
+        # so the code objects have to match too.
+        skip = 0
+        for frame, (frame_id, code) in zip(frames, ancestors):
+            if id(frame) != frame_id or frame.f_code is not code:
+                break
+            skip += 1
+        codes = []
+        for frame in frames[skip:]:
+            code = frame.f_code
+            try:
+                name = code_names[code]
+            except KeyError:
+                module = frame.f_globals.get("__name__") or ""
+                if module.startswith("elasticapm.") or stacks.is_library_frame(code.co_filename, *paths_re):
+                    name = None
+                else:
+                    name = "{}.{}".format(module, getattr(code, "co_qualname", code.co_name))
+                code_names[code] = name
+            if name is not None:
+                codes.append(code)
+        return codes
+
+    def start_thread(self, pid=None) -> None:
+        super(SamplingProfiler, self).start_thread(pid=pid)
+        self._sample_timer = IntervalTimer(
+            self.sample, self.interval, name="eapm profiler", daemon=True, evaluate_function_interval=True
+        )
+        logger.debug("Starting sampling profiler")
+        self._sample_timer.start()
+
+    def stop_thread(self) -> None:
+        if self._sample_timer and self._sample_timer.is_alive():
+            logger.debug("Stopping sampling profiler")
+            self._sample_timer.cancel()
+            self._sample_timer = None
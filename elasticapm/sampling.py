@@ -0,0 +1,311 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import random
+import re
+import threading
+import timeit
+from collections import deque
+from typing import TYPE_CHECKING, Dict, Optional, Sequence, Tuple
+
+from elasticapm.conf import constants
+from elasticapm.utils import starmatch_to_regex
+
+if TYPE_CHECKING:
+    from elasticapm.traces import Transaction
+
+
+class LatencyWindow(object):
+    """
+    Keeps the most recent durations of a transaction name to estimate a duration percentile.
+
+    The percentile is only recomputed every `recompute_every` observations, to keep the cost per
+    transaction low.
+    """
+
+    __slots__ = ("durations", "percentile", "threshold", "_observations")
+
+    recompute_every = 16
+    min_observations = 20
+
+    def __init__(self, percentile: float, size: int = 256) -> None:
+        self.durations = deque(maxlen=size)
+        self.percentile = percentile
+        self.threshold = None
+        self._observations = 0
+
+    def observe(self, duration_ns: int) -> bool:
+        """
+        Records a duration, and returns True if it is above the percentile of the preceding durations
+        """
+        above = self.threshold is not None and duration_ns > self.threshold
+        self.durations.append(duration_ns)
+        self._observations += 1
+        if len(self.durations) >= self.min_observations and (
+            self.threshold is None or self._observations % self.recompute_every == 0
+        ):
+            ordered = sorted(self.durations)
+            self.threshold = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+        return above
+
+
+class TailSampler(object):
+    """
+    Decides whether to keep the spans of a transaction once it has ended.
+
+    Spans are buffered on their transaction until the decision is made. A transaction is kept if
+    an error was captured during it, if its outcome is failure, if its duration is above the configured
+    percentile of recent transactions with the same name, or randomly at the baseline rate.
+    """
+
+    # number of transaction names for which latencies are tracked
+    max_names = 1000
+
+    def __init__(self, rate: float, latency_percentile: float, buffer_size: int) -> None:
+        self.rate = rate
+        self.latency_percentile = latency_percentile
+        self.buffer_size = buffer_size
+        self._buffered = 0
+        self._buffer_lock = threading.Lock()
+        self._latencies: Dict[str, LatencyWindow] = {}
+        self._latencies_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "TailSampler":
+        return cls(
+            rate=config.tail_sampling_rate,
+            latency_percentile=config.tail_sampling_latency_percentile,
+            buffer_size=config.tail_sampling_buffer_size,
+        )
+
+    def acquire(self) -> bool:
+        """
+        Reserves room for a span in the buffer shared by all transactions
+
+        :return: False if the buffer is full
+        """
+        with self._buffer_lock:
+            if self.buffer_size and self._buffered >= self.buffer_size:
+                return False
+            self._buffered += 1
+            return True
+
+    def release(self, count: int) -> None:
+        with self._buffer_lock:
+            self._buffered -= count
+
+    @property
+    def buffered(self) -> int:
+        return self._buffered
+
+    def should_keep(self, transaction: "Transaction") -> bool:
+        # the latency is recorded for every transaction, so it is evaluated first
+        slow = self._is_slow(transaction)
+        return (
+            transaction.error_captured
+            or transaction.outcome == constants.OUTCOME.FAILURE
+            or slow
+            or (self.rate > 0 and random.random() < self.rate)
+        )
+
+    def _is_slow(self, transaction: "Transaction") -> bool:
+        if not self.latency_percentile or transaction.duration_ns is None:
+            return False
+        name = transaction.name or ""
+        with self._latencies_lock:
+            window = self._latencies.get(name)
+            if window is None:
+                if len(self._latencies) >= self.max_names:
+                    return False
+                window = self._latencies[name] = LatencyWindow(self.latency_percentile)
+            return window.observe(transaction.duration_ns)
+
+
+# path segments that are likely IDs: numbers, or hex strings and UUIDs of at least 8 characters containing a digit
+_ID_SEGMENT_RE = re.compile(r"(?<=/)(?:\d+|(?=[^/]*\d)[0-9a-fA-F-]{8,})(?=/|$)")
+
+
+def normalize_url_path(path: str) -> str:
+    """
+    Replaces path segments that look like IDs with `*`, so that requests to the same endpoint share a key,
+    e.g. `/users/42/orders` becomes `/users/*/orders`
+    """
+    return _ID_SEGMENT_RE.sub("*", path)
+
+
+class AdaptiveSampler(object):
+    """
+    Samples transactions so that a target number of transactions per second is sampled.
+
+    Transactions are counted per key (usually the transaction name) in windows of `window` seconds.
+    When a window ends, the smoothed rate of each key is updated, and the target is shared among the keys:
+    keys with less traffic than an even share of the target are always sampled, and the rest of the target
+    is shared evenly by the busier keys. This way, rarely called endpoints keep being sampled.
+    """
+
+    # share of the rate of the last window in the smoothed rate
+    smoothing = 0.7
+    # number of keys that are tracked separately, further keys share a single estimate
+    max_keys = 1000
+    # keys with a smoothed rate below this are forgotten
+    min_rate = 0.001
+
+    def __init__(self, window: float = 5.0, clock=timeit.default_timer) -> None:
+        self.window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._window_start = clock()
+        self._counts: Dict[str, int] = {}
+        self._total = 0
+        self._rates: Dict[str, float] = {}
+        self._probabilities: Dict[str, float] = {}
+        self._target = None
+
+    def sample(self, key: str, target: float) -> Tuple[bool, float]:
+        """
+        Decides whether to sample a transaction
+
+        :param key: the key to estimate the rate for, e.g. the transaction name
+        :param target: the number of transactions to sample per second
+        :return: a tuple of the sampling decision and the effective sample rate, rounded to 4 digits
+        """
+        with self._lock:
+            now = self._clock()
+            if target != self._target:
+                self._target = target
+                self._probabilities = self._allocate(self._rates, target)
+            elapsed = now - self._window_start
+            # end the window early if it saw more transactions than the target for the whole window,
+            # to adapt quickly to traffic spikes
+            if elapsed >= self.window or (self._total >= target * self.window and elapsed >= 0.1 * self.window):
+                self._end_window(elapsed)
+                self._window_start = now
+            if key not in self._counts and len(self._counts) >= self.max_keys:
+                key = ""
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._total += 1
+            probability = self._probabilities.get(key, 1.0)
+        if probability < 1.0:
+            probability = max(0.0001, round(probability, 4))
+        return probability == 1.0 or random.random() < probability, probability
+
+    def _end_window(self, elapsed: float) -> None:
+        rates = {}
+        for key in set(self._rates) | set(self._counts):
+            rate = self.smoothing * self._counts.get(key, 0) / elapsed + (1 - self.smoothing) * self._rates.get(key, 0)
+            if rate >= self.min_rate:
+                rates[key] = rate
+        self._rates = rates
+        self._counts = {}
+        self._total = 0
+        self._probabilities = self._allocate(rates, self._target)
+
+    @staticmethod
+    def _allocate(rates: Dict[str, float], target: float) -> Dict[str, float]:
+        probabilities = {}
+        remaining = target
+        keys = sorted(rates, key=rates.get)
+        for i, key in enumerate(keys):
+            share = remaining / (len(keys) - i)
+            rate = rates[key]
+            if rate <= share:
+                probabilities[key] = 1.0
+                remaining -= rate
+            else:
+                probabilities[key] = share / rate
+                remaining -= share
+        return probabilities
+
+
+class SamplingRules(object):
+    """
+    Matcher for the rules of TRANSACTION_SAMPLING_RULES.
+
+    All rule patterns are compiled into a single regular expression, and match results are cached per
+    subject, so that matching a recurring URL or transaction name is a dictionary lookup, regardless of
+    the number of rules.
+    """
+
+    cache_size = 1000
+
+    def __init__(self, rules: Sequence[Tuple[str, Optional[float], Optional[float]]], clock=timeit.default_timer):
+        self.rules = list(rules)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # per rule with a limit: start of the current second, transactions seen, transactions sampled, effective rate
+        self._limits = {i: [0.0, 0, 0, 1.0] for i, rule in enumerate(self.rules) if rule[2] is not None}
+        self._cache: Dict[str, Optional[int]] = {}
+        groups = []
+        for i, (pattern, _, _) in enumerate(self.rules):
+            regex = starmatch_to_regex(pattern)
+            flag = "i" if regex.flags & re.IGNORECASE else "-i"
+            groups.append("(?P<r{}>(?{}:{}))".format(i, flag, regex.pattern))
+        self._regex = re.compile("|".join(groups), re.DOTALL) if groups else None
+
+    def match(self, subject: str) -> Optional[int]:
+        """
+        Returns the index of the first rule that matches the subject, or None
+        """
+        try:
+            return self._cache[subject]
+        except KeyError:
+            pass
+        match = self._regex.match(subject) if self._regex else None
+        index = int(match.lastgroup[1:]) if match else None
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[subject] = index
+        return index
+
+    def sample(self, subject: str) -> Optional[Tuple[bool, float]]:
+        """
+        Applies the first rule that matches the subject
+
+        :return: a tuple of the sampling decision and the sample rate, or None if no rule matches
+        """
+        index = self.match(subject)
+        if index is None:
+            return None
+        _, rate, limit = self.rules[index]
+        if limit is None:
+            rate = max(0.0001, round(rate, 4)) if 0 < rate < 1 else rate
+            return rate == 1 or random.random() < rate, rate
+        with self._lock:
+            state = self._limits[index]
+            now = self._clock()
+            if now - state[0] >= 1.0:
+                # the rate of the last second is used as the sample rate for the next one
+                state[3] = min(1.0, state[2] / state[1]) if state[1] else 1.0
+                state[0], state[1], state[2] = now, 0, 0
+            state[1] += 1
+            if state[2] >= limit:
+                return False, 0
+            state[2] += 1
+            return True, max(0.0001, round(state[3], 4))
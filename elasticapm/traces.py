@@ -33,10 +33,9 @@ import random
 import re
 import threading
 import time
-import timeit
 import urllib.parse
 import warnings
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from datetime import timedelta
 from types import TracebackType
 from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, TypeVar, Union
@@ -46,6 +45,7 @@ from elasticapm.conf import constants
 from elasticapm.conf.constants import LABEL_RE, SPAN, TRANSACTION
 from elasticapm.context import init_execution_context
 from elasticapm.metrics.base_metrics import Timer
+from elasticapm.sampling import AdaptiveSampler, SamplingRules, TailSampler, normalize_url_path
 from elasticapm.utils import encoding, get_name_from_func, nested_key, url_to_destination_resource
 from elasticapm.utils.disttracing import TraceParent
 from elasticapm.utils.logging import get_logger
@@ -56,7 +56,32 @@ __all__ = ("capture_span", "label", "set_transaction_name", "set_custom_context"
 error_logger = get_logger("elasticapm.errors")
 logger = get_logger("elasticapm.traces")
 
-_time_func = timeit.default_timer
+try:
+    _time_ns_func = time.perf_counter_ns
+except AttributeError:  # Python 3.6
+
+    def _time_ns_func() -> int:
+        return int(time.perf_counter() * 1_000_000_000)
+
+
+# duration thresholds from the configuration, in nanoseconds
+DurationThresholds = namedtuple(
+    "DurationThresholds",
+    ["exit_span_min", "compression_exact_match_max", "compression_same_kind_max", "stack_trace_min"],
+)
+
+
+def duration_to_ns(duration: Union[timedelta, float]) -> int:
+    """
+    Converts a duration, given as timedelta or as seconds, to integer nanoseconds
+    """
+    if isinstance(duration, timedelta):
+        return (duration.days * 86_400 + duration.seconds) * 1_000_000_000 + duration.microseconds * 1_000
+    return int(duration * 1_000_000_000)
+
+
+def ns_to_timedelta(ns: int) -> timedelta:
+    return timedelta(microseconds=ns / 1_000)
 
 
 execution_context = init_execution_context()
@@ -68,42 +93,69 @@ _AnnotatedFunctionT = TypeVar("_AnnotatedFunctionT", bound=FuncType)
 
 
 class ChildDuration(object):
-    __slots__ = ("obj", "_nesting_level", "_start", "_duration", "_lock")
+    """
+    Tracks the time during which at least one child of a span is running. Callers have to hold the
+    bookkeeping lock of the transaction.
+    """
+
+    __slots__ = ("_nesting_level", "_start", "_duration")
 
-    def __init__(self, obj: "BaseSpan") -> None:
-        self.obj = obj
+    def __init__(self) -> None:
         self._nesting_level: int = 0
-        self._start: float = 0
-        self._duration: timedelta = timedelta(seconds=0)
-        self._lock = threading.Lock()
-
-    def start(self, timestamp: float) -> None:
-        with self._lock:
-            self._nesting_level += 1
-            if self._nesting_level == 1:
-                self._start = timestamp
-
-    def stop(self, timestamp: float) -> None:
-        with self._lock:
-            self._nesting_level -= 1
-            if self._nesting_level == 0:
-                self._duration += timedelta(seconds=timestamp - self._start)
+        self._start: int = 0
+        self._duration: int = 0
+
+    def start(self, timestamp_ns: int) -> None:
+        self._nesting_level += 1
+        if self._nesting_level == 1:
+            self._start = timestamp_ns
+
+    def stop(self, timestamp_ns: int) -> None:
+        self._nesting_level -= 1
+        if self._nesting_level == 0:
+            self._duration += timestamp_ns - self._start
 
     @property
     def duration(self) -> timedelta:
+        return ns_to_timedelta(self._duration)
+
+    @property
+    def duration_ns(self) -> int:
         return self._duration
 
 
 class BaseSpan(object):
-    def __init__(self, labels=None, start=None, links: Optional[Sequence[TraceParent]] = None) -> None:
-        self._child_durations = ChildDuration(self)
-        self.labels = {}
+    __slots__ = (
+        "_child_durations",
+        "_labels",
+        "outcome",
+        "compression_buffer",
+        "compression_window",
+        "start_ns",
+        "ended_ns",
+        "duration_ns",
+        "links",
+        "otel_wrapper",
+    )
+
+    def __init__(
+        self, labels=None, start=None, links: Optional[Sequence[TraceParent]] = None, start_ns: Optional[int] = None
+    ) -> None:
+        # the child durations are only needed by spans that have children, so they are created when the first
+        # child starts
+        self._child_durations: Optional[ChildDuration] = None
+        # created on first use, most spans don't have labels
+        self._labels: Optional[dict] = None
         self.outcome: Optional[str] = None
         self.compression_buffer: Optional[Union[Span, DroppedSpan]] = None
-        self.compression_buffer_lock = threading.Lock()
-        self.start_time: float = time_to_perf_counter(start) if start is not None else _time_func()
-        self.ended_time: Optional[float] = None
-        self.duration: Optional[timedelta] = None
+        # the spans held back for compression if span_compression_window_size is larger than 1
+        self.compression_window: Optional[List[Union[Span, DroppedSpan]]] = None
+        # timing is kept in integer nanoseconds of the perf_counter clock
+        if start_ns is None:
+            start_ns = int(time_to_perf_counter(start) * 1_000_000_000) if start is not None else _time_ns_func()
+        self.start_ns: int = start_ns
+        self.ended_ns: Optional[int] = None
+        self.duration_ns: Optional[int] = None
         self.links: Optional[List[Dict[str, str]]] = None
         if links:
             for trace_parent in links:
@@ -111,28 +163,107 @@ class BaseSpan(object):
         if labels:
             self.label(**labels)
 
-    def child_started(self, timestamp) -> None:
-        self._child_durations.start(timestamp)
+    @property
+    def labels(self) -> dict:
+        if self._labels is None:
+            self._labels = {}
+        return self._labels
+
+    @labels.setter
+    def labels(self, labels: dict) -> None:
+        self._labels = labels
+
+    @property
+    def start_time(self) -> float:
+        return self.start_ns / 1_000_000_000
+
+    @property
+    def ended_time(self) -> Optional[float]:
+        return self.ended_ns / 1_000_000_000 if self.ended_ns is not None else None
+
+    @property
+    def duration(self) -> Optional[timedelta]:
+        return ns_to_timedelta(self.duration_ns) if self.duration_ns is not None else None
+
+    @duration.setter
+    def duration(self, value: Optional[Union[timedelta, float]]) -> None:
+        self.duration_ns = duration_to_ns(value) if value is not None else None
+
+    @property
+    def child_durations_ns(self) -> int:
+        """The time during which at least one child was running, in nanoseconds"""
+        return self._child_durations.duration_ns if self._child_durations is not None else 0
+
+    def child_started(self, timestamp_ns: int) -> None:
+        self.transaction.synchronized(self._start_child_duration, timestamp_ns)
+
+    def _start_child_duration(self, timestamp_ns: int) -> None:
+        if self._child_durations is None:
+            self._child_durations = ChildDuration()
+        self._child_durations.start(timestamp_ns)
+
+    def child_stopped(self, timestamp_ns: int) -> None:
+        self.transaction.synchronized(self._child_durations.stop, timestamp_ns)
 
     def child_ended(self, child: SpanType) -> None:
-        with self.compression_buffer_lock:
-            if not child.is_compression_eligible():
-                if self.compression_buffer:
-                    self.compression_buffer.report()
-                    self.compression_buffer = None
-                child.report()
-            elif self.compression_buffer is None:
-                self.compression_buffer = child
-            elif not self.compression_buffer.try_to_compress(child):
+        self.transaction.synchronized(self._buffer_for_compression, child)
+
+    def _buffer_for_compression(self, child: SpanType) -> None:
+        window_size = self.transaction.config_span_compression_window_size
+        if window_size > 1:
+            self._buffer_in_compression_window(child, window_size)
+        elif not child.is_compression_eligible():
+            if self.compression_buffer:
                 self.compression_buffer.report()
-                self.compression_buffer = child
+                self.compression_buffer = None
+            child.report()
+        elif self.compression_buffer is None:
+            self.compression_buffer = child
+        elif not self.compression_buffer.try_to_compress(child):
+            self.compression_buffer.report()
+            self.compression_buffer = child
 
-    def end(self, skip_frames: int = 0, duration: Optional[timedelta] = None) -> None:
-        self.ended_time = _time_func()
-        self.duration = duration if duration is not None else timedelta(seconds=self.ended_time - self.start_time)
+    def _buffer_in_compression_window(self, child: SpanType, window_size: int) -> None:
+        """
+        Holds back up to `window_size` compressed spans of different kinds, so that interleaved siblings,
+        like the queries and cache lookups of a loop, can be compressed too. An ended child is compressed into
+        the first buffered span that it is an exact match or of the same kind of. If there is none, the oldest
+        buffered span is reported to make room for it.
+        """
+        if not child.is_compression_eligible():
+            self.flush_compression_buffer()
+            child.report()
+            return
+        window = self.compression_window
+        if window is None:
+            window = self.compression_window = []
+        for buffered in window:
+            if buffered.try_to_compress(child):
+                return
+        if len(window) >= window_size:
+            window.pop(0).report()
+        window.append(child)
+
+    def flush_compression_buffer(self) -> None:
+        """
+        Reports the spans held back for compression, in the order they started
+        """
         if self.compression_buffer:
             self.compression_buffer.report()
             self.compression_buffer = None
+        if self.compression_window:
+            window, self.compression_window = self.compression_window, None
+            for span in sorted(window, key=lambda span: span.start_ns):
+                span.report()
+
+    def end(self, skip_frames: int = 0, duration: Optional[timedelta] = None) -> None:
+        if duration is not None:
+            self.duration_ns = duration_to_ns(duration)
+            self.ended_ns = self.start_ns + self.duration_ns
+        else:
+            self.ended_ns = _time_ns_func()
+            self.duration_ns = self.ended_ns - self.start_ns
+        self.flush_compression_buffer()
 
     def to_dict(self) -> dict:
         raise NotImplementedError()
@@ -176,6 +307,45 @@ class BaseSpan(object):
 
 
 class Transaction(BaseSpan):
+    __slots__ = (
+        "id",
+        "pause_sampling",
+        "trace_parent",
+        "timestamp",
+        "name",
+        "result",
+        "transaction_type",
+        "_tracer",
+        "transaction",
+        "config_span_compression_enabled",
+        "config_span_compression_window_size",
+        "config_duration_thresholds",
+        "config_transaction_max_spans",
+        "config_defer_span_serialization",
+        "dropped_spans",
+        "context",
+        "error_captured",
+        "_tail_buffer",
+        "_tail_buffer_lock",
+        "_tail_sampling_kept",
+        "_profile",
+        "_is_sampled",
+        "sample_rate",
+        "_span_counter",
+        "_span_timers",
+        "_dropped_span_statistics",
+        "_breakdown",
+        "_bookkeeping_lock",
+        "_window_ns",
+        "_window_start_ns",
+        "_window_span_base",
+        "_window_dropped_base",
+        "_spans_started",
+        "_window_started_base",
+        "_long_transaction_metrics",
+        "__weakref__",
+    )
+
     def __init__(
         self,
         tracer: "Tracer",
@@ -227,35 +397,79 @@ class Transaction(BaseSpan):
         # a reference to the Transaction in the Transaction simplifies things.
         self.transaction = self
         self.config_span_compression_enabled = tracer.config.span_compression_enabled
-        self.config_span_compression_exact_match_max_duration = tracer.config.span_compression_exact_match_max_duration
-        self.config_span_compression_same_kind_max_duration = tracer.config.span_compression_same_kind_max_duration
-        self.config_exit_span_min_duration = tracer.config.exit_span_min_duration
+        self.config_span_compression_window_size = tracer.config.span_compression_window_size
+        self.config_duration_thresholds = tracer.duration_thresholds
         self.config_transaction_max_spans = tracer.config.transaction_max_spans
+        self.config_defer_span_serialization = tracer.config.defer_span_serialization
 
         self.dropped_spans: int = 0
         self.context: Dict[str, Any] = {}
+        self.error_captured = False
+        # spans held back until the tail sampling decision is made when the transaction ends
+        self._tail_buffer: Optional[List[Span]] = [] if tracer.tail_sampler and is_sampled else None
+        self._tail_buffer_lock = threading.Lock() if self._tail_buffer is not None else None
+        self._tail_sampling_kept: Optional[bool] = None
+        # set by the sampling profiler, if it profiles this transaction
+        self._profile = None
 
         self._is_sampled = is_sampled
         self.sample_rate = sample_rate
+        # guards the bookkeeping of spans: child durations, compression buffers, span timers and dropped span
+        # statistics. Reentrant, as reporting a span from the compression buffer updates the span timers.
+        self._bookkeeping_lock = threading.RLock()
         self._span_counter: int = 0
-        self._span_timers: Dict[Tuple[str, str], Timer] = defaultdict(Timer)
-        self._span_timers_lock = threading.Lock()
-        self._dropped_span_statistics = defaultdict(lambda: {"count": 0, "duration.sum.us": 0})
+        # created when the first span is tracked
+        self._span_timers: Optional[Dict[Tuple[str, str], Timer]] = None
+        self._dropped_span_statistics: Optional[Dict[tuple, Dict[str, int]]] = None
         try:
             self._breakdown = self.tracer._agent.metrics.get_metricset(
                 "elasticapm.metrics.sets.breakdown.BreakdownMetricSet"
             )
         except (LookupError, AttributeError):
             self._breakdown = None
+        # in long-transaction mode, transaction_max_spans limits the spans started per window
+        self._window_ns = duration_to_ns(tracer.config.transaction_max_spans_window)
+        self._window_span_base = 0
+        self._window_dropped_base = 0
+        # unlike _span_counter, this isn't decremented for compressed or cancelled spans
+        self._spans_started = 0
+        self._window_started_base = 0
+        self._long_transaction_metrics = None
+        if self._window_ns:
+            try:
+                self._long_transaction_metrics = self.tracer._agent.metrics.get_metricset(
+                    "elasticapm.metrics.sets.long_transaction.LongTransactionMetricSet"
+                )
+            except (LookupError, AttributeError):
+                pass
         super().__init__(start=start)
+        self._window_start_ns = self.start_ns
         if links:
             for trace_parent in links:
                 self.add_link(trace_parent)
 
+    def synchronized(self, func: Callable, *args) -> Any:
+        """
+        Calls `func` with the bookkeeping lock of this transaction held
+        """
+        with self._bookkeeping_lock:
+            return func(*args)
+
     def end(self, skip_frames: int = 0, duration: Optional[timedelta] = None) -> None:
+        if self.tracer.loop_monitor is not None:
+            self.tracer.loop_monitor.transaction_ending(self)
         super().end(skip_frames, duration)
+        if self._window_ns and (self._window_start_ns != self.start_ns or self.duration_ns >= self._window_ns):
+            # report the progress of the last window of a long transaction
+            self._report_progress(self.duration_ns)
+        if self._tail_buffer_lock is not None:
+            self._finish_tail_sampling()
+        if self._profile is not None:
+            self.tracer.profiler.transaction_ended(self)
+        if self.tracer.watchdog is not None:
+            self.tracer.watchdog.transaction_ended(self)
         if self._breakdown:
-            for (span_type, span_subtype), timer in self._span_timers.items():
+            for (span_type, span_subtype), timer in (self._span_timers or {}).items():
                 labels = {
                     "span.type": span_type,
                     "transaction.name": self.name,
@@ -273,7 +487,86 @@ class Transaction(BaseSpan):
                     reset_on_collect=True,
                     unit="us",
                     **{"span.type": "app", "transaction.name": self.name, "transaction.type": self.transaction_type},
-                ).update((self.duration - self._child_durations.duration).total_seconds() * 1_000_000)
+                ).update((self.duration_ns - self.child_durations_ns) / 1_000)
+
+    def _check_window(self) -> None:
+        """
+        Starts a new window of the long-transaction mode, if the current one is over. The span budget is reset,
+        spans held back for compression are reported, and the progress of the transaction is recorded.
+        """
+        now_ns = _time_ns_func()
+        if now_ns - self._window_start_ns < self._window_ns:
+            return
+        self.synchronized(self._start_window, now_ns)
+
+    def _start_window(self, now_ns: int) -> None:
+        if now_ns - self._window_start_ns < self._window_ns:
+            # another thread started a new window already
+            return
+        self._window_start_ns = now_ns
+        self.flush_compression_buffer()
+        self._report_progress(now_ns - self.start_ns)
+        self._window_span_base = self._span_counter
+
+    def _report_progress(self, duration_ns: int) -> None:
+        if self._long_transaction_metrics is not None:
+            self._long_transaction_metrics.report_progress(
+                self,
+                spans_started=self._spans_started - self._window_started_base,
+                spans_dropped=self.dropped_spans - self._window_dropped_base,
+                duration_ns=duration_ns,
+            )
+        self._window_started_base = self._spans_started
+        self._window_dropped_base = self.dropped_spans
+
+    def buffer_span(self, span: "Span") -> bool:
+        """
+        Holds back an ended span until the tail sampling decision for this transaction is made.
+        Spans that end after the decision are dropped if the spans of the transaction were discarded.
+
+        :return: False if the span should be queued right away
+        """
+        with self._tail_buffer_lock:
+            if self._tail_buffer is None and self._tail_sampling_kept:
+                return False
+            if self._tail_buffer is None or not self.tracer.tail_sampler.acquire():
+                self._discard_span(span)
+            else:
+                self._tail_buffer.append(span)
+            return True
+
+    def _finish_tail_sampling(self) -> None:
+        tail_sampler = self.tracer.tail_sampler
+        with self._tail_buffer_lock:
+            spans, self._tail_buffer = self._tail_buffer, None
+            if spans is None:
+                # already decided
+                return
+            self._tail_sampling_kept = tail_sampler.should_keep(self)
+        tail_sampler.release(len(spans))
+        for span in spans:
+            if self._tail_sampling_kept:
+                span.queue()
+            else:
+                self._discard_span(span)
+
+    def _discard_span(self, span: "Span") -> None:
+        # spans discarded by tail sampling are counted as dropped, not as started
+        self.track_dropped_span(span)
+        self.dropped_spans += 1
+        self._span_counter -= 1
+
+    @property
+    def config_span_compression_exact_match_max_duration(self) -> timedelta:
+        return ns_to_timedelta(self.config_duration_thresholds.compression_exact_match_max)
+
+    @property
+    def config_span_compression_same_kind_max_duration(self) -> timedelta:
+        return ns_to_timedelta(self.config_duration_thresholds.compression_same_kind_max)
+
+    @property
+    def config_exit_span_min_duration(self) -> timedelta:
+        return ns_to_timedelta(self.config_duration_thresholds.exit_span_min)
 
     def _begin_span(
         self,
@@ -290,11 +583,16 @@ class Transaction(BaseSpan):
         auto_activate=True,
         links: Optional[Sequence[TraceParent]] = None,
     ):
+        if self._window_ns:
+            self._check_window()
         parent_span = execution_context.get_span()
         tracer = self.tracer
         if parent_span and parent_span.leaf:
             span = DroppedSpan(parent_span, leaf=True)
-        elif self.config_transaction_max_spans and self._span_counter > self.config_transaction_max_spans - 1:
+        elif (
+            self.config_transaction_max_spans
+            and self._span_counter - self._window_span_base > self.config_transaction_max_spans - 1
+        ):
             self.dropped_spans += 1
             span = DroppedSpan(parent_span, context=context)
         else:
@@ -313,8 +611,10 @@ class Transaction(BaseSpan):
                 start=start,
                 links=links,
             )
-            span.frames = tracer.frames_collector_func()
+            if self.config_duration_thresholds.stack_trace_min >= 0:
+                span.frames = tracer.frames_collector_func()
             self._span_counter += 1
+            self._spans_started += 1
         if auto_activate:
             execution_context.set_span(span)
         return span
@@ -397,13 +697,13 @@ class Transaction(BaseSpan):
         # This copy() only covers top level `.pop()` calls, so if we ever start
         # modifying nested data, we'll need to do a deep copy.
         context = self.context.copy()
-        context["tags"] = self.labels
+        context["tags"] = self._labels if self._labels is not None else {}
         result = {
             "id": self.id,
             "trace_id": self.trace_parent.trace_id,
             "name": encoding.keyword_field(self.name or ""),
             "type": encoding.keyword_field(self.transaction_type),
-            "duration": self.duration.total_seconds() * 1000 if self.duration else None,
+            "duration": self.duration_ns / 1_000_000 if self.duration_ns is not None else None,
             "result": encoding.keyword_field(str(self.result)),
             "timestamp": int(self.timestamp * 1_000_000),  # microseconds
             "outcome": self.outcome,
@@ -453,11 +753,15 @@ class Transaction(BaseSpan):
             result["context"] = context
         return result
 
-    def track_span_duration(self, span_type, span_subtype, self_duration) -> None:
+    def track_span_duration(self, span_type, span_subtype, self_duration_ns) -> None:
         # TODO: once asynchronous spans are supported, we should check if the transaction is already finished
         # TODO: and, if it has, exit without tracking.
-        with self._span_timers_lock:
-            self._span_timers[(span_type, span_subtype)].update(self_duration.total_seconds() * 1_000_000)
+        self.synchronized(self._update_span_timer, span_type, span_subtype, self_duration_ns)
+
+    def _update_span_timer(self, span_type, span_subtype, self_duration_ns) -> None:
+        if self._span_timers is None:
+            self._span_timers = defaultdict(Timer)
+        self._span_timers[(span_type, span_subtype)].update(self_duration_ns / 1_000)
 
     @property
     def is_sampled(self) -> bool:
@@ -481,16 +785,23 @@ class Transaction(BaseSpan):
         return self._tracer
 
     def track_dropped_span(self, span: SpanType) -> None:
-        with self._span_timers_lock:
-            try:
-                resource = span.context["destination"]["service"]["resource"]
-                target_type = nested_key(span.context, "service", "target", "type")
-                target_name = nested_key(span.context, "service", "target", "name")
-                stats = self._dropped_span_statistics[(resource, span.outcome, target_type, target_name)]
-                stats["count"] += 1
-                stats["duration.sum.us"] += int(span.duration.total_seconds() * 1_000_000)
-            except KeyError:
-                pass
+        self.synchronized(self._update_dropped_span_statistics, span)
+
+    def _update_dropped_span_statistics(self, span: SpanType) -> None:
+        try:
+            resource = span.context["destination"]["service"]["resource"]
+            target_type = nested_key(span.context, "service", "target", "type")
+            target_name = nested_key(span.context, "service", "target", "name")
+        except KeyError:
+            return
+        if self._dropped_span_statistics is None:
+            self._dropped_span_statistics = {}
+        key = (resource, span.outcome, target_type, target_name)
+        stats = self._dropped_span_statistics.get(key)
+        if stats is None:
+            stats = self._dropped_span_statistics[key] = {"count": 0, "duration.sum.us": 0}
+        stats["count"] += 1
+        stats["duration.sum.us"] += span.duration_ns // 1_000
 
 
 class Span(BaseSpan):
@@ -505,16 +816,11 @@ class Span(BaseSpan):
         "leaf",
         "dist_tracing_propagated",
         "timestamp",
-        "start_time",
-        "ended_time",
-        "duration",
         "parent",
         "parent_span_id",
         "frames",
-        "labels",
         "sync",
-        "outcome",
-        "_child_durations",
+        "composite",
         "_cancelled",
     )
 
@@ -533,6 +839,7 @@ class Span(BaseSpan):
         sync: Optional[bool] = None,
         start: Optional[float] = None,
         links: Optional[Sequence[TraceParent]] = None,
+        start_ns: Optional[int] = None,
     ) -> None:
         """
         Create a new Span
@@ -548,6 +855,8 @@ class Span(BaseSpan):
         :param span_action: sub type of the span, e.g. query
         :param sync: indicate if the span was executed synchronously or asynchronously
         :param start: timestamp, mostly useful for testing
+        :param links: an optional list of traceparents to link this span with
+        :param start_ns: start on the perf_counter clock in nanoseconds, e.g. of a span that is created after the fact
         """
         self.id = self.get_dist_tracing_id()
         self.transaction = transaction
@@ -566,13 +875,13 @@ class Span(BaseSpan):
         self.subtype = span_subtype
         self.action = span_action
         self.dist_tracing_propagated = False
-        self.composite: Dict[str, Any] = {}
+        self.composite: Optional[Dict[str, Any]] = None
         self._cancelled: bool = False
-        super().__init__(labels=labels, start=start, links=links)
-        self.timestamp = transaction.timestamp + (self.start_time - transaction.start_time)
+        super().__init__(labels=labels, start=start, links=links, start_ns=start_ns)
+        self.timestamp = transaction.timestamp + (self.start_ns - transaction.start_ns) / 1_000_000_000
         if self.transaction._breakdown:
             p = self.parent if self.parent else self.transaction
-            p.child_started(self.start_time)
+            p.child_started(self.start_ns)
 
     def to_dict(self) -> dict:
         if (
@@ -594,44 +903,44 @@ class Span(BaseSpan):
             "subtype": encoding.keyword_field(self.subtype),
             "action": encoding.keyword_field(self.action),
             "timestamp": int(self.timestamp * 1000000),  # microseconds
-            "duration": self.duration.total_seconds() * 1000,
+            "duration": self.duration_ns / 1_000_000,
             "outcome": self.outcome,
         }
         if self.transaction.sample_rate is not None:
             result["sample_rate"] = float(self.transaction.sample_rate)
         if self.sync is not None:
             result["sync"] = self.sync
-        if self.labels:
-            if self.context is None:
-                self.context = {}
-            self.context["tags"] = self.labels
+        self.autofill_resource_context()
+        # work on a copy of the context, deferred spans are serialized on the event processor thread
+        context = dict(self.context) if self.context else {}
+        if self._labels:
+            context["tags"] = self._labels
         if self.links:
             result["links"] = self.links
-        if self.context:
-            self.autofill_resource_context()
+        if context:
             # otel attributes and spankind need to be top-level
-            if "otel_spankind" in self.context:
-                result["otel"] = {"span_kind": self.context.pop("otel_spankind")}
+            if "otel_spankind" in context:
+                result["otel"] = {"span_kind": context.pop("otel_spankind")}
             if self.tracer._agent.check_server_version(gte=(7, 16)):
-                if "otel_attributes" in self.context:
+                if "otel_attributes" in context:
                     if "otel" not in result:
-                        result["otel"] = {"attributes": self.context.pop("otel_attributes")}
+                        result["otel"] = {"attributes": context.pop("otel_attributes")}
                     else:
-                        result["otel"]["attributes"] = self.context.pop("otel_attributes")
+                        result["otel"]["attributes"] = context.pop("otel_attributes")
             else:
                 # Attributes map to labels for older versions
-                attributes = self.context.pop("otel_attributes", {})
-                if attributes and ("tags" not in self.context):
-                    self.context["tags"] = {}
-                for key, value in attributes.items():
-                    self.context["tags"][key] = value
-            result["context"] = self.context
+                attributes = context.pop("otel_attributes", {})
+                if attributes:
+                    context["tags"] = tags = dict(context.get("tags") or {})
+                    for key, value in attributes.items():
+                        tags[key] = value
+            result["context"] = context
         if self.frames:
             result["stacktrace"] = self.frames
         if self.composite:
             result["composite"] = {
                 "compression_strategy": self.composite["compression_strategy"],
-                "sum": self.composite["sum"].total_seconds() * 1000,
+                "sum": self.composite["sum"] / 1_000_000,
                 "count": self.composite["count"],
             }
         return result
@@ -692,11 +1001,8 @@ class Span(BaseSpan):
         self.autofill_service_target()
         super().end(skip_frames, duration)
         tracer = self.transaction.tracer
-        if (
-            tracer.span_stack_trace_min_duration >= timedelta(seconds=0)
-            and self.duration >= tracer.span_stack_trace_min_duration
-            and self.frames
-        ):
+        stack_trace_min_duration = self.transaction.config_duration_thresholds.stack_trace_min
+        if stack_trace_min_duration >= 0 and self.duration_ns >= stack_trace_min_duration and self.frames:
             self.frames = tracer.frames_processing_func(self.frames)[skip_frames:]
         else:
             self.frames = None
@@ -708,18 +1014,27 @@ class Span(BaseSpan):
 
         p = self.parent if self.parent else self.transaction
         if self.transaction._breakdown:
-            p._child_durations.stop(self.start_time + self.duration.total_seconds())
-            self.transaction.track_span_duration(
-                self.type, self.subtype, self.duration - self._child_durations.duration
-            )
+            p.child_stopped(self.start_ns + self.duration_ns)
+            self.transaction.track_span_duration(self.type, self.subtype, self.duration_ns - self.child_durations_ns)
         p.child_ended(self)
 
     def report(self) -> None:
-        if self.discardable and self.duration < self.transaction.config_exit_span_min_duration:
+        if self.discardable and self.duration_ns < self.transaction.config_duration_thresholds.exit_span_min:
             self.transaction.track_dropped_span(self)
             self.transaction.dropped_spans += 1
         elif self._cancelled:
             self.transaction._span_counter -= 1
+        elif self.tracer.shed_event(SPAN):
+            # the event queue is filling up, make room for more important events
+            self.transaction.track_dropped_span(self)
+            self.transaction.dropped_spans += 1
+        elif self.transaction._tail_buffer_lock is None or not self.transaction.buffer_span(self):
+            self.queue()
+
+    def queue(self) -> None:
+        if self.transaction.config_defer_span_serialization:
+            # the span is done, it is serialized by calling to_dict() on the event processor thread
+            self.tracer.queue_func(SPAN, self)
         else:
             self.tracer.queue_func(SPAN, self.to_dict())
 
@@ -731,10 +1046,10 @@ class Span(BaseSpan):
             return False
 
         if not self.composite:
-            self.composite = {"compression_strategy": compression_strategy, "count": 1, "sum": self.duration}
+            self.composite = {"compression_strategy": compression_strategy, "count": 1, "sum": self.duration_ns}
         self.composite["count"] += 1
-        self.composite["sum"] += sibling.duration
-        self.duration = timedelta(seconds=sibling.ended_time - self.start_time)
+        self.composite["sum"] += sibling.duration_ns
+        self.duration_ns = sibling.ended_ns - self.start_ns
         self.transaction._span_counter -= 1
         return True
 
@@ -744,7 +1059,7 @@ class Span(BaseSpan):
                 "exact_match"
                 if (
                     self.is_exact_match(sibling)
-                    and sibling.duration <= self.transaction.config_span_compression_exact_match_max_duration
+                    and sibling.duration_ns <= self.transaction.config_duration_thresholds.compression_exact_match_max
                 )
                 else None
             )
@@ -753,7 +1068,7 @@ class Span(BaseSpan):
                 "same_kind"
                 if (
                     self.is_same_kind(sibling)
-                    and sibling.duration <= self.transaction.config_span_compression_same_kind_max_duration
+                    and sibling.duration_ns <= self.transaction.config_duration_thresholds.compression_same_kind_max
                 )
                 else None
             )
@@ -763,12 +1078,12 @@ class Span(BaseSpan):
         if not self.is_same_kind(sibling):
             return None
         if self.name == sibling.name:
-            max_duration = self.transaction.config_span_compression_exact_match_max_duration
-            if self.duration <= max_duration and sibling.duration <= max_duration:
+            max_duration = self.transaction.config_duration_thresholds.compression_exact_match_max
+            if self.duration_ns <= max_duration and sibling.duration_ns <= max_duration:
                 return "exact_match"
             return None
-        max_duration = self.transaction.config_span_compression_same_kind_max_duration
-        if self.duration <= max_duration and sibling.duration <= max_duration:
+        max_duration = self.transaction.config_duration_thresholds.compression_same_kind_max
+        if self.duration_ns <= max_duration and sibling.duration_ns <= max_duration:
             return "same_kind"
         return None
 
@@ -855,7 +1170,7 @@ class Span(BaseSpan):
 
 
 class DroppedSpan(BaseSpan):
-    __slots__ = ("leaf", "parent", "id", "context", "outcome", "dist_tracing_propagated")
+    __slots__ = ("leaf", "parent", "id", "context", "dist_tracing_propagated")
 
     def __init__(self, parent, leaf=False, start=None, context=None) -> None:
         self.parent = parent
@@ -873,6 +1188,9 @@ class DroppedSpan(BaseSpan):
     def child_started(self, timestamp) -> None:
         pass
 
+    def child_stopped(self, timestamp) -> None:
+        pass
+
     def child_ended(self, child: SpanType) -> None:
         pass
 
@@ -915,6 +1233,53 @@ class Tracer(object):
         self.frames_collector_func = frames_collector_func
         self._agent = agent
         self._ignore_patterns = [re.compile(p) for p in config.transactions_ignore_patterns or []]
+        self._duration_thresholds = (None, None)
+        self.tail_sampler = TailSampler.from_config(config) if config.tail_sampling else None
+        self.adaptive_sampler = AdaptiveSampler()
+        self._sampling_rules = (None, None)
+        # set by the client if profiling_inferred_spans_enabled is set
+        self.profiler = None
+        # set by the client if slow_transaction_threshold is set
+        self.watchdog = None
+        # set by the client if event_loop_block_threshold is set
+        self.loop_monitor = None
+
+    def shed_event(self, event_type: str) -> bool:
+        """
+        Returns True if the transport is dropping events of the given type to make room for more important events
+        """
+        transport = getattr(self._agent, "_transport", None)
+        return transport is not None and transport.shed_event(event_type)
+
+    @property
+    def duration_thresholds(self) -> DurationThresholds:
+        """
+        Duration thresholds from the configuration, converted to nanoseconds once per configuration version
+        """
+        # a VersionedConfig replaces its current Config object on every update
+        current_config = getattr(self.config, "current_config", None)
+        config, thresholds = self._duration_thresholds
+        if thresholds is None or current_config is None or config is not current_config:
+            thresholds = DurationThresholds(
+                exit_span_min=duration_to_ns(self.config.exit_span_min_duration),
+                compression_exact_match_max=duration_to_ns(self.config.span_compression_exact_match_max_duration),
+                compression_same_kind_max=duration_to_ns(self.config.span_compression_same_kind_max_duration),
+                stack_trace_min=duration_to_ns(self.span_stack_trace_min_duration),
+            )
+            self._duration_thresholds = (current_config, thresholds)
+        return thresholds
+
+    @property
+    def sampling_rules(self) -> SamplingRules:
+        """
+        The compiled transaction_sampling_rules, recompiled when the setting changes
+        """
+        rules = self.config.transaction_sampling_rules
+        config_rules, sampling_rules = self._sampling_rules
+        if sampling_rules is None or config_rules is not rules:
+            sampling_rules = SamplingRules(rules or [])
+            self._sampling_rules = (rules, sampling_rules)
+        return sampling_rules
 
     @property
     def span_stack_trace_min_duration(self) -> timedelta:
@@ -944,6 +1309,8 @@ class Tracer(object):
         start: Optional[float] = None,
         auto_activate: bool = True,
         links: Optional[Sequence[TraceParent]] = None,
+        name: Optional[str] = None,
+        url: Optional[str] = None,
     ) -> Transaction:
         """
         Start a new transactions and bind it in a thread-local variable
@@ -953,6 +1320,8 @@ class Tracer(object):
         :param start: override the start timestamp, mostly useful for testing
         :param auto_activate: whether to set this transaction in execution_context
         :param links: list of traceparents to causally link this transaction to
+        :param name: name of the transaction, if it is known when the transaction starts
+        :param url: URL path of the request, if the transaction is an HTTP request
         :returns the Transaction object
         """
         links = links if links else []
@@ -967,9 +1336,32 @@ class Tracer(object):
             ):
                 links.append(trace_parent)
                 trace_parent = None
+        rule_decision = None
+        if not trace_parent and self.config.transaction_sampling_rules:
+            subject = url if url is not None else name
+            if subject is not None:
+                rule_decision = self.sampling_rules.sample(subject)
         if trace_parent:
             is_sampled = bool(trace_parent.trace_options.recorded)
             sample_rate = trace_parent.tracestate_dict.get(constants.TRACESTATE.SAMPLE_RATE)
+        elif rule_decision is not None:
+            is_sampled, rate = rule_decision
+            sample_rate = str(rate) if is_sampled else "0"
+        elif self.tail_sampler:
+            # all transactions are recorded, which spans to keep is decided when the transaction ends. Until then,
+            # the trace is propagated as sampled, so downstream services keep their spans regardless of the decision
+            is_sampled = True
+            sample_rate = "1.0"
+        elif self.config.transaction_sample_target:
+            if name is not None:
+                key = name
+            elif url is not None:
+                # HTTP transactions are named once the route is known, estimate the rate per endpoint instead
+                key = "{} {}".format(transaction_type, normalize_url_path(url))
+            else:
+                key = transaction_type
+            is_sampled, rate = self.adaptive_sampler.sample(key, self.config.transaction_sample_target)
+            sample_rate = str(rate) if is_sampled else "0"
         else:
             is_sampled = (
                 self.config.transaction_sample_rate == 1.0 or self.config.transaction_sample_rate > random.random()
@@ -988,10 +1380,16 @@ class Tracer(object):
             sample_rate=sample_rate,
             links=links,
         )
+        if name is not None:
+            transaction.name = name
         if trace_parent is None:
             transaction.trace_parent.add_tracestate(constants.TRACESTATE.SAMPLE_RATE, sample_rate)
         if auto_activate:
             execution_context.set_transaction(transaction)
+            if self.profiler is not None and is_sampled:
+                self.profiler.transaction_started(transaction)
+            if self.watchdog is not None:
+                self.watchdog.transaction_started(transaction)
         return transaction
 
     def end_transaction(self, result=None, transaction_name=None, duration=None):
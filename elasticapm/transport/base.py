@@ -32,6 +32,7 @@
 
 import gzip
 import io
+import itertools
 import os
 import queue as _queue
 import random
@@ -41,12 +42,22 @@ import time
 import timeit
 from collections import defaultdict
 
+from elasticapm.conf.constants import ERROR, METRICSET, SPAN, TRANSACTION
+from elasticapm.transport.exceptions import TransportException
+from elasticapm.transport.spool import DiskSpool
 from elasticapm.utils import json_encoder
 from elasticapm.utils.logging import get_logger
 from elasticapm.utils.threading import ThreadManager
 
 logger = get_logger("elasticapm.transport")
 
+# number of stripes that events are batched in before they are handed over to the event queue
+EVENT_QUEUE_STRIPES = 8
+
+# fill ratio of the event queue from which on events of a type are dropped to make room for more important events.
+# Errors are only dropped if the queue is full.
+SHEDDING_WATERMARKS = {SPAN: 0.8, METRICSET: 0.9, TRANSACTION: 0.95, ERROR: 1.0}
+
 
 class Transport(ThreadManager):
     """
@@ -77,17 +88,30 @@ class Transport(ThreadManager):
         self.client = client
         self.state = TransportState()
         self._metadata = None
+        self._metadata_cache = None
         self._compress_level = min(9, max(0, compress_level if compress_level is not None else 0))
         self._json_serializer = json_serializer
         self._queued_data = None
         self._event_queue = self._init_event_queue(chill_until=queue_chill_count, max_chill_time=queue_chill_time)
         self._is_chilled_queue = isinstance(self._event_queue, ChilledQueue)
+        self._queue_chill_time = queue_chill_time
+        self._event_stripes = self._init_event_stripes(chill_until=queue_chill_count)
         self._thread = None
         self._last_flush = timeit.default_timer()
         self._counts = defaultdict(int)
+        self._dropped = defaultdict(int)
+        self._processor_dropped = defaultdict(int)
+        self._buffered_bytes = 0
+        self._stats_lock = threading.Lock()
+        self._request_stats = defaultdict(int)
         self._flushed = threading.Event()
         self._closed = False
         self._processors = processors if processors is not None else []
+        self._spool = self._init_spool()
+        self._max_inflight_requests = client.config.api_request_max_inflight if client else 0
+        self._send_queue = None
+        self._inflight_requests = None
+        self._sender_threads = []
         super(Transport, self).__init__()
         self.start_stop_order = sys.maxsize  # ensure that the transport thread is always started/stopped last
 
@@ -99,14 +123,172 @@ class Transport(ThreadManager):
     def _max_buffer_size(self):
         return self.client.config.api_request_size if self.client else None
 
+    @property
+    def _memory_budget(self):
+        return self.client.config.transport_memory_budget if self.client else None
+
+    @property
+    def _processors(self):
+        return self._processor_list
+
+    @_processors.setter
+    def _processors(self, processors):
+        self._processor_list = processors
+        self._compile_processor_chains()
+
+    @property
+    def dropped_counts(self):
+        """
+        Number of events dropped due to a full event queue, by event type
+        """
+        return dict(self._dropped)
+
     def queue(self, event_type, data, flush=False) -> None:
+        if self.shed_event(event_type):
+            return
+        size = estimate_size(data) if data is not None and self._memory_budget else 0
         try:
             self._flushed.clear()
-            kwargs = {"chill": not (event_type == "close" or flush)} if self._is_chilled_queue else {}
+            if self._event_stripes is not None and not (event_type == "close" or flush):
+                batch = self._event_stripes.append((event_type, data, flush), size=size)
+                if batch:
+                    self._put_batch(*batch)
+                return
+            kwargs = {"chill": not (event_type == "close" or flush), "size": size} if self._is_chilled_queue else {}
             self._event_queue.put((event_type, data, flush), block=False, **kwargs)
 
         except _queue.Full:
             logger.debug("Event of type %s dropped due to full event queue", event_type)
+            self._dropped[event_type] += 1
+
+    def _put_batch(self, items, size) -> None:
+        """
+        Put a batch of events from the stripes into the event queue. As the queue might have filled up since
+        the events were added to the stripe, they are shed individually, by the watermark of their type.
+        """
+        fill_ratio = self._queue_fill_ratio()
+        kept = []
+        for item in items:
+            watermark = SHEDDING_WATERMARKS.get(item[0])
+            if watermark is not None and fill_ratio >= watermark:
+                self._dropped[item[0]] += 1
+            else:
+                kept.append(item)
+        if not kept:
+            return
+        if len(kept) < len(items):
+            size = size * len(kept) // len(items)
+        try:
+            # a full batch is worth waking up the event processor thread for
+            self._event_queue.put(("batch", kept, False), block=False, chill=False, weight=len(kept), size=size)
+        except _queue.Full:
+            logger.debug("Batch of %d events dropped due to full event queue", len(kept))
+            for item in kept:
+                self._dropped[item[0]] += 1
+
+    def shed_event(self, event_type) -> bool:
+        """
+        Decide if an event should be dropped to make room for events of higher priority, because the
+        event queue is filling up, or the queued events are taking up most of the memory budget.
+        Spans are dropped first, followed by metricsets, transactions, and finally errors.
+
+        :param event_type: the type of the event
+        :return: True if the event should be dropped, in which case it is counted as dropped
+        """
+        watermark = SHEDDING_WATERMARKS.get(event_type)
+        if watermark is None or self._queue_fill_ratio() < watermark:
+            return False
+        self._dropped[event_type] += 1
+        return True
+
+    def _queue_fill_ratio(self) -> float:
+        """
+        The fill ratio of the event queue, either by the number of queued events, or by their estimated size,
+        whichever is higher.
+        """
+        event_queue = self._event_queue
+        if event_queue is None or not event_queue.maxsize:
+            return 0.0
+        ratio = self._queued_events() / event_queue.maxsize
+        memory_budget = self._memory_budget
+        if memory_budget:
+            ratio = max(ratio, self._queued_bytes() / memory_budget)
+        return ratio
+
+    def _queued_bytes(self) -> int:
+        """
+        Estimated size of the queued events and the buffer that is currently being filled
+        """
+        size = self._buffered_bytes
+        if self._is_chilled_queue:
+            size += self._event_queue.bytes
+        if self._event_stripes is not None:
+            size += self._event_stripes.bytes
+        return size
+
+    def _queued_events(self) -> int:
+        event_queue = self._event_queue
+        if event_queue is None:
+            return 0
+        # ChilledQueue.qsize() would take the queue lock, a slightly outdated value is good enough
+        return event_queue._qsize() if self._is_chilled_queue else event_queue.qsize()
+
+    def _inflight_request_count(self) -> int:
+        return self._send_queue.unfinished_tasks if self._send_queue is not None else 0
+
+    def _record_batch(self, buffer, compressed_size) -> None:
+        """
+        Record the size of a batch before and after compression.
+        """
+        uncompressed_size = getattr(buffer, "size", 0) + getattr(buffer, "prefix_size", 0)
+        with self._stats_lock:
+            self._request_stats["bytes.uncompressed"] += uncompressed_size
+            self._request_stats["bytes.compressed"] += compressed_size
+
+    def _record_request(self, size, duration, failed=False) -> None:
+        with self._stats_lock:
+            stats = self._request_stats
+            stats["count"] += 1
+            if failed:
+                stats["failed"] += 1
+            else:
+                stats["bytes"] += size
+            stats["duration"] += duration
+            stats["duration.max"] = max(stats["duration.max"], duration)
+
+    def get_stats(self):
+        """
+        Returns a snapshot of statistics about the events handled by this transport.
+        All counters are totals since the transport was created.
+        """
+        with self._stats_lock:
+            requests = dict(self._request_stats)
+        uncompressed = requests.pop("bytes.uncompressed", 0)
+        compressed = requests.pop("bytes.compressed", 0)
+        stats = {
+            "events": dict(self._counts),
+            "dropped": dict(self._dropped),
+            "dropped_by_processors": dict(self._processor_dropped),
+            "queue": {
+                "events": self._queued_events(),
+                "bytes": self._queued_bytes(),
+                "fill_ratio": self._queue_fill_ratio(),
+            },
+            "requests": {
+                "count": requests.get("count", 0),
+                "failed": requests.get("failed", 0),
+                "inflight": self._inflight_request_count(),
+                "bytes": requests.get("bytes", 0),
+                "duration": requests.get("duration", 0.0),
+                "duration.max": requests.get("duration.max", 0.0),
+            },
+            "compression_ratio": (compressed / uncompressed) if uncompressed else None,
+            "backoff": {"active": self.state.did_fail(), "time": self.state.backoff_time()},
+        }
+        if self._spool:
+            pending, pending_bytes = self._spool.pending()
+            stats["spool"] = dict(self._spool.counts, pending=pending, pending_bytes=pending_bytes)
+        return stats
 
     def _process_queue(self) -> None:
         # Rebuild the metadata to capture new process information
@@ -119,17 +301,51 @@ class Transport(ThreadManager):
         max_flush_time = (
             self._max_flush_time_seconds * random.uniform(0.9, 1.1) if self._max_flush_time_seconds else None
         )
+        last_drain = timeit.default_timer()
 
         while True:
             since_last_flush = timeit.default_timer() - self._last_flush
             # take max flush time into account to calculate timeout
             timeout = max(0, max_flush_time - since_last_flush) if max_flush_time else None
-            timed_out = False
+            get_timeout = timeout
+            if self._event_stripes is not None and (timeout is None or timeout > self._queue_chill_time):
+                # wake up regularly to collect events from stripes that don't fill up
+                get_timeout = self._queue_chill_time
+            timed_out = idle = False
             try:
-                event_type, data, flush = self._event_queue.get(block=True, timeout=timeout)
+                event_type, data, flush = self._event_queue.get(block=True, timeout=get_timeout)
             except _queue.Empty:
                 event_type, data, flush = None, None, None
-                timed_out = True
+                idle = True
+                timed_out = get_timeout == timeout
+
+            if event_type == "batch":
+                events = data
+            elif data is not None:
+                events = [(event_type, data, flush)]
+            else:
+                events = []
+            if self._event_stripes is not None and (
+                idle
+                or timeout == 0
+                or flush
+                or event_type == "close"
+                or timeit.default_timer() - last_drain >= self._queue_chill_time
+            ):
+                # collect events that haven't been handed over from the stripes yet, at least once per chill time
+                # so that events of threads that rarely fill their stripe aren't held back under load
+                events = self._event_stripes.drain() + events
+                last_drain = timeit.default_timer()
+
+            for item_type, item_data, _ in events:
+                item_data = self._process_event(item_type, item_data)
+                if item_data is not None:
+                    if not buffer_written:
+                        # Write metadata just in time to allow for late metadata changes (such as in lambda)
+                        self._write_metadata(buffer)
+                    buffer.write((self._json_serializer({item_type: item_data}) + "\n").encode("utf-8"))
+                    buffer_written = True
+                    self._counts[item_type] += 1
 
             if event_type == "close":
                 if buffer_written:
@@ -140,20 +356,12 @@ class Transport(ThreadManager):
                             "Exception occurred while flushing the buffer "
                             "before closing the transport connection: {0}".format(exc)
                         )
+                self._stop_senders()
                 self._flushed.set()
                 return  # time to go home!
 
-            if data is not None:
-                data = self._process_event(event_type, data)
-                if data is not None:
-                    if not buffer_written:
-                        # Write metadata just in time to allow for late metadata changes (such as in lambda)
-                        self._write_metadata(buffer)
-                    buffer.write((self._json_serializer({event_type: data}) + "\n").encode("utf-8"))
-                    buffer_written = True
-                    self._counts[event_type] += 1
-
             queue_size = 0 if buffer.fileobj is None else buffer.fileobj.tell()
+            self._buffered_bytes = queue_size
 
             forced_flush = flush
             if forced_flush:
@@ -180,42 +388,78 @@ class Transport(ThreadManager):
                     # No data on buffer, but due to manual flush we should send
                     # an empty payload with flushed=true query param, but only
                     # to a local APM server (or lambda extension)
+                    self._wait_for_senders()
                     try:
                         self.send("", forced_flush=True)
                         self.handle_transport_success()
                     except Exception as e:
                         self.handle_transport_fail(e)
+                if forced_flush:
+                    self._wait_for_senders()
                 self._last_flush = timeit.default_timer()
                 buffer = self._init_buffer()
                 buffer_written = False
+                self._buffered_bytes = 0
                 max_flush_time = (
                     self._max_flush_time_seconds * random.uniform(0.9, 1.1) if self._max_flush_time_seconds else None
                 )
                 self._flushed.set()
 
+    def _compile_processor_chains(self):
+        """
+        Pre-computes the processors that apply to each of the known event types,
+        so that processing an event doesn't have to filter the full processor list.
+
+        Chains are recompiled when the configuration version changes.
+        """
+        self._processor_chains_version = self.client.config.config_version if self.client else None
+        self._processor_chains = {
+            event_type: self._build_processor_chain(event_type) for event_type in (ERROR, TRANSACTION, SPAN, METRICSET)
+        }
+
+    def _build_processor_chain(self, event_type):
+        return tuple(
+            processor
+            for processor in self._processors
+            if not hasattr(processor, "event_types") or event_type in processor.event_types
+        )
+
+    def _processor_chain(self, event_type):
+        if self.client and self.client.config.config_version != self._processor_chains_version:
+            self._compile_processor_chains()
+        try:
+            return self._processor_chains[event_type]
+        except KeyError:
+            chain = self._processor_chains[event_type] = self._build_processor_chain(event_type)
+            return chain
+
     def _process_event(self, event_type, data):
+        if hasattr(data, "to_dict"):
+            # events that are queued unserialized, like ended spans with defer_span_serialization
+            data = data.to_dict()
         # Run the data through processors
-        for processor in self._processors:
-            if not hasattr(processor, "event_types") or event_type in processor.event_types:
-                try:
-                    data = processor(self.client, data)
-                    if not data:
-                        logger.debug(
-                            "Dropped event of type %s due to processor %s.%s",
-                            event_type,
-                            processor.__module__,
-                            processor.__name__,
-                        )
-                        return None
-                except Exception:
-                    logger.warning(
-                        "Dropped event of type %s due to exception in processor %s.%s",
+        for processor in self._processor_chain(event_type):
+            try:
+                data = processor(self.client, data)
+                if not data:
+                    self._processor_dropped[event_type] += 1
+                    logger.debug(
+                        "Dropped event of type %s due to processor %s.%s",
                         event_type,
                         processor.__module__,
                         processor.__name__,
-                        exc_info=True,
                     )
                     return None
+            except Exception:
+                self._processor_dropped[event_type] += 1
+                logger.warning(
+                    "Dropped event of type %s due to exception in processor %s.%s",
+                    event_type,
+                    processor.__module__,
+                    processor.__name__,
+                    exc_info=True,
+                )
+                return None
         return data
 
     def _init_buffer(self):
@@ -223,8 +467,45 @@ class Transport(ThreadManager):
         return buffer
 
     def _write_metadata(self, buffer) -> None:
-        data = (self._json_serializer({"metadata": self._metadata}) + "\n").encode("utf-8")
-        buffer.write(data)
+        data, compressed = self._encoded_metadata()
+        fileobj = buffer.fileobj
+        if isinstance(fileobj, io.BytesIO) and not buffer.size:
+            # Only the gzip header of the buffer has been written so far. Put the pre-compressed metadata
+            # member in front of it, gzip decoders read concatenated members as one stream.
+            header = fileobj.getvalue()
+            fileobj.seek(0)
+            fileobj.truncate()
+            fileobj.write(compressed)
+            fileobj.write(header)
+            buffer.prefix_size = len(data)
+        else:
+            buffer.write(data)
+
+    def _encoded_metadata(self):
+        """
+        Returns the metadata line, JSON encoded and as a gzip member.
+
+        Encoding is cached until the metadata changes. Changes are detected by identity first, as the
+        metadata is rebuilt rather than modified, and by equality if a new metadata dict was built.
+        """
+        metadata = self._metadata
+        cache = self._metadata_cache
+        if cache is None or (cache[0] is not metadata and cache[0] != metadata):
+            data = (self._json_serializer({"metadata": metadata}) + "\n").encode("utf-8")
+            cache = (metadata, data, self._compress_member(data))
+        elif cache[0] is not metadata:
+            cache = (metadata, cache[1], cache[2])
+        self._metadata_cache = cache
+        return cache[1], cache[2]
+
+    def _compress_member(self, data: bytes) -> bytes:
+        """
+        Compresses data into a gzip member. Unlike gzip.compress(), this supports a fixed mtime on Python < 3.8.
+        """
+        fileobj = io.BytesIO()
+        with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self._compress_level, mtime=0) as member:
+            member.write(data)
+        return fileobj.getvalue()
 
     def _init_event_queue(self, chill_until, max_chill_time):
         # some libraries like eventlet monkeypatch queue.Queue and switch out the implementation.
@@ -232,42 +513,133 @@ class Transport(ThreadManager):
         # their queue and forgo the optimizations of ChilledQueue. In the case of eventlet, this
         # isn't really a loss, because the main reason for ChilledQueue (avoiding context switches
         # due to the event processor thread being woken up all the time) is not an issue.
+        # The attributes are set in __init__, so we need to check an instance
+        probe = _queue.Queue()
         if all(
             (
-                hasattr(_queue.Queue, "not_full"),
-                hasattr(_queue.Queue, "not_empty"),
-                hasattr(_queue.Queue, "unfinished_tasks"),
+                hasattr(probe, "not_full"),
+                hasattr(probe, "not_empty"),
+                hasattr(probe, "unfinished_tasks"),
             )
         ):
             return ChilledQueue(maxsize=10000, chill_until=chill_until, max_chill_time=max_chill_time)
         else:
             return _queue.Queue(maxsize=10000)
 
+    def _init_event_stripes(self, chill_until):
+        # batching events per thread only pays off if the queue wakes the event processor thread up lazily
+        if not self._is_chilled_queue:
+            return None
+        return EventStripes(stripes=EVENT_QUEUE_STRIPES, batch_size=max(1, chill_until))
+
+    def _init_spool(self):
+        if not self.client or not self.client.config.transport_spool_dir:
+            return None
+        config = self.client.config
+        try:
+            return DiskSpool(
+                config.transport_spool_dir,
+                max_size=config.transport_spool_max_size,
+                max_age=config.transport_spool_max_age.total_seconds(),
+            )
+        except OSError as e:
+            logger.error("Could not create spool directory %s: %s", config.transport_spool_dir, str(e))
+            return None
+
     def _flush(self, buffer, forced_flush=False) -> None:
         """
         Flush the queue. This method should only be called from the event processing queue
         :return: None
         """
-        if not self.state.should_try():
-            logger.error("dropping flushed data due to transport failure back-off")
-            buffer.close()
+        fileobj = buffer.fileobj  # get a reference to the fileobj before closing the gzip file
+        buffer.close()
+
+        data = fileobj.getbuffer()
+        self._record_batch(buffer, len(data))
+        if self._send_queue is not None:
+            # hand the data over to a sender thread, blocking if too many requests are in flight already
+            self._inflight_requests.acquire()
+            self._send_queue.put((data, forced_flush))
         else:
-            fileobj = buffer.fileobj  # get a reference to the fileobj before closing the gzip file
-            buffer.close()
+            self._send_data(data, forced_flush=forced_flush)
+
+    def _send_data(self, data, forced_flush=False) -> None:
+        """
+        Send the compressed data, or spool/drop it if the transport is backing off.
+        Releases the data once it has been handled.
+        """
+        try:
+            if not self.state.should_try():
+                if self._spool:
+                    if self._spool.put(data):
+                        logger.debug("spooled flushed data due to transport failure back-off")
+                else:
+                    logger.error("dropping flushed data due to transport failure back-off")
+            else:
+                start = timeit.default_timer()
+                try:
+                    self.send(data, forced_flush=forced_flush)
+                    self.handle_transport_success()
+                except Exception as e:
+                    self._record_request(len(data), timeit.default_timer() - start, failed=True)
+                    self.handle_transport_fail(e)
+                    # data that the APM Server rejected would be rejected again, so it is not spooled
+                    if self._spool and isinstance(e, TransportException) and e.retryable:
+                        self._spool.put(data)
+                else:
+                    self._record_request(len(data), timeit.default_timer() - start)
+                    self._drain_spool()
+        finally:
+            data.release()
+
+    def _process_send_queue(self) -> None:
+        while True:
+            item = self._send_queue.get()
+            try:
+                if item is None:
+                    return  # time to go home!
+                data, forced_flush = item
+                try:
+                    self._send_data(data, forced_flush=forced_flush)
+                except Exception:
+                    logger.error("Exception occurred while sending data", exc_info=True)
+                finally:
+                    self._inflight_requests.release()
+            finally:
+                self._send_queue.task_done()
+
+    def _wait_for_senders(self) -> None:
+        """
+        Block until all data that has been handed over to sender threads has been sent
+        """
+        if self._send_queue is not None:
+            self._send_queue.join()
+
+    def _stop_senders(self) -> None:
+        if self._send_queue is not None:
+            for _ in self._sender_threads:
+                self._send_queue.put(None)
+            self._send_queue.join()
+            self._sender_threads = []
 
-            data = fileobj.getbuffer()
+    def _drain_spool(self) -> None:
+        """
+        Send batches that were spooled while the APM Server was unreachable, oldest first
+        """
+        if self._spool:
             try:
-                self.send(data, forced_flush=forced_flush)
-                self.handle_transport_success()
+                self._spool.drain(self.send)
             except Exception as e:
                 self.handle_transport_fail(e)
 
-            data.release()
-
     def start_thread(self, pid=None) -> None:
         super(Transport, self).start_thread(pid=pid)
         if (not self._thread or self.pid != self._thread.pid) and not self._closed:
+            if self._thread and self._event_stripes is not None:
+                # the stripe locks might have been held by threads that don't exist in this process
+                self._event_stripes.reset()
             self.handle_fork()
+            self._start_senders()
             try:
                 self._thread = threading.Thread(target=self._process_queue, name="eapm event processor thread")
                 self._thread.daemon = True
@@ -276,6 +648,25 @@ class Transport(ThreadManager):
             except RuntimeError:
                 pass
 
+    def _start_senders(self) -> None:
+        if not self._max_inflight_requests:
+            return
+        # any queue or threads inherited from a parent process are unusable, start over
+        self._send_queue = _queue.Queue()
+        self._inflight_requests = threading.BoundedSemaphore(self._max_inflight_requests)
+        self._sender_threads = []
+        for i in range(self._max_inflight_requests):
+            try:
+                thread = threading.Thread(target=self._process_send_queue, name="eapm event sender thread %d" % i)
+                thread.daemon = True
+                thread.start()
+                self._sender_threads.append(thread)
+            except RuntimeError:
+                pass
+        if not self._sender_threads:
+            # we're probably shutting down, send from the event processor thread instead
+            self._send_queue = None
+
     def send(self, data, forced_flush=False):
         """
         You need to override this to do something with the actual
@@ -339,6 +730,8 @@ class TransportState(object):
         self.status = self.ONLINE
         self.last_check = None
         self.retry_number = -1
+        self._backoff_time = 0.0
+        self._failing_since = None
 
     def should_try(self):
         if self.status == self.ONLINE:
@@ -352,16 +745,123 @@ class TransportState(object):
         self.status = self.ERROR
         self.retry_number += 1
         self.last_check = timeit.default_timer()
+        if self._failing_since is None:
+            self._failing_since = self.last_check
 
     def set_success(self) -> None:
         self.status = self.ONLINE
         self.last_check = None
         self.retry_number = -1
+        failing_since, self._failing_since = self._failing_since, None
+        if failing_since is not None:
+            self._backoff_time += timeit.default_timer() - failing_since
+
+    def backoff_time(self) -> float:
+        """
+        Total time in seconds that the transport spent backing off after failed requests
+        """
+        failing_since = self._failing_since
+        if failing_since is None:
+            return self._backoff_time
+        return self._backoff_time + timeit.default_timer() - failing_since
 
     def did_fail(self):
         return self.status == self.ERROR
 
 
+def estimate_size(value, depth=0) -> int:
+    """
+    Cheaply estimates the size of an event when serialized to JSON.
+
+    Lists are assumed to contain similar items, e.g. stack frames, so only their first item is inspected,
+    and nested structures are only inspected up to a fixed depth.
+    """
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        if depth >= 4:
+            return 64 * len(value)
+        return sum(len(key) + 4 + estimate_size(item, depth + 1) for key, item in value.items()) + 2
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return 2
+        return len(value) * (estimate_size(value[0], depth + 1) + 1) + 2
+    if hasattr(value, "to_dict"):
+        # an event queued for serialization on the event processor thread, like a span.
+        # Context and stack trace make up most of its size.
+        context = getattr(value, "context", None)
+        frames = getattr(value, "frames", None)
+        return 400 + estimate_size(context, depth + 1) + estimate_size(frames, depth + 1)
+    return 8
+
+
+class EventStripes(object):
+    """
+    Batching front-end for the event queue.
+
+    Producing threads are assigned to one of several stripes round-robin, each protected by its own lock,
+    so concurrent producers rarely contend for a lock. Once a stripe holds `batch_size` events, they are
+    taken out of the stripe to be handed over to the event queue as a single item.
+    """
+
+    def __init__(self, stripes, batch_size) -> None:
+        self.batch_size = batch_size
+        self._num_stripes = stripes
+        self.reset()
+
+    def reset(self) -> None:
+        self._local = threading.local()
+        self._counter = itertools.count()
+        self._stripes = [_EventStripe() for _ in range(self._num_stripes)]
+
+    @property
+    def bytes(self) -> int:
+        """Estimated size of all items in all stripes"""
+        return sum(stripe.bytes for stripe in self._stripes)
+
+    def append(self, item, size=0):
+        """
+        Add an item to the stripe of the current thread
+
+        :param size: estimated size of the item
+        :return: a tuple of a list of items and their estimated size if the stripe is full, None otherwise
+        """
+        try:
+            stripe = self._local.stripe
+        except AttributeError:
+            stripe = self._local.stripe = self._stripes[next(self._counter) % self._num_stripes]
+        with stripe.lock:
+            stripe.items.append(item)
+            stripe.bytes += size
+            if len(stripe.items) < self.batch_size:
+                return None
+            batch, stripe.items = stripe.items, []
+            size, stripe.bytes = stripe.bytes, 0
+        return batch, size
+
+    def drain(self):
+        """
+        Take all items out of all stripes
+        """
+        items = []
+        for stripe in self._stripes:
+            if stripe.items:
+                with stripe.lock:
+                    items.extend(stripe.items)
+                    stripe.items = []
+                    stripe.bytes = 0
+        return items
+
+
+class _EventStripe(object):
+    __slots__ = ("lock", "items", "bytes")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.items = []
+        self.bytes = 0
+
+
 class ChilledQueue(_queue.Queue, object):
     """
     A queue subclass that is a bit more chill about how often it notifies the not empty event
@@ -376,7 +876,22 @@ class ChilledQueue(_queue.Queue, object):
         self._last_unchill = time.time()
         super(ChilledQueue, self).__init__(maxsize=maxsize)
 
-    def put(self, item, block=True, timeout=None, chill=True):
+    def _init(self, maxsize) -> None:
+        super(ChilledQueue, self)._init(maxsize)
+        self._weight = 0
+        self.bytes = 0
+
+    def _qsize(self):
+        # items can carry a weight, e.g. a batch of events counts as the number of events it contains
+        return self._weight
+
+    def _get(self):
+        item, weight, size = self.queue.popleft()
+        self._weight -= weight
+        self.bytes -= size
+        return item
+
+    def put(self, item, block=True, timeout=None, chill=True, weight=1, size=0):
         """Put an item into the queue.
 
         If optional args 'block' is true and 'timeout' is None (the default),
@@ -386,6 +901,11 @@ class ChilledQueue(_queue.Queue, object):
         Otherwise ('block' is false), put an item on the queue if a free slot
         is immediately available, else raise the Full exception ('timeout'
         is ignored in that case).
+
+        Optional arg 'weight' is the number of slots the item takes up when
+        checking for a full queue and when deciding whether to chill. Optional
+        arg 'size' is the estimated size of the item in bytes, which is
+        summed up in the 'bytes' attribute.
         """
         with self.not_full:
             if self.maxsize > 0:
@@ -404,7 +924,9 @@ class ChilledQueue(_queue.Queue, object):
                         if remaining <= 0.0:
                             raise _queue.Full
                         self.not_full.wait(remaining)
-            self._put(item)
+            self.queue.append((item, weight, size))
+            self._weight += weight
+            self.bytes += size
             self.unfinished_tasks += 1
             if (
                 not chill
@@ -33,6 +33,16 @@
 
 
 class TransportException(Exception):
-    def __init__(self, message, data=None) -> None:
+    def __init__(self, message, data=None, status=None) -> None:
         super(TransportException, self).__init__(message)
         self.data = data
+        # the HTTP status of the response, if the APM Server answered
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        """
+        True if sending the same data again might succeed, i.e. for connection errors, timeouts,
+        rate limiting and server errors
+        """
+        return self.status is None or self.status == 429 or self.status >= 500
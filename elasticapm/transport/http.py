@@ -30,11 +30,16 @@
 #  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import collections
+import gzip
 import hashlib
+import io
 import json
 import os
 import re
 import ssl
+import threading
+import timeit
 import urllib.parse
 from urllib.request import getproxies_environment, proxy_bypass_environment
 
@@ -57,7 +62,13 @@ logger = get_logger("elasticapm.transport.http")
 class Transport(HTTPTransportBase):
     def __init__(self, url: str, *args, **kwargs) -> None:
         super(Transport, self).__init__(url, *args, **kwargs)
-        pool_kwargs = {"cert_reqs": "CERT_REQUIRED", "ca_certs": self.ca_certs, "block": True}
+        pool_kwargs = {
+            "cert_reqs": "CERT_REQUIRED",
+            "ca_certs": self.ca_certs,
+            "block": True,
+            # one connection per sender thread
+            "maxsize": max(1, self._max_inflight_requests),
+        }
         if url.startswith("https"):
             if self._server_cert:
                 pool_kwargs.update(
@@ -89,10 +100,18 @@ class Transport(HTTPTransportBase):
         url = custom_url or self._url
         if forced_flush:
             url = f"{url}?flushed=true"
+        # streamed request bodies can't be rewound, so a failed request can't be retried
+        stream_kwargs = {"chunked": True, "retries": False} if isinstance(data, StreamingRequestBody) else {}
         try:
             try:
                 response = self.http.urlopen(
-                    "POST", url, body=data, headers=headers, timeout=self._timeout, preload_content=False
+                    "POST",
+                    url,
+                    body=data,
+                    headers=headers,
+                    timeout=self._timeout,
+                    preload_content=False,
+                    **stream_kwargs,
                 )
                 logger.debug("Sent request, url=%s size=%.2fkb status=%s", url, len(data) / 1024.0, response.status)
             except Exception as e:
@@ -111,7 +130,7 @@ class Transport(HTTPTransportBase):
                 else:
                     message = "HTTP %s: " % response.status
                 message += body.decode("utf8", errors="replace")[:10000]
-                raise TransportException(message, data)
+                raise TransportException(message, data, status=response.status)
             return response.headers.get("Location")
         finally:
             if response:
@@ -273,6 +292,264 @@ class Transport(HTTPTransportBase):
             logger.error("Closing the transport connection timed out.")
 
 
+class StreamingTransport(Transport):
+    """
+    A transport that streams events to the APM Server while they are being encoded.
+
+    Instead of compressing a whole batch into memory and sending it once it is complete,
+    a chunked request to the intake API is opened as soon as the first event of a batch
+    is written. Compressed data is handed over to the request while further events arrive,
+    and the request is completed once the size or time limit of the batch is reached.
+
+    If the transport is backing off after a failed request, batches are buffered in
+    memory and handled like in the default transport instead. If a disk spool is configured,
+    streamed batches are kept in memory as well, so that they can be spooled if their request fails.
+    """
+
+    # interval in seconds after which compressed data is pushed to the request, even if
+    # the compressor didn't produce any output yet
+    stream_sync_interval = 1.0
+
+    def __init__(self, url: str, *args, **kwargs) -> None:
+        super(StreamingTransport, self).__init__(url, *args, **kwargs)
+        # the streams that are being sent, and their threads
+        self._streams = []
+
+    def _init_buffer(self):
+        return _StreamingGzipFile(
+            fileobj=StreamingRequestBody(keep_copy=bool(self._spool)),
+            mode="w",
+            compresslevel=self._compress_level,
+            sync_interval=self.stream_sync_interval,
+        )
+
+    def _write_metadata(self, buffer) -> None:
+        # the metadata is the first line of every batch, so this is the right time to open the request
+        if self.state.should_try():
+            self._start_stream(buffer.fileobj)
+        super(StreamingTransport, self)._write_metadata(buffer)
+
+    def _start_stream(self, stream) -> None:
+        self._join_finished_streams()
+        max_streams = max(1, self._max_inflight_requests)
+        while len(self._streams) >= max_streams:
+            self._join_stream(*self._streams.pop(0))
+        stream.start_streaming(timeout=self._timeout)
+        try:
+            thread = threading.Thread(target=self._send_stream, args=(stream,), name="eapm event streaming thread")
+            thread.daemon = True
+            thread.start()
+        except RuntimeError:
+            stream.abort()
+            return
+        self._streams.append((stream, thread))
+
+    def _send_stream(self, stream) -> None:
+        start = timeit.default_timer()
+        try:
+            self.send(stream)
+        except Exception as e:
+            self._record_request(len(stream), timeit.default_timer() - start, failed=True)
+            self.handle_transport_fail(e)
+            if stream.abort(e):
+                # the batch was complete already, otherwise it is spooled once it is
+                self._spool_stream(stream)
+        else:
+            self._record_request(len(stream), timeit.default_timer() - start)
+            self.handle_transport_success()
+            self._drain_spool()
+        finally:
+            stream.done.set()
+
+    def _spool_stream(self, stream) -> None:
+        """
+        Spools the batch of a failed stream, if the data is retained and the request is worth retrying
+        """
+        error = stream.error
+        if not self._spool or not stream.keeps_copy:
+            logger.error("dropping streamed data due to failed request")
+        elif error is None or (isinstance(error, TransportException) and error.retryable):
+            if self._spool.put(stream.getbuffer()):
+                logger.debug("spooled streamed data due to failed request")
+
+    def _flush(self, buffer, forced_flush=False) -> None:
+        stream = buffer.fileobj
+        if not stream.streaming:
+            super(StreamingTransport, self)._flush(buffer, forced_flush=forced_flush)
+            return
+        buffer.close()
+        if stream.close():
+            # the request failed before the batch was complete
+            self._spool_stream(stream)
+        self._record_batch(buffer, len(stream))
+        self._join_finished_streams()
+        if forced_flush:
+            self._wait_for_senders()
+            if any(x in self.client.config.server_url for x in ("/localhost:", "/127.0.0.1:")):
+                # the streamed request was opened before we knew that it would be flushed,
+                # signal the flush to the local APM server (or lambda extension) separately
+                try:
+                    self.send("", forced_flush=True)
+                except Exception as e:
+                    self.handle_transport_fail(e)
+
+    def _start_senders(self) -> None:
+        # every streamed request is sent by its own thread
+        pass
+
+    def _inflight_request_count(self) -> int:
+        return sum(1 for stream, _ in self._streams if not stream.done.is_set())
+
+    def _join_stream(self, stream, thread) -> None:
+        if stream.wait(self._timeout):
+            thread.join()
+
+    def _join_finished_streams(self) -> None:
+        streams = []
+        for stream, thread in self._streams:
+            if stream.done.is_set():
+                thread.join()
+            else:
+                streams.append((stream, thread))
+        self._streams = streams
+
+    def _wait_for_senders(self) -> None:
+        while self._streams:
+            self._join_stream(*self._streams.pop(0))
+
+    def _stop_senders(self) -> None:
+        self._wait_for_senders()
+
+
+class StreamingRequestBody(object):
+    """
+    A file-like object that is written to by the gzip compressor of a batch, and iterated over by
+    the request that streams the batch.
+
+    Until `start_streaming` is called, written data is buffered in memory. Writing never blocks the
+    event processor thread: if the request doesn't keep up, data is appended to the last of `max_chunks`
+    queued chunks instead. With `keep_copy`, all written data is retained, e.g. to spool the batch if
+    the request fails.
+    """
+
+    def __init__(self, max_chunks=16, keep_copy=False) -> None:
+        self.done = threading.Event()
+        self.keeps_copy = keep_copy
+        # the exception of the request, if it failed
+        self.error = None
+        self._buffer = io.BytesIO()
+        self._chunks = None
+        self._max_chunks = max_chunks
+        self._timeout = None
+        self._size = 0
+        self._closed = False
+        self._aborted = False
+        self._condition = threading.Condition()
+
+    @property
+    def streaming(self) -> bool:
+        return self._chunks is not None
+
+    def start_streaming(self, timeout=None) -> None:
+        self._timeout = timeout
+        self._chunks = collections.deque()
+        buffered = self._buffer.getvalue()
+        if not self.keeps_copy:
+            self._buffer = None
+        if buffered:
+            self._chunks.append(bytearray(buffered))
+
+    def write(self, data) -> int:
+        size = len(data)
+        self._size += size
+        if self._buffer is not None:
+            self._buffer.write(data)
+        if self._chunks is not None:
+            with self._condition:
+                if not self._aborted:
+                    if len(self._chunks) < self._max_chunks:
+                        self._chunks.append(bytearray(data))
+                    else:
+                        # the request doesn't keep up, buffer the data instead of waiting for it
+                        self._chunks[-1].extend(data)
+                    self._condition.notify()
+        return size
+
+    def tell(self) -> int:
+        return self._size
+
+    def getbuffer(self):
+        return self._buffer.getbuffer()
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> bool:
+        """
+        Mark the end of the data
+
+        :return: True if the request has been aborted already
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            return self._aborted
+
+    def abort(self, error=None) -> bool:
+        """
+        Stop accepting data, e.g. because the request failed
+
+        :return: True if the data is complete already
+        """
+        with self._condition:
+            self._aborted = True
+            self.error = error
+            if self._chunks is not None:
+                self._chunks.clear()
+            self._condition.notify()
+            return self._closed
+
+    def wait(self, timeout=None) -> bool:
+        return self.done.wait(timeout)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        while True:
+            with self._condition:
+                while not (self._chunks or self._closed or self._aborted):
+                    if not self._condition.wait(self._timeout):
+                        raise TransportException("Timed out waiting for data to stream to the APM Server")
+                if self._aborted:
+                    raise TransportException("Streaming data to the APM Server was aborted")
+                if not self._chunks:
+                    return
+                chunk = self._chunks.popleft()
+            yield bytes(chunk)
+
+
+class _StreamingGzipFile(gzip.GzipFile):
+    """
+    A GzipFile that regularly pushes compressed data to the underlying file object,
+    so that streamed data reaches the APM Server in a timely manner.
+    """
+
+    def __init__(self, *args, sync_interval=None, **kwargs) -> None:
+        super(_StreamingGzipFile, self).__init__(*args, **kwargs)
+        self._sync_interval = sync_interval
+        self._last_sync = timeit.default_timer()
+
+    def write(self, data):
+        size = super(_StreamingGzipFile, self).write(data)
+        if self._sync_interval and self.fileobj.streaming:
+            now = timeit.default_timer()
+            if now - self._last_sync > self._sync_interval:
+                self.flush()
+                self._last_sync = now
+        return size
+
+
 def version_string_to_tuple(version):
     if version:
         version_parts = re.split(r"[.\-]", version)
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import asyncio
+import collections
+import random
+import threading
+import timeit
+
+from elasticapm.transport.base import estimate_size
+from elasticapm.transport.http import Transport
+from elasticapm.utils.logging import get_logger
+from elasticapm.utils.threading import ThreadManager
+
+logger = get_logger("elasticapm.transport.http_asyncio")
+
+
+def get_running_loop():
+    """Returns the running event loop of the current thread, or None"""
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError:  # Python 3.6
+        return asyncio._get_running_loop()
+    except RuntimeError:
+        return None
+
+
+EVENT_QUEUE_SIZE = 10000
+
+
+class AsyncioTransport(Transport):
+    """
+    A transport that processes events on an asyncio event loop instead of a separate thread.
+
+    The transport attaches itself to the running event loop of the first thread that queues an event,
+    which is usually the event loop of the application. Events queued from other threads are handed
+    over to that loop. Batches are sent with the HTTP client of the default transport, in the default
+    executor of the loop, so that requests to the APM Server don't block the loop.
+
+    `flush()` and `close()` block until the queued events have been sent, like they do for the default
+    transport. Called on the loop itself, they send the queued events right away, blocking the loop while
+    doing so. Coroutines can use `flush_async()` and `close_async()` instead, e.g. during the ASGI lifespan
+    shutdown:
+
+        await client._transport.flush_async()
+    """
+
+    def __init__(self, url: str, *args, **kwargs) -> None:
+        super(AsyncioTransport, self).__init__(url, *args, **kwargs)
+        self._loop = None
+        self._task = None
+        # events queued before there is an event loop, or from other threads. Limited to EVENT_QUEUE_SIZE
+        self._pending = collections.deque()
+        self._drain_scheduled = False
+        self._queue_bytes = 0
+        self._attach_lock = threading.Lock()
+        self._buffer = None
+
+    def _init_event_queue(self, chill_until, max_chill_time):
+        # the asyncio.Queue is created once the transport is attached to an event loop
+        return None
+
+    def _start_senders(self) -> None:
+        # batches are sent one after the other, in the executor of the event loop
+        pass
+
+    def start_thread(self, pid=None) -> None:
+        if pid and self.pid and pid != self.pid:
+            # the event loop of the parent process is unusable, start over
+            self._loop = self._task = self._event_queue = None
+            self._buffer = None
+            self._pending.clear()
+            self.handle_fork()
+        # don't start the event processor thread of the base transport
+        ThreadManager.start_thread(self, pid=pid)
+
+    def queue(self, event_type, data, flush=False) -> None:
+        if self.shed_event(event_type):
+            return
+        self._flushed.clear()
+        item = (event_type, data, flush)
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            loop = self._attach()
+            if loop is None:
+                # no event loop to attach to yet, hold on to the event until there is one
+                self._append_pending(item)
+                return
+        if get_running_loop() is loop:
+            self._put(item)
+        else:
+            # hand the event over to the loop. The pending events are collected before any event that is
+            # queued on the loop itself, so that events queued before a flush are part of it
+            if not self._append_pending(item):
+                return
+            if not self._drain_scheduled:
+                self._drain_scheduled = True
+                try:
+                    loop.call_soon_threadsafe(self._drain_pending)
+                except RuntimeError:
+                    # the loop has been closed in the meantime
+                    self._drain_scheduled = False
+
+    def _attach(self, loop=None):
+        with self._attach_lock:
+            if self._loop is not None and not self._loop.is_closed():
+                return self._loop
+            if loop is None:
+                loop = get_running_loop()
+                if loop is None:
+                    return None
+            self._loop = loop
+            self._event_queue = None
+            self._task = loop.create_task(self._run())
+            return loop
+
+    def _append_pending(self, item) -> bool:
+        """
+        Holds on to an event until it can be put into the event queue. Events are dropped if too many are pending.
+
+        :return: True if the event was added
+        """
+        if len(self._pending) >= EVENT_QUEUE_SIZE:
+            logger.debug("Event of type %s dropped due to full event queue", item[0])
+            self._dropped[item[0]] += 1
+            return False
+        self._pending.append(item)
+        return True
+
+    def _drain_pending(self) -> None:
+        self._drain_scheduled = False
+        if self._event_queue is not None:
+            while self._pending:
+                self._put_nowait(self._pending.popleft())
+
+    def _put(self, item) -> None:
+        if self._event_queue is None:
+            self._append_pending(item)
+            return
+        self._drain_pending()
+        self._put_nowait(item)
+
+    def _put_nowait(self, item) -> None:
+        event_type, data, flush = item
+        size = estimate_size(data) if data is not None and self._memory_budget else 0
+        try:
+            self._event_queue.put_nowait((event_type, data, flush, size))
+            self._queue_bytes += size
+        except asyncio.QueueFull:
+            logger.debug("Event of type %s dropped due to full event queue", item[0])
+            self._dropped[item[0]] += 1
+
+    def _queued_bytes(self) -> int:
+        return self._buffered_bytes + self._queue_bytes
+
+    def _queued_events(self) -> int:
+        queued = len(self._pending)
+        if self._event_queue is not None:
+            queued += self._event_queue.qsize()
+        return queued
+
+    def _queue_fill_ratio(self) -> float:
+        # the pending events count too, as they are held on to before the event queue exists
+        ratio = self._queued_events() / EVENT_QUEUE_SIZE
+        if self._memory_budget:
+            ratio = max(ratio, self._queued_bytes() / self._memory_budget)
+        return ratio
+
+    def _can_wait_for_loop(self) -> bool:
+        """
+        Returns True if the event loop we are attached to runs in another thread, so that we can wait for it
+        """
+        loop = self._loop
+        return loop is not None and not loop.is_closed() and loop.is_running() and get_running_loop() is not loop
+
+    def flush(self) -> None:
+        """
+        Trigger a flush of the queue.
+        Note: this method will only return once the queue is empty. This means it can block indefinitely if more events
+        are produced in other threads than can be consumed.
+        """
+        if not self._can_wait_for_loop():
+            self._send_queued()
+            return
+        self.queue(None, None, flush=True)
+        if not self._flushed.wait(timeout=self._max_flush_time_seconds):
+            raise ValueError("flush timed out")
+
+    def close(self) -> None:
+        if self._closed or self.pid is None:
+            return
+        self._closed = True
+        if not self._can_wait_for_loop():
+            self._send_queued()
+            if self._task is not None and not self._task.done():
+                self._task.cancel()
+            return
+        self.queue("close", None)
+        if not self._flushed.wait(timeout=self._max_flush_time_seconds):
+            logger.error("Closing the transport connection timed out.")
+
+    async def flush_async(self) -> None:
+        """
+        Like `flush()`, but waits for the queued events to be sent without blocking the running event loop
+        """
+        running_loop = get_running_loop()
+        if self._attach(running_loop) is not running_loop:
+            # the transport runs on the loop of another thread
+            await running_loop.run_in_executor(None, self.flush)
+            return
+        flushed = running_loop.create_future()
+        self.queue(None, None, flush=flushed)
+        try:
+            await asyncio.wait_for(flushed, self._max_flush_time_seconds)
+        except asyncio.TimeoutError:
+            raise ValueError("flush timed out")
+
+    async def close_async(self) -> None:
+        """
+        Like `close()`, but waits for the queued events to be sent without blocking the running event loop
+        """
+        if self._closed or self.pid is None:
+            return
+        running_loop = get_running_loop()
+        if self._attach(running_loop) is not running_loop:
+            await running_loop.run_in_executor(None, self.close)
+            return
+        self._closed = True
+        self.queue("close", None)
+        done, _ = await asyncio.wait([self._task], timeout=self._max_flush_time_seconds)
+        if not done:
+            logger.error("Closing the transport connection timed out.")
+
+    def _send_queued(self) -> None:
+        """
+        Processes and sends all queued events right away, blocking until they have been sent.
+
+        This is used if we can't wait for the event loop, because we are running on it, or because it
+        isn't running (anymore).
+        """
+        if self._metadata is None:
+            self._metadata = self.client.build_metadata()
+        flushed = []
+        while self._pending:
+            event_type, data, flush = self._pending.popleft()
+            self._write_event(event_type, data)
+            flushed.append(flush)
+        while self._event_queue is not None and not self._event_queue.empty():
+            event_type, data, flush, size = self._event_queue.get_nowait()
+            self._queue_bytes -= size
+            self._write_event(event_type, data)
+            flushed.append(flush)
+        buffer = self._take_buffer()
+        if buffer is not None:
+            self._flush(buffer, forced_flush=True)
+        else:
+            self._send_empty_flush()
+        self._flushed.set()
+        for flush in flushed:
+            if isinstance(flush, asyncio.Future) and not flush.done():
+                flush.set_result(None)
+
+    async def _run(self) -> None:
+        loop = self._loop
+        self._event_queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._queue_bytes = 0
+        self._drain_pending()
+        if not self.client.server_version:
+            if self.client.config.skip_server_info:
+                logger.debug("Skipping to fetch server info")
+            else:
+                await loop.run_in_executor(None, self.fetch_server_info)
+        # Rebuild the metadata to capture new process information
+        self._metadata = self.client.build_metadata()
+
+        # add some randomness to timeout to avoid stampedes of several workers that are booted at the same time
+        max_flush_time = (
+            self._max_flush_time_seconds * random.uniform(0.9, 1.1) if self._max_flush_time_seconds else None
+        )
+
+        while True:
+            since_last_flush = timeit.default_timer() - self._last_flush
+            timeout = max(0, max_flush_time - since_last_flush) if max_flush_time else None
+            timed_out = False
+            try:
+                event_type, data, flush, size = self._event_queue.get_nowait()
+                self._queue_bytes -= size
+            except asyncio.QueueEmpty:
+                try:
+                    event_type, data, flush, size = await asyncio.wait_for(self._event_queue.get(), timeout)
+                    self._queue_bytes -= size
+                except asyncio.TimeoutError:
+                    event_type, data, flush = None, None, None
+                    timed_out = True
+
+            if event_type == "close":
+                buffer = self._take_buffer()
+                if buffer is not None:
+                    await loop.run_in_executor(None, self._flush, buffer)
+                self._flushed.set()
+                return  # time to go home!
+
+            self._write_event(event_type, data)
+
+            forced_flush = bool(flush)
+            if forced_flush:
+                logger.debug("forced flush")
+            elif timed_out or timeout == 0:
+                flush = True
+            elif self._max_buffer_size and self._buffered_bytes > self._max_buffer_size:
+                flush = True
+            if flush:
+                buffer = self._take_buffer()
+                if buffer is not None:
+                    await loop.run_in_executor(None, self._flush, buffer, forced_flush)
+                elif forced_flush:
+                    await loop.run_in_executor(None, self._send_empty_flush)
+                max_flush_time = (
+                    self._max_flush_time_seconds * random.uniform(0.9, 1.1) if self._max_flush_time_seconds else None
+                )
+                self._flushed.set()
+                if isinstance(flush, asyncio.Future) and not flush.done():
+                    flush.set_result(None)
+
+    def _write_event(self, event_type, data) -> None:
+        if data is None:
+            return
+        data = self._process_event(event_type, data)
+        if data is None:
+            return
+        if self._buffer is None:
+            self._buffer = self._init_buffer()
+            # Write metadata just in time to allow for late metadata changes
+            self._write_metadata(self._buffer)
+        self._buffer.write((self._json_serializer({event_type: data}) + "\n").encode("utf-8"))
+        self._counts[event_type] += 1
+        self._buffered_bytes = self._buffer.fileobj.tell()
+
+    def _take_buffer(self):
+        """
+        Returns the buffer with the events written so far, or None if there are none, and starts a new one
+        """
+        buffer, self._buffer = self._buffer, None
+        self._buffered_bytes = 0
+        self._last_flush = timeit.default_timer()
+        return buffer
+
+    def _send_empty_flush(self) -> None:
+        # No data on buffer, but due to manual flush we should send
+        # an empty payload with flushed=true query param, but only
+        # to a local APM server (or lambda extension)
+        if not any(x in self.client.config.server_url for x in ("/localhost:", "/127.0.0.1:")):
+            return
+        try:
+            self.send("", forced_flush=True)
+            self.handle_transport_success()
+        except Exception as e:
+            self.handle_transport_fail(e)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import itertools
+import os
+import time
+from collections import defaultdict
+
+from elasticapm.transport.exceptions import TransportException
+from elasticapm.utils.logging import get_logger
+
+logger = get_logger("elasticapm.transport.spool")
+
+
+class DiskSpool(object):
+    """
+    A size and age capped ring of flushed request bodies, stored on disk.
+
+    Every batch is written to its own segment file. Segment names start with a
+    zero-padded timestamp, so sorting them by name yields the order in which the
+    batches were spooled. The oldest segments are evicted first if the spool
+    grows beyond `max_size` bytes, or if they are older than `max_age` seconds.
+
+    Several processes can share the same spool directory. A segment is claimed
+    by renaming it before it is sent, so that every segment is only sent once.
+    Segments that are being written or sent carry the pid of their process in
+    their name. Leftovers of processes that died are recovered on startup.
+    """
+
+    suffix = ".ndjson.gz"
+    inflight_suffix = ".inflight"
+    tmp_suffix = ".tmp"
+
+    def __init__(self, directory: str, max_size: int, max_age: float) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.counts = defaultdict(int)
+        self._sequence = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def put(self, data) -> bool:
+        """
+        Write a batch to the spool, evicting old batches if needed.
+
+        :param data: the gzip-compressed request body
+        :return: True if the batch was spooled
+        """
+        size = len(data)
+        if size > self.max_size:
+            logger.warning("Dropping batch of %d bytes, as it is larger than the spool (%d bytes)", size, self.max_size)
+            self.counts["evicted"] += 1
+            self.counts["evicted_bytes"] += size
+            return False
+        self._evict(incoming_size=size)
+        name = "%020d-%d-%06d%s" % (int(time.time() * 1000000), os.getpid(), next(self._sequence), self.suffix)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path + self.tmp_suffix, "wb") as f:
+                f.write(data)
+            # rename the completely written file, so that other processes never see partial segments
+            os.replace(path + self.tmp_suffix, path)
+        except OSError as e:
+            logger.error("Could not write to spool directory %s: %s", self.directory, str(e))
+            self.counts["evicted"] += 1
+            self.counts["evicted_bytes"] += size
+            return False
+        self.counts["spooled"] += 1
+        self.counts["spooled_bytes"] += size
+        return True
+
+    def drain(self, send) -> int:
+        """
+        Send all spooled batches, oldest first, until the first failure.
+
+        :param send: a callable that sends the request body. Any exception
+            raised by it stops draining and is re-raised, and the batch
+            stays in the spool. Batches that the APM Server rejected with
+            a client error are dropped instead, as they would be rejected
+            again.
+        :return: the number of drained batches
+        """
+        self._evict()
+        drained = 0
+        for path, size, _ in self._segments():
+            inflight_path = "%s.%d%s" % (path, os.getpid(), self.inflight_suffix)
+            try:
+                os.rename(path, inflight_path)
+            except OSError:
+                # claimed by another process in the meantime
+                continue
+            try:
+                with open(inflight_path, "rb") as f:
+                    data = f.read()
+                send(data)
+            except TransportException as e:
+                if e.retryable:
+                    self._unclaim(inflight_path, path)
+                    raise
+                logger.warning("Dropping spooled batch %s, as it was rejected by the APM Server: %s", path, str(e))
+                if self._remove(inflight_path):
+                    self.counts["evicted"] += 1
+                    self.counts["evicted_bytes"] += size
+                continue
+            except Exception:
+                self._unclaim(inflight_path, path)
+                raise
+            self._remove(inflight_path)
+            self.counts["drained"] += 1
+            self.counts["drained_bytes"] += size
+            drained += 1
+        if drained:
+            logger.debug("Drained %d batches from spool directory %s", drained, self.directory)
+        return drained
+
+    def pending(self):
+        """
+        :return: a tuple of number of spooled batches and their size in bytes
+        """
+        segments = self._segments()
+        return len(segments), sum(size for _, size, _ in segments)
+
+    def _segments(self):
+        return self._scan()[0]
+
+    def _scan(self):
+        """
+        :return: a tuple of the spooled segments, sorted by age, and the size in bytes of the segments
+            that are being written or sent
+        """
+        segments = []
+        busy_size = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    is_segment = entry.name.endswith(self.suffix)
+                    if not is_segment and not entry.name.endswith((self.inflight_suffix, self.tmp_suffix)):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if is_segment:
+                        segments.append((entry.path, stat.st_size, stat.st_mtime))
+                    else:
+                        busy_size += stat.st_size
+        except OSError as e:
+            logger.error("Could not read spool directory %s: %s", self.directory, str(e))
+        segments.sort()
+        return segments, busy_size
+
+    def _recover(self) -> None:
+        """
+        Returns segments that were claimed by processes that no longer run to the spool, and removes
+        segments that they didn't finish writing
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            logger.error("Could not read spool directory %s: %s", self.directory, str(e))
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith(self.inflight_suffix):
+                segment_path, _, pid = name[: -len(self.inflight_suffix)].rpartition(".")
+                if segment_path and not _is_running(pid):
+                    self._unclaim(path, os.path.join(self.directory, segment_path))
+            elif name.endswith(self.suffix + self.tmp_suffix):
+                pid = name.split("-")[1] if name.count("-") >= 2 else None
+                if not _is_running(pid) and self._remove(path):
+                    logger.debug("Removed partially written batch %s", path)
+
+    def _unclaim(self, inflight_path, path) -> None:
+        try:
+            os.rename(inflight_path, path)
+        except OSError:
+            pass
+
+    def _evict(self, incoming_size=0) -> None:
+        segments, busy_size = self._scan()
+        # segments that are being written or sent count against the size of the spool, but can't be evicted
+        total_size = sum(size for _, size, _ in segments) + busy_size
+        min_mtime = time.time() - self.max_age if self.max_age else None
+        for path, size, mtime in segments:
+            if (min_mtime is None or mtime >= min_mtime) and total_size + incoming_size <= self.max_size:
+                break
+            if self._remove(path):
+                logger.debug("Evicted spooled batch %s", path)
+                self.counts["evicted"] += 1
+                self.counts["evicted_bytes"] += size
+            total_size -= size
+
+    def _remove(self, path) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except OSError:
+            return False
+
+
+def _is_running(pid) -> bool:
+    """
+    Returns True if a process with the given pid is running. This process is not considered to be running,
+    as leftovers with its pid are from an earlier process with the same pid, e.g. in a restarted container.
+    """
+    try:
+        pid = int(pid)
+    except (TypeError, ValueError):
+        return False
+    if pid == os.getpid():
+        return False
+    if os.name == "nt":
+        # os.kill() would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. the process belongs to another user
+        return True
+    return True
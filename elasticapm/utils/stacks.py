@@ -222,33 +222,94 @@ def iter_stack_frames(frames=None, start_frame=None, skip=0, skip_top_modules=()
             yield frame, frame.f_lineno
 
 
-def get_frame_info(
-    frame,
-    lineno,
-    with_locals=True,
-    library_frame_context_lines=None,
-    in_app_frame_context_lines=None,
-    include_paths_re=None,
-    exclude_paths_re=None,
-    locals_processor_func=None,
-):
-    # Support hidden frames
-    f_locals = getattr(frame, "f_locals", {})
-    if _getitem_from_frame(f_locals, "__traceback_hide__"):
-        return None
+def get_stack_snapshot(start_frame=None, skip_top_modules=(), config=None, keep_frames_of=()):
+    """
+    Like iter_stack_frames, but returns a light-weight snapshot of the stack: a tuple of
+    (code, lineno, globals) tuples. Unlike the frames, the snapshot doesn't keep the local
+    variables of the stack alive, and taking it doesn't require reading them.
 
-    f_globals = getattr(frame, "f_globals", {})
-    loader = f_globals.get("__loader__")
-    module_name = f_globals.get("__name__")
+    Use iter_stack_snapshot to turn the snapshot into (frame, lineno) tuples for get_stack_info.
+    Local variables are not available on these frames.
 
-    f_code = getattr(frame, "f_code", None)
-    if f_code:
-        abs_path = frame.f_code.co_filename
-        function = frame.f_code.co_name
-    else:
-        abs_path = None
-        function = None
+    :param start_frame: a Frame object or None
+    :param skip_top_modules: tuple of strings
+    :param config: agent configuration
+    :param keep_frames_of: names of functions whose frames are kept as (frame, lineno) tuples
+    :return: a tuple
+    """
+    frame = start_frame if start_frame is not None else inspect.currentframe().f_back
+    max_frames = config.stack_trace_limit if config else -1
+    snapshot = []
+    stop_ignoring = False
+    while frame is not None and len(snapshot) != max_frames:
+        f_globals = frame.f_globals
+        if not stop_ignoring and f_globals.get("__name__", "").startswith(skip_top_modules):
+            frame = frame.f_back
+            continue
+        stop_ignoring = True
+        f_code = frame.f_code
+        # the local variables of functions are known from their code object, f_locals is only read if needed
+        hidden = (
+            not f_code.co_flags & inspect.CO_NEWLOCALS
+            or "__traceback_hide__" in f_code.co_varnames
+            or "__traceback_hide__" in f_code.co_cellvars
+        ) and _getitem_from_frame(frame.f_locals, "__traceback_hide__")
+        if not hidden:
+            if f_code.co_name in keep_frames_of:
+                snapshot.append((frame, frame.f_lineno))
+            else:
+                snapshot.append((f_code, frame.f_lineno, f_globals))
+        frame = frame.f_back
+    return tuple(snapshot)
+
+
+class _FrameSnapshot(object):
+    """Stands in for a frame of a stack snapshot in get_frame_info"""
 
+    __slots__ = ("f_code", "f_globals")
+
+    def __init__(self, f_code, f_globals) -> None:
+        self.f_code = f_code
+        self.f_globals = f_globals
+
+    @property
+    def f_locals(self):
+        return {}
+
+
+def iter_stack_snapshot(snapshot):
+    """
+    Iterates over a snapshot of get_stack_snapshot, or a list of frames of iter_stack_frames,
+    yielding (frame, lineno) tuples.
+    """
+    for item in snapshot:
+        if len(item) == 3:
+            yield _FrameSnapshot(item[0], item[2]), item[1]
+        else:
+            yield item
+
+
+# Cache of the parts of get_frame_info results that only depend on the code location and
+# the configuration, keyed by the code location and the arguments that affect them.
+_frame_info_cache = {}
+_frame_info_cache_size = 4096
+
+
+def clear_frame_info_cache() -> None:
+    _frame_info_cache.clear()
+
+
+def _get_static_frame_info(
+    abs_path,
+    function,
+    lineno,
+    module_name,
+    loader,
+    library_frame_context_lines,
+    in_app_frame_context_lines,
+    include_paths_re,
+    exclude_paths_re,
+):
     # Try to pull a relative file path
     # This changes /foo/site-packages/baz/bar.py into baz/bar.py
     try:
@@ -275,6 +336,63 @@ def get_frame_info(
         # This ensures that blocking operations (reading from source files) happens on the background
         # processing thread.
         frame_result["context_metadata"] = (abs_path, lineno, int(context_lines / 2), loader, module_name)
+    return frame_result
+
+
+def get_frame_info(
+    frame,
+    lineno,
+    with_locals=True,
+    library_frame_context_lines=None,
+    in_app_frame_context_lines=None,
+    include_paths_re=None,
+    exclude_paths_re=None,
+    locals_processor_func=None,
+):
+    # Support hidden frames
+    f_locals = getattr(frame, "f_locals", {})
+    if _getitem_from_frame(f_locals, "__traceback_hide__"):
+        return None
+
+    f_globals = getattr(frame, "f_globals", {})
+    module_name = f_globals.get("__name__")
+
+    f_code = getattr(frame, "f_code", None)
+    if f_code:
+        abs_path = frame.f_code.co_filename
+        function = frame.f_code.co_name
+    else:
+        abs_path = None
+        function = None
+
+    cache_key = (
+        abs_path,
+        function,
+        lineno,
+        module_name,
+        include_paths_re,
+        exclude_paths_re,
+        library_frame_context_lines,
+        in_app_frame_context_lines,
+    )
+    frame_info = _frame_info_cache.get(cache_key)
+    if frame_info is None:
+        frame_info = _get_static_frame_info(
+            abs_path,
+            function,
+            lineno,
+            module_name,
+            f_globals.get("__loader__"),
+            library_frame_context_lines,
+            in_app_frame_context_lines,
+            include_paths_re,
+            exclude_paths_re,
+        )
+        if len(_frame_info_cache) >= _frame_info_cache_size:
+            _frame_info_cache.clear()
+        _frame_info_cache[cache_key] = frame_info
+    # the result is modified later on, e.g. when context lines are added
+    frame_result = frame_info.copy()
     if with_locals:
         if f_locals is not None and not isinstance(f_locals, dict):
             # XXX: Genshi (and maybe others) have broken implementations of
@@ -0,0 +1,157 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import sys
+import threading
+import weakref
+from typing import TYPE_CHECKING, List, MutableMapping
+
+from elasticapm import traces
+from elasticapm.utils import stacks
+from elasticapm.utils.logging import get_logger
+from elasticapm.utils.threading import IntervalTimer, ThreadManager
+
+if TYPE_CHECKING:
+    import elasticapm
+
+logger = get_logger("elasticapm.watchdog")
+
+
+class SlowTransactionWatchdog(ThreadManager):
+    """
+    Keeps track of running transactions, and captures the stack of the thread of a transaction that
+    runs for longer than `slow_transaction_threshold`. The stack is sent as a log event, right away, so
+    that it is available even if the transaction never ends.
+
+    After the first snapshot, another one is taken every `slow_transaction_threshold`, up to
+    `slow_transaction_max_snapshots` per transaction.
+
+    If several transactions run on the same thread, e.g. with asyncio, the stack of the thread can't be
+    attributed to one of them. The slow transaction is still reported, but without a stack.
+    """
+
+    def __init__(self, client: "elasticapm.Client") -> None:
+        self.client = client
+        self._lock = threading.Lock()
+        # thread id and number of snapshots taken of each running transaction. Transactions that are never
+        # ended are dropped once they are garbage collected, or once all their snapshots have been taken.
+        self._transactions: MutableMapping["traces.Transaction", List[int]] = weakref.WeakKeyDictionary()
+        self._check_timer = None
+        super(SlowTransactionWatchdog, self).__init__()
+
+    @property
+    def check_interval(self) -> float:
+        return max(self.client.config.slow_transaction_threshold.total_seconds() / 4, 0.05)
+
+    def transaction_started(self, transaction: "traces.Transaction") -> None:
+        with self._lock:
+            self._transactions[transaction] = [threading.get_ident(), 0]
+
+    def transaction_ended(self, transaction: "traces.Transaction") -> None:
+        with self._lock:
+            self._transactions.pop(transaction, None)
+
+    def check(self) -> float:
+        """
+        Takes snapshots of the stacks of transactions that are over the threshold
+
+        :return: the interval until the next check, in seconds
+        """
+        threshold_ns = traces.duration_to_ns(self.client.config.slow_transaction_threshold)
+        if threshold_ns <= 0:
+            return self.check_interval
+        max_snapshots = self.client.config.slow_transaction_max_snapshots
+        now_ns = traces._time_ns_func()
+        with self._lock:
+            slow = [
+                (transaction, state)
+                for transaction, state in self._transactions.items()
+                if state[1] < max_snapshots and now_ns - transaction.start_ns >= threshold_ns * (state[1] + 1)
+            ]
+            # number of running transactions per thread
+            threads = collections.Counter(state[0] for state in self._transactions.values()) if slow else None
+            for transaction, state in slow:
+                state[1] += 1
+                if state[1] >= max_snapshots:
+                    # no more snapshots are taken of this transaction
+                    del self._transactions[transaction]
+        if slow:
+            frames = sys._current_frames()
+            for transaction, state in slow:
+                if threads[state[0]] > 1:
+                    # the stack of the thread can't be attributed to one of its transactions
+                    frame = None
+                else:
+                    frame = frames.get(state[0])
+                    if frame is None:
+                        continue
+                self._capture(transaction, frame, (now_ns - transaction.start_ns) / 1_000_000_000)
+            del frames, frame
+        return self.check_interval
+
+    def _capture(self, transaction: "traces.Transaction", frame, running_for: float) -> None:
+        if frame is not None:
+            # The thread is still running, so its frames are only taken as a snapshot, without local variables
+            snapshot = stacks.get_stack_snapshot(start_frame=frame, config=self.client.config)
+            message = "Transaction %s has been running for %.1f seconds"
+            stack = list(stacks.iter_stack_snapshot(snapshot))
+        else:
+            message = "Transaction %s has been running for %.1f seconds, other transactions share its thread"
+            stack = False
+        # the event is captured on this thread, in the context of the slow transaction
+        traces.execution_context.set_transaction(transaction)
+        try:
+            self.client.capture(
+                "Message",
+                param_message={
+                    "message": message,
+                    "params": (transaction.name or transaction.transaction_type, running_for),
+                },
+                level="warning",
+                logger_name="elasticapm.watchdog",
+                stack=stack,
+            )
+        finally:
+            traces.execution_context.get_transaction(clear=True)
+
+    def start_thread(self, pid=None) -> None:
+        super(SlowTransactionWatchdog, self).start_thread(pid=pid)
+        self._check_timer = IntervalTimer(
+            self.check, self.check_interval, name="eapm watchdog", daemon=True, evaluate_function_interval=True
+        )
+        logger.debug("Starting slow transaction watchdog")
+        self._check_timer.start()
+
+    def stop_thread(self) -> None:
+        if self._check_timer and self._check_timer.is_alive():
+            logger.debug("Stopping slow transaction watchdog")
+            self._check_timer.cancel()
+            self._check_timer = None
@@ -0,0 +1,76 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import gc
+import tracemalloc
+
+import pytest
+
+import elasticapm
+
+SPANS = 500
+
+# upper bound of the memory that a transaction with 500 open spans holds, in bytes. It leaves some headroom
+# for differences between Python versions, raise it only if the span classes really need to grow.
+MAX_BYTES_PER_TRANSACTION = 260_000
+
+
+def _open_transaction(client):
+    transaction = client.begin_transaction("request")
+    spans = []
+    for _ in range(SPANS):
+        spans.append(
+            transaction.begin_span("SELECT FROM foo", "db", span_subtype="postgresql", leaf=True, auto_activate=False)
+        )
+    return transaction, spans
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"span_stack_trace_min_duration": -1, "breakdown_metrics": True}],
+    indirect=True,
+)
+def test_memory_per_transaction(elasticapm_client):
+    # warm up caches, so that they are not attributed to the measured transaction
+    transaction, spans = _open_transaction(elasticapm_client)
+    elasticapm_client.end_transaction("GET /foo", "HTTP 2xx")
+    del transaction, spans
+    gc.collect()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        transaction, spans = _open_transaction(elasticapm_client)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    elasticapm.set_transaction_name("GET /foo")
+    elasticapm_client.end_transaction("GET /foo", "HTTP 2xx")
+    assert used < MAX_BYTES_PER_TRANSACTION, "%d bytes used by a transaction with %d spans" % (used, SPANS)
@@ -0,0 +1,63 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+from elasticapm.transport.base import Transport
+
+
+def _process_event_unfiltered(transport, event_type, data):
+    # processing as done before per-event-type chains were compiled, for comparison
+    for processor in transport._processors:
+        if not hasattr(processor, "event_types") or event_type in processor.event_types:
+            data = processor(transport.client, data)
+    return data
+
+
+@pytest.fixture()
+def transport(elasticapm_client):
+    transport = Transport(client=elasticapm_client, processors=elasticapm_client.load_processors())
+    yield transport
+    transport.close()
+
+
+@pytest.fixture()
+def span():
+    return {"id": "0af7651916cd43dd", "name": "SELECT FROM foo", "type": "db", "duration": 1.5, "context": {}}
+
+
+@pytest.mark.benchmark(group="process-span")
+def test_process_span_compiled_chain(benchmark, transport, span):
+    assert benchmark(transport._process_event, "span", span) == span
+
+
+@pytest.mark.benchmark(group="process-span")
+def test_process_span_unfiltered(benchmark, transport, span):
+    assert benchmark(_process_event_unfiltered, transport, "span", span) == span
@@ -0,0 +1,69 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import elasticapm
+
+
+def _request(client):
+    client.begin_transaction("request")
+    for i in range(10):
+        with elasticapm.capture_span(
+            "SELECT FROM foo",
+            span_type="db",
+            span_subtype="postgresql",
+            span_action="query",
+            extra={"db": {"type": "sql", "statement": "SELECT * FROM foo WHERE id = %s"}},
+            leaf=True,
+        ):
+            pass
+    client.end_transaction("GET /foo", "HTTP 2xx")
+
+
+@pytest.mark.benchmark(group="request-overhead")
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [
+        {"defer_span_serialization": False, "span_stack_trace_min_duration": -1},
+        {"defer_span_serialization": True, "span_stack_trace_min_duration": -1},
+    ],
+    indirect=True,
+    ids=["serialize-on-end", "deferred"],
+)
+def test_request_overhead(benchmark, elasticapm_client):
+    # only measure the request path, not the serialization done by the test transport when queueing
+    queued = []
+    elasticapm_client._transport.queue = lambda event_type, data, flush=False: queued.append(data)
+    benchmark(_request, elasticapm_client)
+    if benchmark.stats:  # not available with --benchmark-disable
+        data = benchmark.stats.stats.sorted_data
+        benchmark.extra_info["p99"] = data[int(len(data) * 0.99)]
+    assert queued
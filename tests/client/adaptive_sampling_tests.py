@@ -0,0 +1,124 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mock
+import pytest
+
+from elasticapm.conf import constants
+from elasticapm.sampling import AdaptiveSampler, normalize_url_path
+
+
+class FakeClock(object):
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_allocate_favours_rare_keys():
+    probabilities = AdaptiveSampler._allocate({"busy": 100.0, "rare": 1.0}, 10)
+    assert probabilities["rare"] == 1.0
+    assert probabilities["busy"] == pytest.approx(0.09)
+
+
+def test_adaptive_sampler_targets_rate():
+    clock = FakeClock()
+    sampler = AdaptiveSampler(window=1.0, clock=clock)
+    sampler.smoothing = 1.0
+    # nothing is known in the first window, so everything is sampled
+    assert sampler.sample("busy", 10) == (True, 1.0)
+    for second in range(3):
+        for i in range(100):
+            clock.now = second + i / 100
+            sampler.sample("busy", 10)
+        sampler.sample("rare", 10)
+    clock.now = 3.0
+    _, busy_rate = sampler.sample("busy", 10)
+    assert busy_rate == pytest.approx(0.09, abs=0.02)
+    assert sampler.sample("rare", 10) == (True, 1.0)
+
+
+def test_adaptive_sampler_adapts_within_window_to_spikes():
+    clock = FakeClock()
+    sampler = AdaptiveSampler(window=10.0, clock=clock)
+    for i in range(2000):
+        clock.now = i / 1000
+        sampler.sample("spike", 10)
+    # the window ended early, well before the 10 seconds are over
+    _, rate = sampler.sample("spike", 10)
+    assert rate < 0.05
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"transaction_sample_target": 5}], indirect=True)
+def test_transaction_sample_target(elasticapm_client):
+    with mock.patch.object(elasticapm_client.tracer.adaptive_sampler, "sample", return_value=(True, 0.25)) as sample:
+        transaction = elasticapm_client.begin_transaction("request", name="GET /")
+        elasticapm_client.end_transaction()
+    sample.assert_called_once_with("GET /", 5)
+    assert transaction.trace_parent.tracestate_dict[constants.TRACESTATE.SAMPLE_RATE] == "0.25"
+    assert elasticapm_client.events[constants.TRANSACTION][0]["sample_rate"] == 0.25
+
+    with mock.patch.object(elasticapm_client.tracer.adaptive_sampler, "sample", return_value=(False, 0.25)) as sample:
+        transaction = elasticapm_client.begin_transaction("request")
+        elasticapm_client.end_transaction("GET /")
+    sample.assert_called_once_with("request", 5)
+    assert not transaction.is_sampled
+    assert transaction.trace_parent.tracestate_dict[constants.TRACESTATE.SAMPLE_RATE] == "0"
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        ("/users/42/orders", "/users/*/orders"),
+        ("/items/3f2a9c1e-8b7d-4a5b-9c1d-1234567890ab", "/items/*"),
+        ("/api/v1/users", "/api/v1/users"),
+        ("/static/app.js", "/static/app.js"),
+        ("/", "/"),
+    ],
+)
+def test_normalize_url_path(path, expected):
+    assert normalize_url_path(path) == expected
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"transaction_sample_target": 5}], indirect=True)
+def test_transaction_sample_target_keys_unnamed_requests_by_url(elasticapm_client):
+    with mock.patch.object(elasticapm_client.tracer.adaptive_sampler, "sample", return_value=(True, 1.0)) as sample:
+        elasticapm_client.begin_transaction("request", url="/users/42")
+        elasticapm_client.end_transaction("GET /users/{id}")
+        elasticapm_client.begin_transaction("request", url="/users/43")
+        elasticapm_client.end_transaction("GET /users/{id}")
+        elasticapm_client.begin_transaction("request", url="/health")
+        elasticapm_client.end_transaction("GET /health")
+    assert sample.call_args_list == [
+        mock.call("request /users/*", 5),
+        mock.call("request /users/*", 5),
+        mock.call("request /health", 5),
+    ]
@@ -27,6 +27,7 @@
 #  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
 #  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import mock
 import pytest
 
 import elasticapm
@@ -164,3 +165,146 @@ def test_transaction_cancelled_span(elasticapm_client):
     assert len(spans) == 0
     assert transaction["span_count"]["started"] == 0
     assert transaction["span_count"]["dropped"] == 0
+
+
+def test_spans_shed_when_event_queue_fills_up(elasticapm_client):
+    transport = elasticapm_client._transport
+    elasticapm_client.begin_transaction("test_type")
+    with elasticapm.capture_span("sent"):
+        pass
+    with mock.patch.object(transport, "_queue_fill_ratio", return_value=0.85):
+        for i in range(3):
+            with elasticapm.capture_span("shed"):
+                pass
+        transaction_obj = elasticapm_client.end_transaction("test")
+
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    spans = elasticapm_client.events[constants.SPAN]
+    assert [span["name"] for span in spans] == ["sent"]
+    assert transaction_obj.dropped_spans == 3
+    assert transaction["span_count"]["dropped"] == 3
+    assert transport.dropped_counts == {constants.SPAN: 3}
+
+
+def _end_window(transaction):
+    transaction._window_start_ns -= transaction._window_ns
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client", [{"transaction_max_spans": 2, "transaction_max_spans_window": "10s"}], indirect=True
+)
+def test_transaction_max_spans_window(elasticapm_client):
+    transaction_obj = elasticapm_client.begin_transaction("test_type")
+    elasticapm.set_transaction_name("long")
+    for i in range(3):
+        with elasticapm.capture_span("first"):
+            pass
+    _end_window(transaction_obj)
+    for i in range(3):
+        with elasticapm.capture_span("second"):
+            pass
+    metricset = elasticapm_client.metrics.get_metricset(
+        "elasticapm.metrics.sets.long_transaction.LongTransactionMetricSet"
+    )
+    labels = {"transaction.name": "long", "transaction.type": "test_type"}
+    assert metricset.counter("transaction.long.span.started", **labels).val == 2
+    assert metricset.counter("transaction.long.span.dropped", **labels).val == 1
+    assert metricset.gauge("transaction.long.duration.max.us", **labels).val > 0
+    elasticapm_client.end_transaction("long")
+
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    spans = elasticapm_client.events[constants.SPAN]
+    assert [span["name"] for span in spans] == ["first", "first", "second", "second"]
+    assert transaction["span_count"] == {"dropped": 2, "started": 4}
+    # the last window is reported when the transaction ends
+    assert metricset.counter("transaction.long.span.started", **labels).val == 4
+    assert metricset.counter("transaction.long.span.dropped", **labels).val == 2
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [
+        {
+            "transaction_max_spans": 2,
+            "transaction_max_spans_window": "10s",
+            "span_compression_enabled": True,
+            "span_compression_exact_match_max_duration": "5ms",
+        }
+    ],
+    indirect=True,
+)
+def test_transaction_max_spans_window_reports_compressed_spans(elasticapm_client):
+    transaction_obj = elasticapm_client.begin_transaction("test_type")
+    elasticapm.set_transaction_name("long")
+    for i in range(5):
+        with elasticapm.capture_span(
+            "SELECT",
+            span_type="db",
+            span_subtype="mysql",
+            leaf=True,
+            duration=0.001,
+            extra={"destination": {"service": {"resource": "x"}}},
+        ):
+            pass
+    assert not elasticapm_client.events[constants.SPAN]
+    _end_window(transaction_obj)
+    with elasticapm.capture_span("second"):
+        pass
+    # the composite span held back for compression is reported when a new window starts
+    spans = elasticapm_client.events[constants.SPAN]
+    assert spans[0]["composite"]["count"] == 5
+    elasticapm_client.end_transaction("long")
+    assert elasticapm_client.events[constants.TRANSACTION][0]["span_count"] == {"dropped": 0, "started": 2}
+    metricset = elasticapm_client.metrics.get_metricset(
+        "elasticapm.metrics.sets.long_transaction.LongTransactionMetricSet"
+    )
+    labels = {"transaction.name": "long", "transaction.type": "test_type"}
+    # compressed spans count as started
+    assert metricset.counter("transaction.long.span.started", **labels).val == 6
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [
+        {
+            "transaction_max_spans_window": "10s",
+            "span_compression_enabled": True,
+            "span_compression_exact_match_max_duration": "5ms",
+        }
+    ],
+    indirect=True,
+)
+def test_transaction_max_spans_window_spans_compressed_in_later_window(elasticapm_client):
+    transaction_obj = elasticapm_client.begin_transaction("test_type")
+    elasticapm.set_transaction_name("long")
+    spans = [
+        transaction_obj.begin_span(
+            "SELECT",
+            "db",
+            span_subtype="mysql",
+            leaf=True,
+            context={"destination": {"service": {"resource": "x"}}},
+            auto_activate=False,
+        )
+        for i in range(2)
+    ]
+    _end_window(transaction_obj)
+    with elasticapm.capture_span("second"):
+        pass
+    for span in spans:
+        span.end(duration=0.001)
+    elasticapm_client.end_transaction("long")
+    metricset = elasticapm_client.metrics.get_metricset(
+        "elasticapm.metrics.sets.long_transaction.LongTransactionMetricSet"
+    )
+    labels = {"transaction.name": "long", "transaction.type": "test_type"}
+    # the compression in the second window doesn't take back spans started in the first one
+    assert metricset.counter("transaction.long.span.started", **labels).val == 3
+
+
+def test_transaction_max_spans_window_disabled(elasticapm_client):
+    transaction_obj = elasticapm_client.begin_transaction("test_type")
+    assert not transaction_obj._window_ns
+    elasticapm_client.end_transaction("test")
+    with pytest.raises(LookupError):
+        elasticapm_client.metrics.get_metricset("elasticapm.metrics.sets.long_transaction.LongTransactionMetricSet")
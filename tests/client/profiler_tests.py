@@ -0,0 +1,183 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+import mock
+import pytest
+
+from elasticapm.conf import constants
+from elasticapm.profiler import TransactionProfile
+from elasticapm.traces import Transaction
+
+PROFILER_CONFIG = {
+    "profiling_inferred_spans_enabled": True,
+    # samples are taken by the tests, not by the profiler thread
+    "profiling_inferred_spans_sampling_interval": "100s",
+}
+
+
+def outer(profiler, samples=3):
+    return inner(profiler, samples)
+
+
+def inner(profiler, samples):
+    for _ in range(samples):
+        profiler.sample()
+        time.sleep(0.001)
+
+
+def other(profiler):
+    profiler.sample()
+    time.sleep(0.001)
+
+
+def test_transaction_profile_merges_consecutive_samples():
+    profile = TransactionProfile(None, 1, ())
+    a, b, c = outer.__code__, inner.__code__, other.__code__
+    profile.add_sample([a, b], 1)
+    profile.add_sample([a, b], 2)
+    profile.add_sample([a, c], 3)
+    profile.add_sample([a], 4)
+    calls = {(node.code, node.start_ns, node.last_seen_ns) for node in profile.finish()}
+    assert calls == {(a, 1, 4), (b, 1, 2), (c, 3, 3)}
+
+
+@pytest.mark.parametrize("elasticapm_client", [PROFILER_CONFIG], indirect=True)
+def test_inferred_spans(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    elasticapm_client.begin_transaction("test")
+    outer(profiler)
+    other(profiler)
+    elasticapm_client.end_transaction("test")
+    profiler.sample()
+
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    spans = {span["name"]: span for span in elasticapm_client.events[constants.SPAN]}
+    assert set(spans) == {__name__ + ".outer", __name__ + ".inner"}
+    assert spans[__name__ + ".outer"]["type"] == "app"
+    assert spans[__name__ + ".outer"]["subtype"] == "inferred"
+    assert spans[__name__ + ".outer"]["parent_id"] == transaction["id"]
+    assert spans[__name__ + ".inner"]["parent_id"] == spans[__name__ + ".outer"]["id"]
+    assert spans[__name__ + ".outer"]["duration"] >= spans[__name__ + ".inner"]["duration"] > 0
+    assert not profiler._profiles
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [dict(PROFILER_CONFIG, profiling_inferred_spans_min_duration="10s")],
+    indirect=True,
+)
+def test_inferred_spans_min_duration(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    elasticapm_client.begin_transaction("test")
+    outer(profiler)
+    elasticapm_client.end_transaction("test")
+    profiler.sample()
+    assert not elasticapm_client.events[constants.SPAN]
+
+
+@pytest.mark.parametrize("elasticapm_client", [PROFILER_CONFIG], indirect=True)
+def test_inferred_spans_not_sampled(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    elasticapm_client.config.update(version="1", transaction_sample_rate=0.0)
+    elasticapm_client.begin_transaction("test")
+    assert not profiler._profiles
+    outer(profiler)
+    elasticapm_client.end_transaction("test")
+    profiler.sample()
+    assert not elasticapm_client.events[constants.SPAN]
+
+
+@pytest.mark.parametrize("elasticapm_client", [PROFILER_CONFIG], indirect=True)
+def test_inferred_spans_several_transactions_on_one_thread(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    first = elasticapm_client.begin_transaction("test")
+    second = elasticapm_client.begin_transaction("test")
+    outer(profiler)
+    second.end()
+    first.end()
+    profiler.sample()
+    assert not elasticapm_client.events[constants.SPAN]
+    assert not profiler._profiles
+
+
+@pytest.mark.parametrize("elasticapm_client", [PROFILER_CONFIG], indirect=True)
+def test_inferred_spans_paused_while_shedding(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    elasticapm_client.begin_transaction("test")
+    with mock.patch.object(elasticapm_client.tracer, "shed_event", return_value=True):
+        outer(profiler)
+    elasticapm_client.end_transaction("test")
+    profiler.sample()
+    assert not elasticapm_client.events[constants.SPAN]
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client", [dict(PROFILER_CONFIG, profiling_inferred_spans_max_overhead=1e-12)], indirect=True
+)
+def test_sampling_interval_stretched_to_overhead_budget(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    assert profiler.sample() > profiler.interval
+    elasticapm_client.config.update(version="1", profiling_inferred_spans_max_overhead=1.0)
+    assert profiler.sample() == profiler.interval
+
+
+@pytest.mark.parametrize("elasticapm_client", [PROFILER_CONFIG], indirect=True)
+def test_inferred_spans_are_ended_like_other_spans(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    transaction = elasticapm_client.begin_transaction("test")
+    outer(profiler)
+    elasticapm_client.end_transaction("test")
+    span_count = transaction._span_counter
+    with mock.patch.object(Transaction, "track_span_duration", autospec=True) as track_span_duration:
+        profiler.sample()
+    # the transaction has been reported already
+    assert transaction._span_counter == span_count
+    spans = {span["name"]: span for span in elasticapm_client.events[constants.SPAN]}
+    outer_duration = spans[__name__ + ".outer"]["duration"] * 1_000_000
+    inner_duration = spans[__name__ + ".inner"]["duration"] * 1_000_000
+    # the self time of the outer call doesn't include the inner call
+    self_times = [call.args[1:] for call in track_span_duration.call_args_list]
+    assert self_times == [
+        ("app", "inferred", pytest.approx(inner_duration, abs=1)),
+        ("app", "inferred", pytest.approx(outer_duration - inner_duration, abs=2)),
+    ]
+
+
+@pytest.mark.parametrize("elasticapm_client", [PROFILER_CONFIG], indirect=True)
+def test_samples_per_profile_are_limited(elasticapm_client):
+    profiler = elasticapm_client.tracer.profiler
+    transaction = elasticapm_client.begin_transaction("test")
+    profile = transaction._profile
+    with mock.patch.object(profiler, "max_samples", 2):
+        outer(profiler, samples=5)
+    assert profile.samples == 2
+    elasticapm_client.end_transaction("test")
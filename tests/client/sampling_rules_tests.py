@@ -0,0 +1,140 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+from elasticapm.conf import Config, constants
+from elasticapm.sampling import SamplingRules
+
+
+class FakeClock(object):
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sampling_rules_parsing():
+    config = Config(inline_dict={"transaction_sampling_rules": "/health*=0, GET /api/*=0.25,/search=10/s"})
+    assert not config.errors
+    assert config.transaction_sampling_rules == [
+        ("/health*", 0.0, None),
+        ("GET /api/*", 0.25, None),
+        ("/search", None, 10.0),
+    ]
+
+
+@pytest.mark.parametrize("rule", ["/health", "/health=2", "=0.5", "/search=many/s", "/search=-1/s"])
+def test_sampling_rules_invalid(rule):
+    config = Config(inline_dict={"transaction_sampling_rules": rule})
+    assert "TRANSACTION_SAMPLING_RULES" in config.errors
+
+
+def test_sampling_rules_first_match_wins():
+    rules = SamplingRules([("/api/health", 0.0, None), ("/api/*", 1.0, None), ("(?-i)/Case", 1.0, None)])
+    assert rules.match("/api/health") == 0
+    assert rules.match("/API/HEALTH") == 0
+    assert rules.match("/api/health/deep") == 1
+    assert rules.match("/case") is None
+    assert rules.match("/Case") == 2
+    assert rules.match("/other") is None
+    assert rules._cache["/api/health/deep"] == 1
+
+
+def test_sampling_rules_cache_is_bounded():
+    rules = SamplingRules([("/api/*", 1.0, None)])
+    rules.cache_size = 10
+    for i in range(25):
+        rules.match("/api/{}".format(i))
+    assert len(rules._cache) <= 10
+
+
+def test_sampling_rules_rate():
+    rules = SamplingRules([("/never", 0.0, None), ("/always", 1.0, None), ("/other", 0.123456, None)])
+    assert rules.sample("/never") == (False, 0.0)
+    assert rules.sample("/always") == (True, 1.0)
+    assert rules.sample("/other")[1] == 0.1235
+    assert rules.sample("/unknown") is None
+
+
+def test_sampling_rules_limit():
+    clock = FakeClock()
+    rules = SamplingRules([("/search", None, 5.0)], clock=clock)
+    clock.now = 1.0
+    decisions = [rules.sample("/search") for _ in range(20)]
+    assert [sampled for sampled, _ in decisions].count(True) == 5
+    assert decisions[-1] == (False, 0)
+    # the next second starts afresh, with the effective rate of the last second
+    clock.now = 2.0
+    assert rules.sample("/search") == (True, 0.25)
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"transaction_sampling_rules": ["/health=0", "/api/*=1"], "transaction_sample_rate": 0.0}],
+    indirect=True,
+)
+def test_sampling_rules_client(elasticapm_client):
+    transaction = elasticapm_client.begin_transaction("request", url="/health")
+    elasticapm_client.end_transaction("GET /health")
+    assert not transaction.is_sampled
+    assert transaction.trace_parent.tracestate_dict[constants.TRACESTATE.SAMPLE_RATE] == "0"
+
+    transaction = elasticapm_client.begin_transaction("request", url="/api/users")
+    elasticapm_client.end_transaction("GET /api/users")
+    assert transaction.is_sampled
+
+    # the name is matched if there is no url
+    transaction = elasticapm_client.begin_transaction("task", name="/api/task")
+    elasticapm_client.end_transaction()
+    assert transaction.is_sampled
+
+    # no rule matches, transaction_sample_rate applies
+    transaction = elasticapm_client.begin_transaction("request", url="/other")
+    elasticapm_client.end_transaction("GET /other")
+    assert not transaction.is_sampled
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"transaction_sampling_rules": ["/api/*=0"]}], indirect=True)
+def test_sampling_rules_dynamic_update(elasticapm_client):
+    transaction = elasticapm_client.begin_transaction("request", url="/api/users")
+    elasticapm_client.end_transaction("GET /api/users")
+    assert not transaction.is_sampled
+
+    elasticapm_client.config.update(version="1", transaction_sampling_rules="/api/*=1")
+    transaction = elasticapm_client.begin_transaction("request", url="/api/users")
+    elasticapm_client.end_transaction("GET /api/users")
+    assert transaction.is_sampled
+
+    elasticapm_client.config.reset()
+    transaction = elasticapm_client.begin_transaction("request", url="/api/users")
+    elasticapm_client.end_transaction("GET /api/users")
+    assert not transaction.is_sampled
@@ -338,3 +338,96 @@ def test_span_compression_disabled(elasticapm_client):
     assert len(spans) == 2
     span = spans[0]
     assert "composite" not in span
+
+
+def _exit_span(name, span_type, subtype, duration=0.001):
+    return elasticapm.capture_span(
+        name,
+        span_type=span_type,
+        span_subtype=subtype,
+        span_action="query",
+        leaf=True,
+        duration=duration,
+        extra={"destination": {"service": {"resource": subtype}}},
+    )
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [
+        {"span_compression_exact_match_max_duration": "5ms", "span_compression_window_size": 1},
+        {"span_compression_exact_match_max_duration": "5ms", "span_compression_window_size": 2},
+    ],
+    indirect=True,
+)
+def test_interleaved_spans(elasticapm_client):
+    elasticapm_client.begin_transaction("test")
+    for i in range(5):
+        with _exit_span("SELECT FROM users", "db", "postgresql"):
+            pass
+        with _exit_span("GET", "db", "redis"):
+            pass
+    elasticapm_client.end_transaction("test")
+    spans = elasticapm_client.events[SPAN]
+    transaction = elasticapm_client.events[TRANSACTION][0]
+    if elasticapm_client.config.span_compression_window_size == 1:
+        assert len(spans) == 10
+        assert transaction["span_count"]["started"] == 10
+    else:
+        assert [(span["name"], span["composite"]["count"]) for span in spans] == [
+            ("SELECT FROM users", 5),
+            ("GET", 5),
+        ]
+        assert spans[0]["timestamp"] < spans[1]["timestamp"]
+        assert transaction["span_count"]["started"] == 2
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"span_compression_exact_match_max_duration": "5ms", "span_compression_window_size": 2}],
+    indirect=True,
+)
+def test_compression_window_reports_oldest_span_when_full(elasticapm_client):
+    elasticapm_client.begin_transaction("test")
+    with _exit_span("SELECT", "db", "postgresql"):
+        pass
+    with _exit_span("GET", "db", "redis"):
+        pass
+    with _exit_span("find", "db", "mongodb"):
+        pass
+    spans = elasticapm_client.events[SPAN]
+    assert [span["name"] for span in spans] == ["SELECT"]
+    with _exit_span("GET", "db", "redis"):
+        pass
+    # spans that are too long for compression get their own slot
+    with _exit_span("GET", "db", "redis", duration=0.01):
+        pass
+    elasticapm_client.end_transaction("test")
+    spans = elasticapm_client.events[SPAN]
+    assert [(span["name"], span.get("composite", {}).get("count")) for span in spans] == [
+        ("SELECT", None),
+        ("GET", 2),
+        ("find", None),
+        ("GET", None),
+    ]
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"span_compression_exact_match_max_duration": "5ms", "span_compression_window_size": 3}],
+    indirect=True,
+)
+def test_compression_window_flushed_by_non_compressible_sibling(elasticapm_client):
+    elasticapm_client.begin_transaction("test")
+    with _exit_span("SELECT", "db", "postgresql"):
+        pass
+    with _exit_span("GET", "db", "redis"):
+        pass
+    with elasticapm.capture_span("render", span_type="template"):
+        pass
+    with _exit_span("SELECT", "db", "postgresql"):
+        pass
+    elasticapm_client.end_transaction("test")
+    spans = elasticapm_client.events[SPAN]
+    assert [span["name"] for span in spans] == ["SELECT", "GET", "render", "SELECT"]
+    assert not any("composite" in span for span in spans)
@@ -0,0 +1,142 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import elasticapm
+from elasticapm.conf import constants
+from elasticapm.sampling import LatencyWindow
+
+
+def _transaction_with_spans(client, count=3, outcome=None):
+    client.begin_transaction("test_type")
+    for i in range(count):
+        with elasticapm.capture_span(
+            "SELECT", span_type="db", span_subtype="mysql", extra={"destination": {"service": {"resource": "mysql"}}}
+        ):
+            pass
+    if outcome:
+        elasticapm.set_transaction_outcome(outcome)
+    return client.end_transaction("test")
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"tail_sampling": True, "tail_sampling_rate": 0, "tail_sampling_latency_percentile": 0}],
+    indirect=True,
+)
+def test_tail_sampling_discards_spans(elasticapm_client):
+    transaction_obj = _transaction_with_spans(elasticapm_client)
+    assert not elasticapm_client.events[constants.SPAN]
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    assert transaction["sampled"]
+    assert transaction["span_count"] == {"started": 0, "dropped": 3}
+    assert transaction["dropped_spans_stats"][0]["duration"]["count"] == 3
+    assert transaction_obj._tail_sampling_kept is False
+    assert elasticapm_client.tracer.tail_sampler.buffered == 0
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"tail_sampling": True, "tail_sampling_rate": 0, "tail_sampling_latency_percentile": 0}],
+    indirect=True,
+)
+def test_tail_sampling_keeps_failed_transactions(elasticapm_client):
+    _transaction_with_spans(elasticapm_client, outcome=constants.OUTCOME.FAILURE)
+    assert len(elasticapm_client.events[constants.SPAN]) == 3
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    assert transaction["span_count"] == {"started": 3, "dropped": 0}
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"tail_sampling": True, "tail_sampling_rate": 0, "tail_sampling_latency_percentile": 0}],
+    indirect=True,
+)
+def test_tail_sampling_keeps_transactions_with_errors(elasticapm_client):
+    elasticapm_client.begin_transaction("test_type")
+    with elasticapm.capture_span("test"):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            elasticapm_client.capture_exception()
+    elasticapm_client.end_transaction("test")
+    assert len(elasticapm_client.events[constants.SPAN]) == 1
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"tail_sampling": True, "tail_sampling_rate": 1.0, "tail_sampling_buffer_size": 2}],
+    indirect=True,
+)
+def test_tail_sampling_buffer_size(elasticapm_client):
+    _transaction_with_spans(elasticapm_client)
+    assert len(elasticapm_client.events[constants.SPAN]) == 2
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    assert transaction["span_count"] == {"started": 2, "dropped": 1}
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"tail_sampling": True, "tail_sampling_rate": 0, "tail_sampling_latency_percentile": 90}],
+    indirect=True,
+)
+def test_tail_sampling_keeps_slow_transactions(elasticapm_client):
+    for i in range(LatencyWindow.min_observations):
+        elasticapm_client.begin_transaction("test_type")
+        elasticapm_client.end_transaction("test", duration=0.01)
+    assert not elasticapm_client.events[constants.SPAN]
+    elasticapm_client.begin_transaction("test_type")
+    with elasticapm.capture_span("test"):
+        pass
+    elasticapm_client.end_transaction("test", duration=1)
+    assert len(elasticapm_client.events[constants.SPAN]) == 1
+
+
+def test_latency_window():
+    window = LatencyWindow(percentile=90)
+    for i in range(1, LatencyWindow.min_observations + 1):
+        assert not window.observe(i * 1000)
+    assert window.threshold == 19000
+    assert window.observe(20000)
+    assert not window.observe(10000)
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client",
+    [{"tail_sampling": True, "tail_sampling_rate": 0, "tail_sampling_latency_percentile": 0}],
+    indirect=True,
+)
+def test_tail_sampling_propagates_sampled_trace(elasticapm_client):
+    # the decision is only made once the transaction ends, downstream services record the trace
+    transaction = elasticapm_client.begin_transaction("test_type")
+    assert transaction.trace_parent.trace_options.recorded
+    assert transaction.trace_parent.tracestate_dict[constants.TRACESTATE.SAMPLE_RATE] == "1.0"
+    elasticapm_client.end_transaction("test")
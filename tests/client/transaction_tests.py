@@ -29,11 +29,13 @@
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import time
 from collections import defaultdict
+from datetime import timedelta
 
 import pytest
 
 import elasticapm
 from elasticapm.conf import constants
+from elasticapm.traces import duration_to_ns
 from elasticapm.utils import encoding
 from elasticapm.utils.disttracing import TraceParent
 
@@ -509,3 +511,30 @@ def test_transaction_trace_continuation_restart_external(elasticapm_client):
     transaction = elasticapm_client.events[constants.TRANSACTION][1]
     assert transaction["trace_id"] == tp.trace_id
     assert "links" not in transaction
+
+
+def test_duration_to_ns():
+    assert duration_to_ns(timedelta(days=1, seconds=2, microseconds=3)) == 86_402_000_003_000
+    assert duration_to_ns(0.0025) == 2_500_000
+    assert duration_to_ns(timedelta(seconds=-1)) == -1_000_000_000
+
+
+def test_duration_kept_in_ns(elasticapm_client):
+    transaction = elasticapm_client.begin_transaction("test")
+    with elasticapm.capture_span("test", duration=0.005) as span:
+        pass
+    elasticapm_client.end_transaction("test", "OK", duration=0.01)
+    assert span.duration_ns == 5_000_000
+    assert span.duration == timedelta(milliseconds=5)
+    assert transaction.duration_ns == 10_000_000
+    assert elasticapm_client.events[constants.SPAN][0]["duration"] == 5
+    assert elasticapm_client.events[constants.TRANSACTION][0]["duration"] == 10
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"exit_span_min_duration": "5ms"}], indirect=True)
+def test_duration_thresholds_converted_once_per_config_version(elasticapm_client):
+    thresholds = elasticapm_client.tracer.duration_thresholds
+    assert thresholds.exit_span_min == 5_000_000
+    assert elasticapm_client.tracer.duration_thresholds is thresholds
+    elasticapm_client.config.update(version="2", exit_span_min_duration="10ms")
+    assert elasticapm_client.tracer.duration_thresholds.exit_span_min == 10_000_000
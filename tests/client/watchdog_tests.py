@@ -0,0 +1,177 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import gc
+import threading
+import time
+
+import pytest
+
+import elasticapm
+from elasticapm.conf import constants
+from elasticapm.traces import execution_context
+
+WATCHDOG_CONFIG = {"slow_transaction_threshold": "20ms"}
+
+
+def stuck(event):
+    event.wait(5)
+
+
+def run_stuck_transaction(client, started, event):
+    client.begin_transaction("request")
+    elasticapm.set_transaction_name("GET /stuck")
+    started.set()
+    stuck(event)
+    client.end_transaction()
+
+
+def start_stuck_transaction(client):
+    started, event = threading.Event(), threading.Event()
+    thread = threading.Thread(target=run_stuck_transaction, args=(client, started, event))
+    thread.start()
+    started.wait(5)
+    return thread, event
+
+
+@pytest.mark.parametrize("elasticapm_client", [WATCHDOG_CONFIG], indirect=True)
+def test_watchdog_captures_stack_of_slow_transaction(elasticapm_client):
+    watchdog = elasticapm_client.tracer.watchdog
+    # checks are done by the test, not by the watchdog thread
+    watchdog.stop_thread()
+    thread, event = start_stuck_transaction(elasticapm_client)
+    try:
+        watchdog.check()
+        assert not elasticapm_client.events[constants.ERROR]
+        time.sleep(0.03)
+        watchdog.check()
+        watchdog.check()
+    finally:
+        event.set()
+        thread.join()
+    assert not watchdog._transactions
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    errors = elasticapm_client.events[constants.ERROR]
+    assert len(errors) == 1
+    error = errors[0]
+    assert error["transaction_id"] == transaction["id"]
+    assert error["log"]["message"].startswith("Transaction GET /stuck has been running for")
+    assert error["log"]["level"] == "warning"
+    functions = [frame["function"] for frame in error["log"]["stacktrace"]]
+    assert "stuck" in functions
+    assert "run_stuck_transaction" in functions
+
+
+@pytest.mark.parametrize("elasticapm_client", [dict(WATCHDOG_CONFIG, slow_transaction_max_snapshots=2)], indirect=True)
+def test_watchdog_takes_periodic_snapshots(elasticapm_client):
+    watchdog = elasticapm_client.tracer.watchdog
+    # checks are done by the test, not by the watchdog thread
+    watchdog.stop_thread()
+    thread, event = start_stuck_transaction(elasticapm_client)
+    try:
+        for _ in range(4):
+            time.sleep(0.025)
+            watchdog.check()
+    finally:
+        event.set()
+        thread.join()
+    assert len(elasticapm_client.events[constants.ERROR]) == 2
+
+
+@pytest.mark.parametrize("elasticapm_client", [WATCHDOG_CONFIG], indirect=True)
+def test_watchdog_skips_stack_of_shared_thread(elasticapm_client):
+    watchdog = elasticapm_client.tracer.watchdog
+    # checks are done by the test, not by the watchdog thread
+    watchdog.stop_thread()
+    # several transactions on one thread, like on an event loop
+    first = elasticapm_client.begin_transaction("request")
+    second = elasticapm_client.begin_transaction("request")
+    time.sleep(0.03)
+    watchdog.check()
+    execution_context.set_transaction(second)
+    elasticapm_client.end_transaction("second")
+    execution_context.set_transaction(first)
+    elasticapm_client.end_transaction("first")
+    errors = elasticapm_client.events[constants.ERROR]
+    assert len(errors) == 2
+    for error in errors:
+        assert "other transactions share its thread" in error["log"]["message"]
+        assert "stacktrace" not in error["log"]
+
+
+@pytest.mark.parametrize("elasticapm_client", [WATCHDOG_CONFIG], indirect=True)
+def test_watchdog_ignores_ended_transactions(elasticapm_client):
+    watchdog = elasticapm_client.tracer.watchdog
+    # checks are done by the test, not by the watchdog thread
+    watchdog.stop_thread()
+    elasticapm_client.begin_transaction("request")
+    assert len(watchdog._transactions) == 1
+    elasticapm_client.end_transaction("test")
+    time.sleep(0.03)
+    watchdog.check()
+    assert not watchdog._transactions
+    assert not elasticapm_client.events[constants.ERROR]
+
+
+def test_watchdog_disabled_by_default(elasticapm_client):
+    assert elasticapm_client.tracer.watchdog is None
+
+
+@pytest.mark.parametrize("elasticapm_client", [dict(WATCHDOG_CONFIG, slow_transaction_max_snapshots=2)], indirect=True)
+def test_watchdog_forgets_transactions_after_last_snapshot(elasticapm_client):
+    watchdog = elasticapm_client.tracer.watchdog
+    # checks are done by the test, not by the watchdog thread
+    watchdog.stop_thread()
+    thread, event = start_stuck_transaction(elasticapm_client)
+    try:
+        time.sleep(0.025)
+        watchdog.check()
+        assert len(watchdog._transactions) == 1
+        time.sleep(0.025)
+        watchdog.check()
+        assert not watchdog._transactions
+    finally:
+        event.set()
+        thread.join()
+    assert len(elasticapm_client.events[constants.ERROR]) == 2
+
+
+@pytest.mark.parametrize("elasticapm_client", [WATCHDOG_CONFIG], indirect=True)
+def test_watchdog_does_not_keep_abandoned_transactions_alive(elasticapm_client):
+    watchdog = elasticapm_client.tracer.watchdog
+    # checks are done by the test, not by the watchdog thread
+    watchdog.stop_thread()
+    transaction = elasticapm_client.begin_transaction("request")
+    assert len(watchdog._transactions) == 1
+    # the transaction is never ended
+    execution_context.get_transaction(clear=True)
+    del transaction
+    gc.collect()
+    assert not watchdog._transactions
@@ -47,6 +47,7 @@ from elasticapm.conf import (
     ExcludeRangeValidator,
     FileIsReadableValidator,
     PrecisionValidator,
+    RangeValidator,
     RegexValidator,
     SupportedValueInFipsModeValidator,
     UnitValidator,
@@ -494,6 +495,34 @@ def test_exclude_range_validator_not_in_range():
     assert "cannot be in range" in e.value.args[0]
 
 
+def test_range_validator():
+    validator = RangeValidator(min_value=0, max_value=1)
+    assert validator(0, "field") == 0
+    assert validator(1, "field") == 1
+    with pytest.raises(ConfigurationError) as e:
+        validator(-1, "field")
+    assert "field=-1 must be >= 0" == e.value.args[0]
+    with pytest.raises(ConfigurationError) as e:
+        validator(2, "field")
+    assert "field=2 must be <= 1" == e.value.args[0]
+    with pytest.raises(ConfigurationError) as e:
+        RangeValidator(min_value=0, min_exclusive=True)(0, "field")
+    assert "field=0 must be > 0" == e.value.args[0]
+
+
+def test_api_request_max_inflight_must_not_be_negative():
+    config = Config(inline_dict={"api_request_max_inflight": -1})
+    assert "API_REQUEST_MAX_INFLIGHT" in config.errors
+    assert config.api_request_max_inflight == 1
+
+
+@pytest.mark.parametrize("value", [0, -0.5, 1.5])
+def test_profiling_inferred_spans_max_overhead_must_be_in_range(value):
+    config = Config(inline_dict={"profiling_inferred_spans_max_overhead": value})
+    assert "PROFILING_INFERRED_SPANS_MAX_OVERHEAD" in config.errors
+    assert config.profiling_inferred_spans_max_overhead == 0.01
+
+
 def test_supported_value_in_fips_mode_validator_in_fips_mode_with_invalid_value(monkeypatch):
     monkeypatch.setattr(elasticapm.conf, "_in_fips_mode", lambda: True)
     exception_message = "VERIFY_SERVER_CERT=False must be set to True if FIPS mode is enabled"
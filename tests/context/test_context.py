@@ -63,3 +63,67 @@ def test_execution_context_monkeypatched(monkeypatch):
 
     # Should always use ThreadLocalContext when thread local is monkey patched
     assert isinstance(execution_context, ThreadLocalContext)
+
+
+@pytest.fixture(params=["threadlocal", "contextvars"])
+def context(request):
+    if request.param == "contextvars":
+        from elasticapm.context.contextvars import ContextVarsContext
+
+        context = ContextVarsContext()
+        token = context.elasticapm_spans_var.set(None)
+        yield context
+        context.elasticapm_spans_var.reset(token)
+    else:
+        context = ThreadLocalContext()
+        yield context
+        context.thread_local.spans = None
+
+
+def test_span_stack(context):
+    assert context.get_span() is None
+    assert context.unset_span() is None
+    for span in ("a", "b", "c"):
+        context.set_span(span)
+    assert context.get_span() == "c"
+    assert context.unset_span() == "c"
+    assert context.get_span() == "b"
+    context.set_span("d")
+    assert context.unset_span() == "d"
+    assert context.unset_span() == "b"
+    assert context.unset_span() == "a"
+    assert context.get_span() is None
+
+
+def test_span_stack_clear_all(context):
+    context.set_span("a")
+    context.set_span("b")
+    assert context.unset_span(clear_all=True) == "b"
+    assert context.get_span() is None
+
+
+def test_span_stack_is_not_shared_with_tasks():
+    import asyncio
+
+    from elasticapm.context.contextvars import ContextVarsContext
+
+    context = ContextVarsContext()
+
+    async def child(name):
+        # the task starts with a copy of the stack of its parent
+        assert context.get_span() == "parent"
+        context.set_span(name)
+        await asyncio.sleep(0)
+        assert context.get_span() == name
+        assert context.unset_span() == name
+        assert context.unset_span() == "parent"
+        assert context.get_span() is None
+
+    async def main():
+        context.set_span("parent")
+        await asyncio.gather(child("a"), child("b"))
+        # the tasks didn't modify the stack of the parent
+        assert context.get_span() == "parent"
+        assert context.unset_span() == "parent"
+
+    asyncio.run(main())
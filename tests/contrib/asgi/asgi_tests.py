@@ -32,6 +32,8 @@ import pytest  # isort:skip
 
 async_asgi_testclient = pytest.importorskip("async_asgi_testclient")  # isort:skip
 
+import mock
+
 from elasticapm.conf import constants
 from elasticapm.contrib.asgi import ASGITracingMiddleware
 from tests.contrib.asgi.app import app
@@ -66,6 +68,17 @@ async def test_transaction_span_success(instrumented_app, elasticapm_client):
     assert span["sync"] == False
 
 
+@pytest.mark.parametrize("elasticapm_client", [{"transaction_sample_target": 5}], indirect=True)
+@pytest.mark.asyncio
+async def test_transaction_sample_target_uses_url(instrumented_app, elasticapm_client):
+    sampler = elasticapm_client.tracer.adaptive_sampler
+    with mock.patch.object(sampler, "sample", wraps=sampler.sample) as sample:
+        async with async_asgi_testclient.TestClient(instrumented_app) as client:
+            resp = await client.get("/foo")
+            assert resp.status_code == 200
+    sample.assert_called_once_with("request /foo", 5)
+
+
 @pytest.mark.asyncio
 async def test_transaction_span_failure(instrumented_app, elasticapm_client):
     async with async_asgi_testclient.TestClient(instrumented_app) as client:
@@ -0,0 +1,149 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from elasticapm.conf import constants
+
+LOOP_MONITOR_CONFIG = {"event_loop_block_threshold": "50ms"}
+
+
+def blocking(seconds):
+    time.sleep(seconds)
+
+
+def test_loop_monitor_disabled_by_default(elasticapm_client):
+    assert elasticapm_client.loop_monitor is None
+
+
+@pytest.mark.parametrize("elasticapm_client", [LOOP_MONITOR_CONFIG], indirect=True)
+def test_loop_monitor_reports_blocked_loop_as_span(elasticapm_client):
+    monitor = elasticapm_client.loop_monitor
+    # checks are done by the test, not by the monitor thread
+    monitor.stop_thread()
+
+    async def main():
+        monitor.watch()
+        monitor.watch()
+        await asyncio.sleep(0.05)
+        elasticapm_client.begin_transaction("request")
+        timer = threading.Timer(0.15, monitor.check)
+        timer.start()
+        blocking(0.3)
+        timer.join()
+        await asyncio.sleep(0.05)
+        elasticapm_client.end_transaction("GET /blocking", "success")
+
+    asyncio.run(main())
+    assert len(monitor._loops) == 1
+    monitor.check()
+    assert not monitor._loops
+
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    spans = elasticapm_client.spans_for_transaction(transaction)
+    assert len(spans) == 1
+    span = spans[0]
+    assert span["name"] == "event loop blocked"
+    assert span["type"] == "app"
+    assert span["subtype"] == "internal"
+    assert span["action"] == "blocked"
+    assert span["duration"] >= 200
+    assert "blocking" in [frame["function"] for frame in span["stacktrace"]]
+    assert monitor.metrics.blocked.val >= 1
+    assert monitor.metrics.lag_max.val >= 0.2
+
+
+@pytest.mark.parametrize("elasticapm_client", [LOOP_MONITOR_CONFIG], indirect=True)
+def test_loop_monitor_reports_stall_of_transaction_ending_in_same_step(elasticapm_client):
+    monitor = elasticapm_client.loop_monitor
+    monitor.stop_thread()
+
+    async def main():
+        monitor.watch()
+        await asyncio.sleep(0.05)
+        elasticapm_client.begin_transaction("request")
+        timer = threading.Timer(0.15, monitor.check)
+        timer.start()
+        blocking(0.3)
+        timer.join()
+        # the transaction ends before the loop runs the next heartbeat
+        elasticapm_client.end_transaction("GET /blocking", "success")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    spans = elasticapm_client.spans_for_transaction(transaction)
+    assert [span["name"] for span in spans] == ["event loop blocked"]
+    assert spans[0]["duration"] >= 200
+
+
+@pytest.mark.parametrize("elasticapm_client", [LOOP_MONITOR_CONFIG], indirect=True)
+def test_loop_monitor_heartbeat_does_not_keep_request_context(elasticapm_client):
+    monitor = elasticapm_client.loop_monitor
+    monitor.stop_thread()
+    var = contextvars.ContextVar("request")
+    seen = []
+    heartbeat = monitor._heartbeat
+
+    def recording_heartbeat(state):
+        seen.append(var.get(None))
+        heartbeat(state)
+
+    monitor._heartbeat = recording_heartbeat
+
+    async def main():
+        var.set("first request")
+        monitor.watch()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert seen
+    assert set(seen) == {None}
+
+
+@pytest.mark.parametrize("elasticapm_client", [LOOP_MONITOR_CONFIG], indirect=True)
+def test_loop_monitor_records_lag_without_transaction(elasticapm_client):
+    monitor = elasticapm_client.loop_monitor
+    monitor.stop_thread()
+
+    async def main():
+        monitor.watch()
+        await asyncio.sleep(0.05)
+        blocking(0.1)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert not elasticapm_client.events[constants.SPAN]
+    assert monitor.metrics.blocked.val >= 1
@@ -388,6 +388,19 @@ def test_transaction_name_is_route_for_mounts(app, elasticapm_client):
     assert transaction["context"]["request"]["url"]["pathname"] == "/sub/subsub/hihi/shay"
 
 
+@pytest.mark.parametrize(
+    "elasticapm_client", [{"transaction_sample_rate": 0, "transaction_sampling_rules": "/api/*=1"}], indirect=True
+)
+def test_sampling_rules_match_root_path(app, elasticapm_client):
+    client = TestClient(app, root_path="/api")
+    response = client.get("/")
+    assert response.status_code == 200
+
+    assert len(elasticapm_client.events[constants.TRANSACTION]) == 1
+    transaction = elasticapm_client.events[constants.TRANSACTION][0]
+    assert transaction["sampled"] is True
+
+
 def test_undefined_route(app, elasticapm_client):
     client = TestClient(app)
 
@@ -28,8 +28,11 @@
 #  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import copy
 import decimal
 import logging
+import sys
+import threading
 import time
 from collections import defaultdict
 
@@ -39,7 +42,7 @@ import pytest
 import elasticapm
 from elasticapm.conf import Config, VersionedConfig
 from elasticapm.conf.constants import SPAN, TRANSACTION
-from elasticapm.traces import Tracer, capture_span, execution_context
+from elasticapm.traces import Tracer, Transaction, capture_span, execution_context
 from elasticapm.utils.disttracing import TraceParent
 from tests.utils import any_record_contains, assert_any_record_contains
 
@@ -370,6 +373,16 @@ def test_labels_merge(elasticapm_client):
     assert transactions[0]["context"]["tags"] == {"foo": 1, "bar": 3, "boo": "biz"}
 
 
+def test_labels_can_be_set_directly(elasticapm_client):
+    transaction = elasticapm_client.begin_transaction("test")
+    transaction.labels["foo"] = "bar"
+    with elasticapm.capture_span("test") as span:
+        span.labels["baz"] = "bazzinga"
+    elasticapm_client.end_transaction("test", "OK")
+    assert elasticapm_client.events[TRANSACTION][0]["context"]["tags"] == {"foo": "bar"}
+    assert elasticapm_client.events[SPAN][0]["context"]["tags"] == {"baz": "bazzinga"}
+
+
 def test_labels_dedot(elasticapm_client):
     elasticapm_client.begin_transaction("test")
     elasticapm.label(**{"d.o.t": "dot"})
@@ -558,3 +571,134 @@ def test_span_sync(elasticapm_client):
 
     assert spans[2]["name"] == "foo"
     assert spans[2]["sync"]
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"defer_span_serialization": True}], indirect=True)
+def test_span_serialization_deferred(elasticapm_client):
+    queued = []
+    with mock.patch.object(elasticapm_client.tracer, "queue_func", side_effect=lambda *args: queued.append(args[1])):
+        elasticapm_client.begin_transaction("test")
+        with capture_span("foo", "db", extra={"db": {"instance": "bar"}}, leaf=True):
+            pass
+        elasticapm_client.end_transaction("test", "OK")
+    span, transaction = queued
+    # the span object is queued and only serialized by the transport
+    assert isinstance(span, elasticapm.traces.Span)
+    assert isinstance(transaction, dict)
+    elasticapm_client._transport.queue(SPAN, span)
+    span = elasticapm_client.events[SPAN][0]
+    assert span["name"] == "foo"
+    assert span["transaction_id"] == transaction["id"]
+    assert span["context"]["destination"]["service"]["resource"] == "db/bar"
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"defer_span_serialization": True}], indirect=True)
+def test_span_serialization_deferred_does_not_modify_span(elasticapm_client):
+    elasticapm_client.server_version = (7, 15)
+    queued = []
+    with mock.patch.object(elasticapm_client.tracer, "queue_func", side_effect=lambda *args: queued.append(args[1])):
+        elasticapm_client.begin_transaction("test")
+        with capture_span("foo", "db", labels={"a": "b"}, extra={"otel_attributes": {"c": "d"}}, leaf=True):
+            pass
+        elasticapm_client.end_transaction("test", "OK")
+    span = queued[0]
+    context = copy.deepcopy(span.context)
+    assert span.to_dict()["context"]["tags"] == {"a": "b", "c": "d"}
+    assert span.context == context
+    assert span.labels == {"a": "b"}
+    assert span.to_dict()["context"]["tags"] == {"a": "b", "c": "d"}
+
+
+def test_span_ended_in_other_thread(elasticapm_client):
+    transaction = elasticapm_client.begin_transaction("test")
+    span = transaction.begin_span("foo", "custom", auto_activate=False)
+    thread = threading.Thread(target=span.end)
+    thread.start()
+    thread.join()
+    elasticapm_client.end_transaction("test", "OK")
+    assert transaction.child_durations_ns > 0
+    assert len(elasticapm_client.events[SPAN]) == 1
+
+
+def test_sibling_spans_ended_by_owner_and_other_thread(elasticapm_client):
+    queued = []
+    switch_interval = sys.getswitchinterval()
+    # switch threads often, to interrupt the bookkeeping of one thread by the other
+    sys.setswitchinterval(1e-5)
+    try:
+        with mock.patch.object(elasticapm_client.tracer, "queue_func", side_effect=lambda *args: queued.append(args)):
+            for _ in range(20):
+                transaction = elasticapm_client.begin_transaction("test")
+                spans = [
+                    transaction.begin_span("foo", "db", span_subtype="mysql", leaf=True, auto_activate=False)
+                    for _ in range(200)
+                ]
+                barrier = threading.Barrier(2)
+
+                def end(spans):
+                    barrier.wait()
+                    for span in spans:
+                        span.end()
+
+                thread = threading.Thread(target=end, args=(spans[1::2],))
+                thread.start()
+                end(spans[::2])
+                thread.join()
+                elasticapm_client.end_transaction("test", "OK")
+                assert transaction._child_durations._nesting_level == 0
+    finally:
+        sys.setswitchinterval(switch_interval)
+    # every span is reported exactly once, either on its own or compressed into a composite span
+    spans = [data for event_type, data in queued if event_type == SPAN]
+    assert sum(span["composite"]["count"] if "composite" in span else 1 for span in spans) == 20 * 200
+
+
+def test_bookkeeping_of_spans_ended_in_two_threads_does_not_overlap(elasticapm_client):
+    transaction = elasticapm_client.begin_transaction("test")
+    spans = [transaction.begin_span("foo", "custom", auto_activate=False) for _ in range(2)]
+    buffer_for_compression = Transaction._buffer_for_compression
+    updating = threading.Event()
+    running, overlaps = [], []
+
+    def slow_buffer_for_compression(self, child):
+        if running:
+            overlaps.append(child)
+        running.append(child)
+        if child is spans[0]:
+            updating.set()
+            # give the other thread time to start its update
+            time.sleep(0.1)
+        buffer_for_compression(self, child)
+        running.remove(child)
+
+    def end_in_other_thread():
+        updating.wait(5)
+        spans[1].end()
+
+    with mock.patch.object(Transaction, "_buffer_for_compression", slow_buffer_for_compression):
+        thread = threading.Thread(target=end_in_other_thread)
+        thread.start()
+        spans[0].end()
+        thread.join()
+    elasticapm_client.end_transaction("test", "OK")
+    assert not overlaps
+    assert len(elasticapm_client.events[SPAN]) == 2
+
+
+def test_spans_of_transaction_started_concurrently(elasticapm_client):
+    transaction = elasticapm_client.begin_transaction("test")
+    barrier = threading.Barrier(4)
+
+    def run():
+        barrier.wait()
+        for _ in range(100):
+            transaction.begin_span("foo", "custom", auto_activate=False).end()
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elasticapm_client.end_transaction("test", "OK")
+    assert transaction._child_durations._nesting_level == 0
+    assert len(elasticapm_client.events[SPAN]) == 400
@@ -0,0 +1,83 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"transport_metrics": True}], indirect=True)
+def test_transport_metrics(elasticapm_client):
+    transport = elasticapm_client._transport
+    metricset = elasticapm_client.metrics.get_metricset("elasticapm.metrics.sets.transport.TransportMetricSet")
+    transport._counts["span"] = 10
+    transport._dropped["span"] = 3
+    transport._processor_dropped["error"] = 1
+    transport._record_request(1000, 0.5)
+    transport._record_request(1000, 1.5, failed=True)
+    data = list(metricset.collect())
+    samples = {}
+    for item in data:
+        for name, sample in item["samples"].items():
+            samples[(name, item.get("tags", {}).get("reason"))] = sample["value"]
+    assert samples[("agent.events.total", None)] == 10
+    assert samples[("agent.events.dropped", "queue")] == 3
+    assert samples[("agent.events.dropped", "processor")] == 1
+    assert samples[("agent.events.requests.count", None)] == 2
+    assert samples[("agent.events.requests.failed", None)] == 1
+    assert samples[("agent.events.requests.bytes", None)] == 1000
+    assert samples[("agent.events.requests.duration.sum.us", None)] == 2000000
+    assert samples[("agent.events.requests.duration.count", None)] == 2
+
+    # counters are reported per collection interval
+    transport._counts["span"] = 15
+    data = list(metricset.collect())
+    samples = {name: sample["value"] for item in data if "tags" not in item for name, sample in item["samples"].items()}
+    assert samples["agent.events.total"] == 5
+    assert samples["agent.events.requests.count"] == 0
+    assert "agent.events.requests.duration.sum.us" not in samples
+
+
+def test_transport_metrics_disabled_by_default(elasticapm_client):
+    assert "elasticapm.metrics.sets.transport.TransportMetricSet" not in elasticapm_client.metrics._metricsets
+
+
+def test_get_transport_stats(sending_elasticapm_client):
+    for i in range(5):
+        sending_elasticapm_client.capture_message("foo %d" % i)
+    sending_elasticapm_client._transport.flush()
+    stats = sending_elasticapm_client.get_transport_stats()
+    assert stats["events"] == {"error": 5}
+    assert stats["dropped"] == {}
+    assert stats["queue"]["events"] == 0
+    assert stats["requests"]["count"] == 1
+    assert stats["requests"]["failed"] == 0
+    assert stats["requests"]["bytes"] > 0
+    assert stats["requests"]["duration"] > 0
+    assert 0 < stats["compression_ratio"] < 1
+    assert stats["backoff"] == {"active": False, "time": 0.0}
@@ -0,0 +1,225 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from elasticapm.transport.exceptions import TransportException
+from elasticapm.transport.http_asyncio import AsyncioTransport
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+@pytest.mark.asyncio
+async def test_send_on_event_loop(sending_elasticapm_client):
+    transport = sending_elasticapm_client._transport
+    assert isinstance(transport, AsyncioTransport)
+    for i in range(3):
+        sending_elasticapm_client.capture_message("foo %d" % i)
+    await transport.flush_async()
+    httpserver = sending_elasticapm_client.httpserver
+    assert len(httpserver.requests) == 1
+    assert httpserver.requests[0].args.get("flushed") == "true"
+    payload = httpserver.payloads[0]
+    assert "metadata" in payload[0]
+    assert [item["error"]["log"]["message"] for item in payload[1:]] == ["foo 0", "foo 1", "foo 2"]
+    assert transport._counts["error"] == 3
+    assert not any(thread.name == "eapm event processor thread" for thread in threading.enumerate())
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+@pytest.mark.asyncio
+async def test_events_from_other_threads_are_sent_on_event_loop(sending_elasticapm_client):
+    sending_elasticapm_client.capture_message("from the loop")
+    thread = threading.Thread(target=sending_elasticapm_client.capture_message, args=("from a thread",))
+    thread.start()
+    thread.join()
+    await sending_elasticapm_client._transport.flush_async()
+    payload = sending_elasticapm_client.httpserver.payloads[0]
+    assert {item["error"]["log"]["message"] for item in payload[1:]} == {"from the loop", "from a thread"}
+
+
+@pytest.mark.asyncio
+async def test_http_error_marks_transport_failed(waiting_httpserver, elasticapm_client):
+    elasticapm_client.server_version = (8, 0, 0)  # avoid making server_info request
+    waiting_httpserver.serve_content(code=418, content="I'm a teapot")
+    transport = AsyncioTransport(waiting_httpserver.url, client=elasticapm_client)
+    transport.start_thread()
+    transport.queue("error", {"id": "foo"})
+    await transport.flush_async()
+    assert transport.state.did_fail()
+    await transport.close_async()
+    assert transport._task.done()
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+def test_close_without_event_loop(sending_elasticapm_client):
+    sending_elasticapm_client.capture_message("foo")
+    assert sending_elasticapm_client._transport._loop is None
+    sending_elasticapm_client.close()
+    payload = sending_elasticapm_client.httpserver.payloads[0]
+    assert payload[1]["error"]["log"]["message"] == "foo"
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+@pytest.mark.asyncio
+async def test_flush_on_event_loop_before_first_event(sending_elasticapm_client):
+    transport = sending_elasticapm_client._transport
+    assert transport._loop is None
+    start = time.monotonic()
+    await asyncio.wait_for(transport.flush_async(), timeout=5)
+    assert time.monotonic() - start < transport._max_flush_time_seconds
+    assert transport._loop is asyncio.get_running_loop()
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+@pytest.mark.asyncio
+async def test_close_on_event_loop_before_first_event(sending_elasticapm_client):
+    thread = threading.Thread(target=sending_elasticapm_client.capture_message, args=("from a thread",))
+    thread.start()
+    thread.join()
+    transport = sending_elasticapm_client._transport
+    assert transport._loop is None
+    await asyncio.wait_for(transport.close_async(), timeout=5)
+    payload = sending_elasticapm_client.httpserver.payloads[0]
+    assert payload[1]["error"]["log"]["message"] == "from a thread"
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+def test_pending_events_are_limited(sending_elasticapm_client):
+    transport = sending_elasticapm_client._transport
+    with mock.patch("elasticapm.transport.http_asyncio.EVENT_QUEUE_SIZE", 2):
+        for i in range(3):
+            transport.queue("error", {"id": i})
+        assert len(transport._pending) == 2
+        assert transport._dropped["error"] == 1
+        assert transport._queue_fill_ratio() == 1.0
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+@pytest.mark.asyncio
+async def test_blocking_flush_on_event_loop(sending_elasticapm_client):
+    transport = sending_elasticapm_client._transport
+    sending_elasticapm_client.capture_message("foo")
+    # waiting for the loop would dead-lock, the events are sent right away instead
+    transport.flush()
+    payload = sending_elasticapm_client.httpserver.payloads[0]
+    assert payload[1]["error"]["log"]["message"] == "foo"
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+@pytest.mark.asyncio
+async def test_client_close_on_event_loop_sends_queued_events(sending_elasticapm_client):
+    sending_elasticapm_client.capture_message("foo")
+    assert sending_elasticapm_client._transport._loop is asyncio.get_running_loop()
+    sending_elasticapm_client.close()
+    payload = sending_elasticapm_client.httpserver.payloads[0]
+    assert payload[1]["error"]["log"]["message"] == "foo"
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http_asyncio.AsyncioTransport"}],
+    indirect=True,
+)
+def test_blocking_flush_waits_for_event_loop_of_other_thread(sending_elasticapm_client):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        asyncio.run_coroutine_threadsafe(_capture(sending_elasticapm_client, "on the loop"), loop).result(timeout=5)
+        transport = sending_elasticapm_client._transport
+        assert transport._loop is loop
+        sending_elasticapm_client.capture_message("from a thread")
+        transport.flush()
+        payload = sending_elasticapm_client.httpserver.payloads[0]
+        assert {item["error"]["log"]["message"] for item in payload[1:]} == {"on the loop", "from a thread"}
+        transport.close()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+async def _capture(client, message):
+    client.capture_message(message)
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_spooled(elasticapm_client, tmpdir):
+    elasticapm_client.config.update(version="1", transport_spool_dir=str(tmpdir))
+    elasticapm_client.server_version = (8, 0, 0)  # avoid making server_info request
+
+    def send(data, forced_flush=False):
+        raise TransportException("meh")
+
+    transport = AsyncioTransport("http://localhost:8200", client=elasticapm_client)
+    transport.send = send
+    transport.start_thread()
+    transport.queue("error", {"id": "foo"})
+    await transport.flush_async()
+    assert transport.state.did_fail()
+    assert transport._spool.pending()[0] == 1
+    await transport.close_async()
@@ -29,17 +29,22 @@
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import gzip
+import json
 import platform
+import queue as _queue
 import random
 import string
 import sys
+import threading
 import time
 import timeit
 
 import mock
 import pytest
 
-from elasticapm.transport.base import Transport, TransportState
+from elasticapm.conf import constants
+from elasticapm.processors import for_events
+from elasticapm.transport.base import ChilledQueue, EventStripes, Transport, TransportState, estimate_size
 from elasticapm.transport.exceptions import TransportException
 from tests.fixtures import DummyTransport, TempStoreClient
 from tests.utils import assert_any_record_contains
@@ -287,3 +292,323 @@ def test_flushed_arg_with_wait(sending_elasticapm_client):
     sending_elasticapm_client._transport.flush()
 
     assert sending_elasticapm_client.httpserver.requests[1].args["flushed"] == "true"
+
+
+def test_transport_spools_data_during_back_off(elasticapm_client, tmpdir):
+    elasticapm_client.config.update(version="1", transport_spool_dir=str(tmpdir))
+    sent = []
+    failing = [True]
+
+    def send(data, forced_flush=False):
+        if failing[0]:
+            raise TransportException("meh")
+        sent.append(gzip.decompress(bytes(data)).decode("utf-8").split("\n")[1])
+
+    transport = Transport(client=elasticapm_client)
+    transport.send = send
+    transport.start_thread()
+    try:
+        transport.queue("x", {"id": 1})
+        transport.flush()
+        assert transport.state.did_fail()
+        # the failed batch is spooled
+        assert transport._spool.pending()[0] == 1
+        transport.state.last_check = timeit.default_timer()
+        transport.state.retry_number = 2
+        transport.queue("x", {"id": 2})
+        transport.flush()
+        # the batch flushed during back-off is spooled without trying to send it
+        assert transport._spool.pending()[0] == 2
+
+        # recover, the spooled batches are sent after the new batch
+        failing[0] = False
+        transport.state.set_success()
+        transport.queue("x", {"id": 3})
+        transport.flush()
+        assert not transport.state.did_fail()
+        assert transport._spool.pending()[0] == 0
+        assert [json.loads(line)["x"]["id"] for line in sent] == [3, 1, 2]
+    finally:
+        transport.close()
+
+
+def test_transport_does_not_spool_rejected_data(elasticapm_client, tmpdir):
+    elasticapm_client.config.update(version="1", transport_spool_dir=str(tmpdir))
+
+    def send(data, forced_flush=False):
+        raise TransportException("HTTP 400: invalid event", status=400)
+
+    transport = Transport(client=elasticapm_client)
+    transport.send = send
+    transport.start_thread()
+    try:
+        transport.queue("x", {"id": 1})
+        transport.flush()
+        assert transport.state.did_fail()
+        assert transport._spool.pending()[0] == 0
+    finally:
+        transport.close()
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client", [{"api_request_max_inflight": 2, "api_request_size": "9b"}], indirect=True
+)
+def test_send_in_sender_threads(elasticapm_client):
+    sending_threads = []
+    release = threading.Event()
+
+    def send(data, forced_flush=False):
+        sending_threads.append(threading.current_thread().name)
+        release.wait(timeout=5)
+
+    transport = Transport(client=elasticapm_client, queue_chill_count=1)
+    transport.send = send
+    transport.start_thread()
+    try:
+        assert len(transport._sender_threads) == 2
+        transport.queue("x", {"a": "b" * 1000})
+        transport.queue("x", {"a": "b" * 1000})
+        # both requests are in flight, while the event processor thread is still consuming the queue
+        for _ in range(50):
+            if len(sending_threads) == 2:
+                break
+            time.sleep(0.01)
+        assert len(sending_threads) == 2
+        assert all(name.startswith("eapm event sender thread") for name in sending_threads)
+        release.set()
+        transport.flush()
+    finally:
+        transport.close()
+    assert not transport._sender_threads
+
+
+@mock.patch("elasticapm.transport.base.Transport.send")
+@pytest.mark.parametrize("elasticapm_client", [{"api_request_max_inflight": 0}], indirect=True)
+def test_send_in_event_processor_thread(mock_send, elasticapm_client):
+    transport = Transport(client=elasticapm_client)
+    transport.start_thread()
+    try:
+        assert transport._send_queue is None
+        transport.queue("x", {}, flush=True)
+    finally:
+        transport.close()
+    assert mock_send.call_count == 1
+
+
+@mock.patch("elasticapm.transport.base.Transport._flush")
+@pytest.mark.parametrize("elasticapm_client", [{"api_request_time": "5s"}], indirect=True)
+def test_events_from_many_threads_are_batched(mock_flush, elasticapm_client):
+    transport = Transport(client=elasticapm_client, queue_chill_count=10)
+    transport.start_thread()
+
+    def produce(thread_number):
+        for i in range(25):
+            transport.queue("error", {"id": "%d-%d" % (thread_number, i)})
+
+    with mock.patch.object(transport._event_queue, "put", wraps=transport._event_queue.put) as mock_put:
+        threads = [threading.Thread(target=produce, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 8 threads with 25 events each fill two batches of 10 per stripe, the rest stays in the stripes
+        assert mock_put.call_count == 16
+        assert all(call[0][0][0] == "batch" for call in mock_put.call_args_list)
+    transport.close()
+    assert transport._counts["error"] == 200
+
+
+@mock.patch("elasticapm.transport.base.Transport._flush")
+@pytest.mark.parametrize("elasticapm_client", [{"api_request_time": "5s"}], indirect=True)
+def test_stripes_are_drained_while_event_queue_is_busy(mock_flush, elasticapm_client):
+    transport = Transport(client=elasticapm_client, queue_chill_count=10, queue_chill_time=0.05)
+    transport.start_thread()
+    quiet = threading.Thread(target=transport.queue, args=("quiet", {}))
+    quiet.start()
+    quiet.join()
+    drained_under_load = False
+    deadline = time.time() + 2
+    # a busy thread hands over a full batch more often than the processor would time out waiting for events
+    while time.time() < deadline:
+        transport.queue("busy", {})
+        if transport._counts["quiet"]:
+            drained_under_load = True
+            break
+        time.sleep(0.001)
+    transport.close()
+    assert drained_under_load
+
+
+def test_events_of_batch_are_shed_by_priority(elasticapm_client):
+    transport = Transport(client=elasticapm_client, queue_chill_count=4)
+    transport.queue(constants.SPAN, {"id": 1})
+    transport.queue(constants.TRANSACTION, {"id": 2})
+    transport.queue(constants.SPAN, {"id": 3})
+    # the queue fills up past the watermark of spans before the batch is complete
+    transport._event_queue.put(("batch", [], False), weight=int(transport._event_queue.maxsize * 0.9))
+    transport.queue(constants.ERROR, {"id": 4})
+    item, weight, size = transport._event_queue.queue[-1]
+    assert item == ("batch", [(constants.TRANSACTION, {"id": 2}, False), (constants.ERROR, {"id": 4}, False)], False)
+    assert weight == 2
+    assert transport._dropped == {constants.SPAN: 2}
+
+
+def test_event_stripes_hand_off_full_batches():
+    stripes = EventStripes(stripes=2, batch_size=3)
+    assert stripes.append(1) is None
+    assert stripes.append(2) is None
+    assert stripes.append(3, size=5) == ([1, 2, 3], 5)
+    assert stripes.append(4, size=7) is None
+    assert stripes.bytes == 7
+    assert stripes.drain() == [4]
+    assert stripes.drain() == []
+    assert stripes.bytes == 0
+
+
+def test_chilled_queue_counts_weight():
+    queue = ChilledQueue(maxsize=10, chill_until=5)
+    queue.put("a", weight=9, size=100)
+    queue.put("b", size=20)
+    assert queue.qsize() == 10
+    assert queue.bytes == 120
+    with pytest.raises(_queue.Full):
+        queue.put("c", block=False)
+    assert queue.get() == "a"
+    assert queue.qsize() == 1
+    assert queue.bytes == 20
+
+
+@pytest.mark.parametrize(
+    "fill_ratio,dropped",
+    [
+        (0.5, []),
+        (0.85, ["span"]),
+        (0.92, ["span", "metricset"]),
+        (0.97, ["span", "metricset", "transaction"]),
+    ],
+)
+def test_shedding_priorities(fill_ratio, dropped, elasticapm_client):
+    transport = Transport(client=elasticapm_client)
+    with mock.patch.object(transport, "_queue_fill_ratio", return_value=fill_ratio):
+        for event_type in ("span", "metricset", "transaction", "error"):
+            transport.queue(event_type, {})
+    assert sorted(transport.dropped_counts) == sorted(dropped)
+
+
+def test_events_dropped_by_full_queue_are_counted(elasticapm_client):
+    transport = Transport(client=elasticapm_client, queue_chill_count=1)
+    with mock.patch.object(transport._event_queue, "put", side_effect=_queue.Full):
+        transport.queue("error", {})
+    assert transport.dropped_counts == {"error": 1}
+
+
+def test_estimate_size():
+    span = {
+        "name": "SELECT",
+        "context": {"db": {"statement": "x" * 10000}},
+        "stacktrace": [{"filename": "a" * 100}] * 50,
+    }
+    estimate = estimate_size(span)
+    assert 15000 < estimate < 20000
+    assert abs(estimate - len(json.dumps(span))) / len(json.dumps(span)) < 0.1
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"transport_memory_budget": "100kb"}], indirect=True)
+def test_memory_budget_sheds_events(elasticapm_client):
+    transport = Transport(client=elasticapm_client)
+    big_span = {"context": {"db": {"statement": "x" * 30 * 1024}}}
+    for i in range(4):
+        transport.queue("span", big_span)
+    # spans are shed from 80% of the budget on
+    assert transport.dropped_counts == {"span": 1}
+    transport.queue("transaction", {"id": "foo"})
+    transport.queue("error", {"id": "foo"})
+    assert transport.dropped_counts == {"span": 1}
+
+
+def test_transport_state_backoff_time():
+    state = TransportState()
+    with mock.patch("timeit.default_timer", return_value=10):
+        state.set_fail()
+    with mock.patch("timeit.default_timer", return_value=12):
+        state.set_fail()
+        assert state.backoff_time() == 2
+    with mock.patch("timeit.default_timer", return_value=15):
+        state.set_success()
+    with mock.patch("timeit.default_timer", return_value=20):
+        assert state.backoff_time() == 5
+
+
+def test_processor_chains_per_event_type(elasticapm_client):
+    def for_all(client, event):
+        return event
+
+    @for_events("error", "transaction")
+    def for_errors_and_transactions(client, event):
+        return event
+
+    transport = Transport(client=elasticapm_client, processors=[for_all, for_errors_and_transactions])
+    assert transport._processor_chain("span") == (for_all,)
+    assert transport._processor_chain("error") == (for_all, for_errors_and_transactions)
+    assert transport._processor_chain("custom") == (for_all,)
+
+
+def test_processor_chains_recompiled_on_config_change(elasticapm_client):
+    transport = Transport(client=elasticapm_client, processors=[])
+    chains = transport._processor_chains
+    assert transport._processor_chain("span") is chains["span"]
+    elasticapm_client.config.update(version="2", transaction_sample_rate=0.5)
+    transport._processor_chain("span")
+    assert transport._processor_chains is not chains
+    assert transport._processor_chains_version == "2"
+
+
+def test_metadata_written_as_precompressed_member(elasticapm_client):
+    transport = Transport(client=elasticapm_client, compress_level=6)
+    transport._metadata = {"service": {"name": "foo"}}
+    buffer = transport._init_buffer()
+    transport._write_metadata(buffer)
+    buffer.write(b'{"error": {}}\n')
+    fileobj = buffer.fileobj
+    buffer.close()
+    _, compressed = transport._encoded_metadata()
+    assert fileobj.getvalue().startswith(compressed)
+    data = gzip.decompress(fileobj.getvalue()).decode("utf-8").split("\n")
+    assert json.loads(data[0]) == {"metadata": {"service": {"name": "foo"}}}
+    assert json.loads(data[1]) == {"error": {}}
+
+
+def test_init_buffer_writes_gzip_header_right_away(elasticapm_client):
+    # _write_metadata relies on the header of a new buffer being written before any data
+    transport = Transport(client=elasticapm_client, compress_level=6)
+    buffer = transport._init_buffer()
+    assert buffer.size == 0
+    assert buffer.fileobj.getvalue()[:3] == b"\x1f\x8b\x08"
+
+
+def test_encoded_metadata_member_is_reproducible(elasticapm_client):
+    transport = Transport(client=elasticapm_client, compress_level=6)
+    compressed = transport._compress_member(b"foo")
+    # mtime is 0, so equal data is compressed to equal bytes
+    assert compressed[4:8] == b"\x00\x00\x00\x00"
+    assert compressed == transport._compress_member(b"foo")
+    assert gzip.decompress(compressed) == b"foo"
+
+
+def test_encoded_metadata_cached_until_changed(elasticapm_client):
+    serializer = mock.Mock(side_effect=json.dumps)
+    transport = Transport(client=elasticapm_client, json_serializer=serializer)
+    transport._metadata = {"service": {"name": "foo"}}
+    first = transport._encoded_metadata()
+    # an equal, newly built metadata dict doesn't need to be encoded again
+    transport._metadata = {"service": {"name": "foo"}}
+    assert transport._encoded_metadata() == first
+    assert serializer.call_count == 1
+    transport._metadata = {"service": {"name": "bar"}}
+    assert transport._encoded_metadata() != first
+    assert serializer.call_count == 2
+
+
+def test_estimate_size_of_unserialized_event():
+    span = mock.Mock(context={"db": {"statement": "x" * 10000}}, frames=None)
+    assert 10000 < estimate_size(span) < 11000
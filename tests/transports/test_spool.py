@@ -0,0 +1,168 @@
+#  BSD 3-Clause License
+#
+#  Copyright (c) 2019, Elasticsearch BV
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+
+import mock
+import pytest
+
+from elasticapm.transport.exceptions import TransportException
+from elasticapm.transport.spool import DiskSpool
+
+
+def test_spool_put_and_drain_in_order(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    for i in range(3):
+        assert spool.put(b"batch%d" % i)
+    assert spool.pending() == (3, 18)
+    send = mock.Mock()
+    assert spool.drain(send) == 3
+    assert [call[0][0] for call in send.call_args_list] == [b"batch0", b"batch1", b"batch2"]
+    assert spool.pending() == (0, 0)
+    assert spool.counts["spooled"] == 3
+    assert spool.counts["drained"] == 3
+
+
+def test_spool_drain_stops_at_failure(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    spool.put(b"batch0")
+    spool.put(b"batch1")
+    send = mock.Mock(side_effect=[None, ValueError("boom")])
+    with pytest.raises(ValueError):
+        spool.drain(send)
+    assert spool.pending() == (1, 6)
+    send = mock.Mock()
+    spool.drain(send)
+    send.assert_called_once_with(b"batch1")
+
+
+def test_spool_evicts_oldest_when_full(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=20, max_age=60)
+    for i in range(5):
+        spool.put(b"batch%d" % i)
+    assert spool.pending() == (3, 18)
+    assert spool.counts["evicted"] == 2
+    send = mock.Mock()
+    spool.drain(send)
+    assert [call[0][0] for call in send.call_args_list] == [b"batch2", b"batch3", b"batch4"]
+
+
+def test_spool_rejects_batch_larger_than_spool(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=4, max_age=60)
+    assert not spool.put(b"batch0")
+    assert spool.pending() == (0, 0)
+    assert spool.counts["evicted"] == 1
+
+
+def test_spool_evicts_by_age(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    spool.put(b"batch0")
+    spool.put(b"batch1")
+    old_path = sorted(os.listdir(str(tmpdir)))[0]
+    old = time.time() - 120
+    os.utime(os.path.join(str(tmpdir), old_path), (old, old))
+    send = mock.Mock()
+    spool.drain(send)
+    send.assert_called_once_with(b"batch1")
+    assert spool.counts["evicted"] == 1
+
+
+def test_spool_shared_between_instances(tmpdir):
+    spool1 = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    spool2 = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    spool1.put(b"batch0")
+    spool2.put(b"batch1")
+    send = mock.Mock()
+    assert spool2.drain(send) == 2
+    assert spool1.drain(send) == 0
+
+
+def test_spool_drops_rejected_batch(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    spool.put(b"batch0")
+    spool.put(b"batch1")
+    send = mock.Mock(side_effect=[TransportException("HTTP 400: invalid", status=400), None])
+    assert spool.drain(send) == 1
+    assert [call[0][0] for call in send.call_args_list] == [b"batch0", b"batch1"]
+    assert spool.pending() == (0, 0)
+    assert os.listdir(str(tmpdir)) == []
+    assert spool.counts["evicted"] == 1
+    assert spool.counts["evicted_bytes"] == 6
+
+
+@pytest.mark.parametrize("status", [None, 429, 503])
+def test_spool_keeps_batch_on_retryable_error(tmpdir, status):
+    spool = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    spool.put(b"batch0")
+    send = mock.Mock(side_effect=TransportException("meh", status=status))
+    with pytest.raises(TransportException):
+        spool.drain(send)
+    assert spool.pending() == (1, 6)
+    assert spool.counts["evicted"] == 0
+
+
+def test_spool_recovers_leftovers_of_crashed_process(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    spool.put(b"batch0")
+    spool.put(b"batch1")
+    claimed, unfinished = sorted(os.listdir(str(tmpdir)))
+    # the leftovers of a process that crashed while sending one batch and writing the other. Leftovers with
+    # the pid of the current process are from an earlier process, as this one didn't claim or write them.
+    os.rename(
+        os.path.join(str(tmpdir), claimed),
+        os.path.join(str(tmpdir), "%s.%d%s" % (claimed, os.getpid(), DiskSpool.inflight_suffix)),
+    )
+    os.rename(os.path.join(str(tmpdir), unfinished), os.path.join(str(tmpdir), unfinished + DiskSpool.tmp_suffix))
+    assert spool.pending() == (0, 0)
+
+    spool = DiskSpool(str(tmpdir), max_size=1024, max_age=60)
+    assert sorted(os.listdir(str(tmpdir))) == [claimed]
+    send = mock.Mock()
+    assert spool.drain(send) == 1
+    send.assert_called_once_with(b"batch0")
+
+
+def test_spool_counts_batches_of_running_processes_towards_size(tmpdir):
+    spool = DiskSpool(str(tmpdir), max_size=20, max_age=60)
+    spool.put(b"batch0")
+    (claimed,) = os.listdir(str(tmpdir))
+    # claimed by the parent process, which is still running
+    os.rename(
+        os.path.join(str(tmpdir), claimed),
+        os.path.join(str(tmpdir), "%s.%d%s" % (claimed, os.getppid(), DiskSpool.inflight_suffix)),
+    )
+    spool = DiskSpool(str(tmpdir), max_size=20, max_age=60)
+    spool.put(b"batch1")
+    spool.put(b"batch2")
+    spool.put(b"batch3")
+    # the claimed batch can't be evicted, but it leaves room for two batches only
+    assert spool.pending() == (2, 12)
+    assert spool.counts["evicted"] == 1
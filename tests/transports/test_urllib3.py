@@ -40,7 +40,7 @@ from urllib3.exceptions import MaxRetryError, TimeoutError
 
 from elasticapm.conf import constants
 from elasticapm.transport.exceptions import TransportException
-from elasticapm.transport.http import Transport, version_string_to_tuple
+from elasticapm.transport.http import StreamingRequestBody, StreamingTransport, Transport, version_string_to_tuple
 from tests.utils import assert_any_record_contains
 
 try:
@@ -622,3 +622,123 @@ def test_http_pool_manager_is_recycled_at_stop_thread(waiting_httpserver, caplog
     assert transport._flushed.is_set() is True
     assert pool_manager != transport._http
     assert not caplog.records
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client", [{"transport_class": "elasticapm.transport.http.StreamingTransport"}], indirect=True
+)
+def test_streaming_transport_sends_chunked_request(sending_elasticapm_client):
+    for i in range(10):
+        sending_elasticapm_client.capture_message("foo %d" % i)
+    sending_elasticapm_client.close()
+    httpserver = sending_elasticapm_client.httpserver
+    assert len(httpserver.requests) == 1
+    assert httpserver.requests[0].headers["Transfer-Encoding"] == "chunked"
+    payload = httpserver.payloads[0]
+    assert "metadata" in payload[0]
+    assert [item["error"]["log"]["message"] for item in payload[1:]] == ["foo %d" % i for i in range(10)]
+    assert httpserver.responses[0]["code"] == 202
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client", [{"transport_class": "elasticapm.transport.http.StreamingTransport"}], indirect=True
+)
+def test_streaming_transport_opens_request_before_batch_is_complete(sending_elasticapm_client):
+    transport = sending_elasticapm_client._transport
+    sending_elasticapm_client.capture_message("foo")
+    for _ in range(500):
+        if transport._streams:
+            break
+        time.sleep(0.01)
+    stream, _ = transport._streams[0]
+    assert stream.streaming
+    assert not stream.done.is_set()
+    sending_elasticapm_client.close()
+    assert stream.done.is_set()
+    assert len(sending_elasticapm_client.httpserver.requests) == 1
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client", [{"transport_class": "elasticapm.transport.http.StreamingTransport"}], indirect=True
+)
+def test_streaming_transport_buffers_during_back_off(sending_elasticapm_client):
+    transport = sending_elasticapm_client._transport
+    with mock.patch.object(transport.state, "should_try", return_value=False):
+        with mock.patch.object(transport, "_send_data", wraps=transport._send_data) as mock_send_data:
+            sending_elasticapm_client.capture_message("foo")
+            sending_elasticapm_client.close()
+    assert mock_send_data.call_count == 1
+    assert not sending_elasticapm_client.httpserver.requests
+
+
+def test_streaming_request_body_buffers_when_request_is_slow():
+    stream = StreamingRequestBody(max_chunks=2)
+    stream.write(b"header")
+    stream.start_streaming(timeout=0.01)
+    # nobody reads from the stream, the writer doesn't wait for the request
+    start = time.time()
+    for data in (b"x", b"y", b"z"):
+        stream.write(data)
+    assert time.time() - start < 0.01
+    assert stream.tell() == 9
+    stream.close()
+    assert list(stream) == [b"header", b"xyz"]
+
+
+def test_streaming_request_body_times_out_without_data():
+    stream = StreamingRequestBody()
+    stream.start_streaming(timeout=0.01)
+    with pytest.raises(TransportException):
+        list(stream)
+
+
+def test_streaming_request_body_keeps_copy():
+    stream = StreamingRequestBody(keep_copy=True)
+    stream.write(b"header")
+    stream.start_streaming()
+    stream.write(b"body")
+    # the request fails before the data is complete
+    assert not stream.abort()
+    stream.write(b"trailer")
+    assert stream.close()
+    assert bytes(stream.getbuffer()) == b"headerbodytrailer"
+
+
+def test_streaming_transport_spools_failed_stream(waiting_httpserver, elasticapm_client, tmpdir):
+    elasticapm_client.config.update(version="1", transport_spool_dir=str(tmpdir))
+    elasticapm_client.server_version = (8, 0, 0)  # avoid making server_info request
+    waiting_httpserver.serve_content(code=503, content="unavailable")
+    transport = StreamingTransport(waiting_httpserver.url, client=elasticapm_client)
+    transport.start_thread()
+    try:
+        transport.queue("error", {"id": "foo"})
+        transport.flush()
+        assert transport.state.did_fail()
+        assert transport._spool.pending()[0] == 1
+    finally:
+        transport.close()
+
+
+@pytest.mark.parametrize(
+    "sending_elasticapm_client",
+    [{"transport_class": "elasticapm.transport.http.StreamingTransport", "api_request_time": "50ms"}],
+    indirect=True,
+)
+def test_streaming_transport_joins_finished_streams(sending_elasticapm_client):
+    transport = sending_elasticapm_client._transport
+    sending_elasticapm_client.capture_message("foo")
+    for _ in range(500):
+        if transport._streams:
+            break
+        time.sleep(0.01)
+    first = transport._streams[0]
+    # the batch is completed once api_request_time is over
+    assert first[0].wait(5)
+    sending_elasticapm_client.capture_message("bar")
+    for _ in range(500):
+        if first not in transport._streams:
+            break
+        time.sleep(0.01)
+    assert first not in transport._streams
+    assert not first[1].is_alive()
+    sending_elasticapm_client.close()
@@ -33,7 +33,9 @@
 from __future__ import absolute_import
 
 import importlib
+import inspect
 import os
+import types
 
 import pytest
 from mock import Mock
@@ -170,6 +172,65 @@ def test_iter_stack_frames_max_frames_is_dynamic(elasticapm_client):
     assert len(span["stacktrace"]) == 5
 
 
+def test_get_stack_snapshot():
+    def get_me_a_snapshot(hide=False, **kwargs):
+        __traceback_hide__ = True
+        if not hide:
+            del __traceback_hide__
+        return stacks.get_stack_snapshot(**kwargs), inspect.currentframe()
+
+    snapshot, frame = get_me_a_snapshot()
+    assert all(len(item) == 3 for item in snapshot)
+    assert snapshot[0] == (frame.f_code, frame.f_lineno, frame.f_globals)
+    assert snapshot[1][0].co_name == "test_get_stack_snapshot"
+    frames = stacks.get_stack_info(stacks.iter_stack_snapshot(snapshot))
+    assert frames[0]["function"] == "get_me_a_snapshot"
+    assert frames[0]["module"] == __name__
+    assert frames[0]["lineno"] == snapshot[0][1]
+    assert "vars" not in stacks.get_stack_info(stacks.iter_stack_snapshot(snapshot), with_locals=False)[0]
+
+    snapshot, _ = get_me_a_snapshot(hide=True)
+    assert snapshot[0][0].co_name == "test_get_stack_snapshot"
+
+    snapshot, _ = get_me_a_snapshot(config=Mock(stack_trace_limit=2))
+    assert len(snapshot) == 2
+
+    snapshot, _ = get_me_a_snapshot(skip_top_modules=(__name__,))
+    assert snapshot[0][0].co_name != "get_me_a_snapshot"
+
+    snapshot, frame = get_me_a_snapshot(keep_frames_of=("get_me_a_snapshot",))
+    assert snapshot[0] == (frame, frame.f_lineno)
+    assert len(snapshot[1]) == 3
+
+
+@pytest.mark.parametrize(
+    "elasticapm_client,snapshot",
+    [
+        ({"span_stack_trace_min_duration": 0}, True),
+        ({"span_stack_trace_min_duration": 0, "collect_local_variables": "all"}, False),
+    ],
+    indirect=["elasticapm_client"],
+)
+def test_span_stack_snapshot(elasticapm_client, snapshot):
+    a_local_var = 42
+    elasticapm_client.begin_transaction("foo")
+    with elasticapm.capture_span("yay") as span:
+        assert all(isinstance(item[0], types.CodeType) == snapshot for item in span.frames)
+    elasticapm_client.end_transaction()
+    span = elasticapm_client.events[constants.SPAN][0]
+    assert span["stacktrace"][0]["function"] == "test_span_stack_snapshot"
+    assert ("vars" in span["stacktrace"][0]) != snapshot
+
+
+@pytest.mark.parametrize("elasticapm_client", [{"span_stack_trace_min_duration": -1}], indirect=True)
+def test_span_stack_not_captured_if_disabled(elasticapm_client):
+    elasticapm_client.begin_transaction("foo")
+    with elasticapm.capture_span("yay") as span:
+        assert span.frames is None
+    elasticapm_client.end_transaction()
+    assert "stacktrace" not in elasticapm_client.events[constants.SPAN][0]
+
+
 @pytest.mark.parametrize(
     "elasticapm_client", [{"include_paths": ("/a/b/c/*", "/c/d/*"), "exclude_paths": ("/c/*",)}], indirect=True
 )
@@ -191,6 +252,42 @@ def test_library_frames(elasticapm_client):
     assert info4["library_frame"]
 
 
+def test_get_frame_info_is_cached():
+    stacks.clear_frame_info_cache()
+    frame = get_me_a_test_frame()
+    frame_info = stacks.get_frame_info(frame, frame.f_lineno, with_locals=True, in_app_frame_context_lines=5)
+    frame_info["modified"] = True
+    cached_frame_info = stacks.get_frame_info(frame, frame.f_lineno, with_locals=False, in_app_frame_context_lines=5)
+    assert len(stacks._frame_info_cache) == 1
+    assert "modified" not in cached_frame_info
+    assert "vars" not in cached_frame_info
+    assert cached_frame_info["function"] == "get_me_a_test_frame"
+    assert cached_frame_info["context_metadata"] == frame_info["context_metadata"]
+
+    # different settings are cached separately
+    frame_info = stacks.get_frame_info(frame, frame.f_lineno, with_locals=False, in_app_frame_context_lines=0)
+    assert "context_metadata" not in frame_info
+    library_frame_info = stacks.get_frame_info(
+        frame, frame.f_lineno, with_locals=False, exclude_paths_re=stacks.get_path_regex(["*/tests/*"])
+    )
+    assert library_frame_info["library_frame"]
+    assert len(stacks._frame_info_cache) == 3
+
+
+def test_include_exclude_paths_change(elasticapm_client):
+    frame = get_me_a_test_frame()
+    frame_info = elasticapm_client._get_stack_info_for_trace([(frame, frame.f_lineno)])[0]
+    assert not frame_info["library_frame"]
+
+    elasticapm_client.config.update(version="1", include_paths="*/nothing/*", exclude_paths="*/tests/*")
+    frame_info = elasticapm_client._get_stack_info_for_trace([(frame, frame.f_lineno)])[0]
+    assert frame_info["library_frame"]
+
+    elasticapm_client.config.update(version="2", include_paths="*/tests/utils/*", exclude_paths="*/tests/*")
+    frame_info = elasticapm_client._get_stack_info_for_trace([(frame, frame.f_lineno)])[0]
+    assert not frame_info["library_frame"]
+
+
 def test_get_frame_info():
     frame = get_me_a_test_frame()
     frame_info = stacks.get_frame_info(